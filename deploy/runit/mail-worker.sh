@@ -0,0 +1,3 @@
+#!/bin/bash
+
+exec /code/deploy/runit/wait-for-it.sh redis:6379 -- /usr/bin/python3 /code/manage.py mail_worker
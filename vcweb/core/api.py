@@ -2,13 +2,15 @@ import logging
 
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import get_object_or_404
-from django.views.decorators.http import require_POST, require_GET
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_POST, require_GET
 
 from .decorators import group_required
 from .forms import ChatForm, ParticipantGroupIdForm
 from .http import JsonResponse, dumps
 from .models import (Experiment, RoundData, get_chat_message_parameter, ExperimentConfiguration, User, PermissionGroup,
-                     ParticipantGroupRelationship, ChatMessage)
+                     ParticipantGroupRelationship, ChatMessage, ReadyStatusPublisher, ForeignKeyValueResolver)
+from .view_models import StateVersion, invalidate_group_view_models
 
 logger = logging.getLogger(__name__)
 
@@ -93,20 +95,39 @@ def get_round_data(request):
     pk = request.GET.get('pk')
     round_data = get_object_or_404(RoundData.objects.select_related('experiment__experimenter'), pk=pk,
                                    experiment__experimenter=request.user.experimenter)
+    resolver = ForeignKeyValueResolver()
     group_data_values = [
         gdv.to_dict(cacheable=True)
-        for gdv in round_data.group_data_value_set.select_related('group', 'parameter').all()
-    ]
-    participant_data_values = [
-        pdv.to_dict(include_email=True, cacheable=True)
-        for pdv in round_data.get_participant_data_values(is_active=True).exclude(parameter=get_chat_message_parameter())
+        for gdv in resolver.resolve(round_data.group_data_value_set.select_related('group', 'parameter'))
     ]
+    pdvs = resolver.resolve(round_data.get_participant_data_values(is_active=True).select_related(
+        'target_data_value').exclude(parameter=get_chat_message_parameter()))
+    resolver.resolve(pdv.target_data_value for pdv in pdvs if pdv.target_data_value is not None)
+    participant_data_values = [pdv.to_dict(include_email=True, cacheable=True) for pdv in pdvs]
     return JsonResponse({
         'groupDataValues': group_data_values,
         'participantDataValues': participant_data_values
     })
 
 
+def experiment_model_etag(request):
+    pk = request.GET.get('pk')
+    if not pk or not pk.isdigit() or not Experiment.objects.filter(
+            pk=pk, experimenter__user=request.user).exists():
+        return None
+    return StateVersion(pk).get_etag(all_groups=True)
+
+
+@group_required(PermissionGroup.experimenter, PermissionGroup.demo_experimenter)
+@require_GET
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=experiment_model_etag)
+def get_experiment_model(request):
+    """ experimenter monitor view model, polled by the monitor page """
+    experiment = _get_experiment(request, request.GET.get('pk'))
+    return JsonResponse(experiment.to_dict(include_round_data=True))
+
+
 @login_required
 @require_POST
 def handle_chat_message(request, pk):
@@ -117,11 +138,13 @@ def handle_chat_message(request, pk):
         pgr = get_object_or_404(ParticipantGroupRelationship.objects.select_related('group'),
                                 pk=participant_group_id,
                                 participant=request.user.participant)
-        experiment = Experiment.objects.get(pk=pk)
+        experiment = Experiment.objects.select_related('experiment_metadata').get(pk=pk)
         current_round_data = experiment.current_round_data
         chat_message = ChatMessage.objects.create(participant_group_relationship=pgr,
                                                   string_value=message,
                                                   round_data=current_round_data)
+        # the chat message itself is pushed below, cached group view models only need to be recomputed on demand
+        invalidate_group_view_models(experiment, [pgr.group])
         chat_json = chat_message.to_json()
         experiment.notify_participants(chat_json, pgr.group, notify_experimenter=True)
         return JsonResponse(SUCCESS_DICT)
@@ -148,20 +171,21 @@ def participant_ready(request):
         pgr.set_participant_ready(round_data)
 
         logger.debug("handling participant ready event for experiment %s", experiment)
-        message = "Participant %s is ready." % request.user.participant
-
-        experiment.notify_participants(create_message_event(message, "participant_ready"), notify_experimenter=True)
-        if experiment.all_participants_ready:
-            experiment.notify_experimenter(create_message_event(
-                "All participants are ready to move on to the next round."))
-        return JsonResponse(_ready_participants_dict(experiment))
+        number_of_ready_participants = experiment.number_of_ready_participants
+        number_of_participants = experiment.number_of_participants
+        ReadyStatusPublisher(experiment, round_data).publish(number_of_ready_participants, number_of_participants)
+        return JsonResponse(_ready_participants_dict(experiment, number_of_ready_participants,
+                                                     number_of_participants))
     else:
         return JsonResponse({'success': False, 'message': "Invalid form"})
 
 
-def _ready_participants_dict(experiment):
-    number_of_ready_participants = experiment.number_of_ready_participants
-    all_participants_ready = (number_of_ready_participants == experiment.number_of_participants)
+def _ready_participants_dict(experiment, number_of_ready_participants=None, number_of_participants=None):
+    if number_of_ready_participants is None:
+        number_of_ready_participants = experiment.number_of_ready_participants
+    if number_of_participants is None:
+        number_of_participants = experiment.number_of_participants
+    all_participants_ready = (number_of_ready_participants == number_of_participants)
     return {
         'success': True,
         'number_of_ready_participants': number_of_ready_participants,
@@ -14,3 +14,7 @@ class VcwebCoreConfig(AppConfig):
     def ready(self):
         logger.debug("vcweb core initialized in %s mode, initializing mimetypes", settings.ENVIRONMENT)
         mimetypes.init()
+        from .view_models import connect_signals
+        connect_signals()
+        from .models import parameter_registry
+        parameter_registry.warm_up()
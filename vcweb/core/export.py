@@ -0,0 +1,669 @@
+"""
+Experiment data exporters and a Redis-backed job queue for running them outside of the web request.
+
+Export artifacts are written to settings.EXPORT_DIRECTORY under a content-addressed key derived from the exporter,
+the experiment pk, and a fingerprint of the experiment's data (see get_data_version) so that repeated downloads of
+an unchanged experiment can be served from disk, and are removed after settings.EXPORT_ARTIFACT_MAX_AGE. Jobs are
+queued in the Redis instance we already use for caching and pub/sub and executed by the `export_worker` management
+command; each worker claims jobs into its own processing list under a renewable lease.
+"""
+import hashlib
+import itertools
+import logging
+import os
+import tempfile
+import time
+import zipfile
+from collections import defaultdict
+
+import unicodecsv
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files import File
+from django.db.models import Case, Count, Max, Sum, When
+from django.utils.translation import ugettext_lazy as _
+from model_utils import Choices
+
+from .models import (ChatMessage, Experiment, ForeignKeyValueResolver, GroupClusterDataValue, GroupRelationship,
+                     GroupRoundDataValue, ParticipantExperimentRelationship, ParticipantGroupRelationship,
+                     ParticipantRoundDataValue, RoundData, get_model_fields)
+from .view_models import StateVersion
+from ..redis_pubsub import RedisPubSub, WorkerHeartbeat, get_worker_id
+
+logger = logging.getLogger(__name__)
+
+
+class Echo(object):
+
+    """ pseudo-buffer for csv writers that hands back each written row instead of buffering it """
+
+    def write(self, value):
+        return value
+
+
+class RoundDataCursor(object):
+
+    """
+    Walks a queryset ordered by round data in lockstep with an experiment's round data so that a single query can
+    serve every round without materializing its results.
+    """
+
+    def __init__(self, queryset):
+        self.iterator = queryset.iterator()
+        self.current = next(self.iterator, None)
+
+    def take(self, round_data):
+        while self.current is not None and self.current.round_data_id == round_data.pk:
+            yield self.current
+            self.current = next(self.iterator, None)
+
+
+# every data value query must walk round data in exactly the same order as ROUND_DATA_ORDERING
+ROUND_DATA_ORDERING = ['round_configuration', 'repeating_round_sequence_number', 'pk']
+DATA_VALUE_ROUND_ORDERING = ['round_data__round_configuration', 'round_data__repeating_round_sequence_number',
+                             'round_data_id']
+
+
+def get_round_data_set(experiment):
+    return experiment.round_data_set.select_related('round_configuration').order_by(*ROUND_DATA_ORDERING)
+
+
+def get_participant_data_values(experiment):
+    return ParticipantRoundDataValue.objects.select_related('participant_group_relationship', 'parameter').filter(
+        round_data__experiment=experiment).order_by(*DATA_VALUE_ROUND_ORDERING + [
+            '-date_created', 'participant_group_relationship', 'parameter'])
+
+
+def get_chat_messages(experiment):
+    return ChatMessage.objects.select_related('participant_group_relationship').filter(
+        round_data__experiment=experiment).order_by(*DATA_VALUE_ROUND_ORDERING + [
+            'participant_group_relationship__group', 'date_created'])
+
+
+def get_group_data_values(experiment):
+    return GroupRoundDataValue.objects.select_related('parameter').filter(
+        round_data__experiment=experiment).order_by(*DATA_VALUE_ROUND_ORDERING + ['group', 'parameter'])
+
+
+def get_group_cluster_data_values(experiment):
+    return GroupClusterDataValue.objects.select_related('parameter').filter(
+        round_data__experiment=experiment).order_by(*DATA_VALUE_ROUND_ORDERING + ['group_cluster', 'parameter'])
+
+
+def experiment_data_rows(experiment):
+    """
+    Generates CSV rows for all group membership, participant data values, chat messages, group data values, and
+    foreign key lookup tables in the given experiment. Issues a fixed number of queries regardless of the number of
+    rounds and streams data values from server-side cursors.
+    """
+    # header for group membership, session id, and base participant data
+    yield ['Group ID', 'Group Number', 'Group Cluster ID', 'Session ID', 'Participant ID', 'Participant Email']
+    group_to_cluster_dict = defaultdict(str)
+    group_relationships = GroupRelationship.objects.filter(cluster__experiment=experiment).order_by('cluster',
+                                                                                                    'date_created')
+    for group_pk, group_cluster_pk in group_relationships.values_list('group', 'cluster'):
+        group_to_cluster_dict[group_pk] = group_cluster_pk
+    pgrs = ParticipantGroupRelationship.objects.select_related('group', 'participant__user').filter(
+        group__experiment=experiment).order_by('group__pk', 'participant_number')
+    for pgr in pgrs.iterator():
+        group = pgr.group
+        yield [group.pk, group.number, group_to_cluster_dict[group.pk], group.session_id, pgr.pk,
+               pgr.participant.email]
+    # header for participant data values, chat messages, and per-group data ordered per-round
+    yield ['Round', 'Participant ID', 'Participant Number', 'Group ID', 'Parameter', 'Value',
+           'Creation Date', 'Creation Time', 'Last Modified Date', 'Last Modified Time']
+    participant_data_values = RoundDataCursor(get_participant_data_values(experiment))
+    chat_messages = RoundDataCursor(get_chat_messages(experiment))
+    group_data_values = RoundDataCursor(get_group_data_values(experiment))
+    lookup_table_parameters = set()
+    experimenter_email = experiment.experimenter.email
+    resolver = ForeignKeyValueResolver()
+    for round_data in get_round_data_set(experiment).iterator():
+        round_number = round_data.round_number
+        # emit experimenter notes
+        if round_data.experimenter_notes:
+            yield [round_number, experimenter_email, '', '', 'Experimenter Notes', round_data.experimenter_notes,
+                   '', '', '', '']
+        # emit all participant data values
+        for data_value in resolver.resolve(participant_data_values.take(round_data)):
+            pgr = data_value.participant_group_relationship
+            if data_value.parameter.is_foreign_key:
+                lookup_table_parameters.add(data_value.parameter)
+            dc = data_value.date_created
+            lm = data_value.last_modified
+            yield [round_number, pgr.pk, pgr.participant_number, pgr.group_id, data_value.parameter.label,
+                   data_value.value, dc.date(), dc.time(), lm.date(), lm.time()]
+        # emit all chat messages
+        for chat_message in chat_messages.take(round_data):
+            pgr = chat_message.participant_group_relationship
+            dc = chat_message.date_created
+            lm = chat_message.last_modified
+            yield [round_number, pgr.pk, pgr.participant_number, pgr.group_id, "Chat Message",
+                   chat_message.string_value, dc.date(), dc.time(), lm.date(), lm.time()]
+        # emit group round data values
+        for data_value in resolver.resolve(group_data_values.take(round_data)):
+            dc = data_value.date_created
+            lm = data_value.last_modified
+            yield [round_number, '', '', data_value.group_id, data_value.parameter.label,
+                   data_value.value, dc.date(), dc.time(), lm.date(), lm.time()]
+    if lookup_table_parameters:
+        yield ['Lookup Tables']
+        for ltp in lookup_table_parameters:
+            model = ltp.get_model_class()
+            # introspect on the model and emit all of its relevant fields
+            data_fields = get_model_fields(model)
+            yield list(itertools.chain(['Type', 'ID'], [f.verbose_name for f in data_fields]))
+            for obj in model.objects.order_by('pk').iterator():
+                yield list(itertools.chain([model.__name__, obj.pk], [getattr(obj, f.name) for f in data_fields]))
+
+
+def experiment_summary_rows(experiment):
+    """ Generates CSV rows for group membership and per-round data values and chat messages """
+    yield ['Group', 'Members']
+    for group in experiment.group_set.prefetch_related('participant_set'):
+        yield list(itertools.chain.from_iterable([[group], group.participant_set.all()]))
+    participant_data_values = RoundDataCursor(get_participant_data_values(experiment).select_related(
+        'participant_group_relationship__group', 'participant_group_relationship__participant__user'))
+    chat_messages = RoundDataCursor(get_chat_messages(experiment).select_related(
+        'participant_group_relationship__group', 'participant_group_relationship__participant__user'))
+    group_data_values = RoundDataCursor(get_group_data_values(experiment).select_related('group'))
+    resolver = ForeignKeyValueResolver()
+    for round_data in get_round_data_set(experiment).iterator():
+        round_configuration = round_data.round_configuration
+        # write out group-wide and participant data values
+        yield ['Owner', 'Round', 'Data Parameter', 'Data Parameter Value', 'Created On', 'Last Modified']
+        for data_value in resolver.resolve(itertools.chain(group_data_values.take(round_data),
+                                                           participant_data_values.take(round_data))):
+            yield [data_value.owner, round_configuration, data_value.parameter.label, data_value.value,
+                   data_value.date_created, data_value.last_modified]
+        # write out all chat messages as a side bar, sorted by group first, then time
+        chat_message_rows = ([chat_message.group, chat_message.participant, chat_message.message,
+                              chat_message.date_created, round_configuration]
+                             for chat_message in chat_messages.take(round_data))
+        first_row = next(chat_message_rows, None)
+        if first_row is not None:
+            yield ['Chat Messages']
+            yield ['Group', 'Participant', 'Message', 'Time', 'Round']
+            yield first_row
+            yield from chat_message_rows
+
+
+def participant_rows(experiment):
+    """ Generates CSV rows with login credentials for every participant registered in the given experiment """
+    yield ['Email', 'Password', 'URL']
+    full_participant_url = experiment.full_participant_url
+    authentication_code = experiment.authentication_code
+    for participant in experiment.participant_set.select_related('user').iterator():
+        yield [participant.email, authentication_code, full_participant_url]
+
+
+class Exporter(object):
+
+    """ A named export of an experiment's data into a single downloadable file """
+
+    def __init__(self, name, rows, file_name=None, file_ext='.csv', content_type='text/csv'):
+        self.name = name
+        self.rows = rows
+        self.file_ext = file_ext
+        self.content_type = content_type
+        self._file_name = file_name
+
+    def get_file_name(self, experiment):
+        if self._file_name is None:
+            return experiment.data_file_name(file_ext=self.file_ext)
+        return self._file_name(experiment)
+
+    def stream(self, experiment):
+        """ returns a generator of encoded CSV lines suitable for a StreamingHttpResponse """
+        writer = unicodecsv.writer(Echo(), encoding='utf-8')
+        return (writer.writerow(row) for row in self.rows(experiment))
+
+    def write(self, experiment, stream):
+        """ writes this export for the given experiment to a binary file-like object """
+        writer = unicodecsv.writer(stream, encoding='utf-8')
+        for row in self.rows(experiment):
+            writer.writerow(row)
+
+
+EXPORTERS = {}
+
+
+def register_exporter(exporter):
+    EXPORTERS[exporter.name] = exporter
+    return exporter
+
+
+def get_exporter(name):
+    """ raises KeyError for unregistered exporters """
+    return EXPORTERS[name]
+
+
+DATA_EXPORTER = register_exporter(Exporter('data', experiment_data_rows))
+SUMMARY_EXPORTER = register_exporter(Exporter('summary', experiment_summary_rows))
+PARTICIPANTS_EXPORTER = register_exporter(Exporter('participants', participant_rows,
+                                                   file_name=lambda experiment: 'participants.csv'))
+
+
+def get_pyarrow():
+    """ pyarrow is imported on demand since it is large and only needed for columnar exports """
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImproperlyConfigured("Columnar exports require pyarrow, install it with `pip install pyarrow`")
+    return pyarrow
+
+
+def get_round_numbers(experiment):
+    return {round_data.pk: str(round_data.round_number) for round_data in get_round_data_set(experiment)}
+
+
+VALUE_COLUMNS = [('parameter', 'string'), ('int_value', 'int64'), ('float_value', 'float64'),
+                 ('boolean_value', 'bool_'), ('string_value', 'string'), ('is_active', 'bool_'),
+                 ('date_created', 'timestamp'), ('last_modified', 'timestamp')]
+VALUE_FIELDS = ['parameter__name', 'int_value', 'float_value', 'boolean_value', 'string_value', 'is_active',
+                'date_created', 'last_modified']
+
+
+def participant_data_value_records(experiment):
+    round_numbers = get_round_numbers(experiment)
+    data_values = get_participant_data_values(experiment).values_list(
+        'round_data', 'participant_group_relationship', 'participant_group_relationship__participant_number',
+        'participant_group_relationship__group', *VALUE_FIELDS)
+    for record in data_values.iterator():
+        yield (round_numbers[record[0]],) + record
+
+
+def group_data_value_records(experiment):
+    round_numbers = get_round_numbers(experiment)
+    data_values = get_group_data_values(experiment).values_list('round_data', 'group', *VALUE_FIELDS)
+    for record in data_values.iterator():
+        yield (round_numbers[record[0]],) + record
+
+
+def group_cluster_data_value_records(experiment):
+    round_numbers = get_round_numbers(experiment)
+    data_values = get_group_cluster_data_values(experiment).values_list('round_data', 'group_cluster',
+                                                                        *VALUE_FIELDS)
+    for record in data_values.iterator():
+        yield (round_numbers[record[0]],) + record
+
+
+def chat_message_records(experiment):
+    round_numbers = get_round_numbers(experiment)
+    chat_messages = get_chat_messages(experiment).values_list(
+        'round_data', 'participant_group_relationship', 'participant_group_relationship__participant_number',
+        'participant_group_relationship__group', 'target_participant', 'string_value', 'date_created',
+        'last_modified')
+    for record in chat_messages.iterator():
+        yield (round_numbers[record[0]],) + record
+
+
+class ColumnarTable(object):
+
+    """ A typed table of experiment data written to a parquet file in fixed size record batches """
+
+    def __init__(self, name, columns, records):
+        self.name = name
+        self.columns = columns
+        self.records = records
+
+    @property
+    def file_name(self):
+        return self.name + '.parquet'
+
+    def get_schema(self, pa):
+        def get_type(type_name):
+            return pa.timestamp('us') if type_name == 'timestamp' else getattr(pa, type_name)()
+        return pa.schema([pa.field(name, get_type(type_name)) for name, type_name in self.columns])
+
+    def write(self, experiment, path, batch_size=None):
+        if batch_size is None:
+            batch_size = settings.EXPORT_BATCH_SIZE
+        pa = get_pyarrow()
+        schema = self.get_schema(pa)
+        writer = pa.parquet.ParquetWriter(path, schema)
+        try:
+            records = self.records(experiment)
+            batch = list(itertools.islice(records, batch_size))
+            while batch:
+                arrays = [pa.array(column, type=field.type) for column, field in zip(zip(*batch), schema)]
+                writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+                batch = list(itertools.islice(records, batch_size))
+        finally:
+            writer.close()
+        return path
+
+
+COLUMNAR_TABLES = (
+    ColumnarTable('participant_data_values',
+                  [('round_number', 'string'), ('round_data_id', 'int64'),
+                   ('participant_group_relationship_id', 'int64'), ('participant_number', 'int64'),
+                   ('group_id', 'int64')] + VALUE_COLUMNS,
+                  participant_data_value_records),
+    ColumnarTable('group_data_values',
+                  [('round_number', 'string'), ('round_data_id', 'int64'), ('group_id', 'int64')] + VALUE_COLUMNS,
+                  group_data_value_records),
+    ColumnarTable('group_cluster_data_values',
+                  [('round_number', 'string'), ('round_data_id', 'int64'), ('group_cluster_id', 'int64')] +
+                  VALUE_COLUMNS,
+                  group_cluster_data_value_records),
+    ColumnarTable('chat_messages',
+                  [('round_number', 'string'), ('round_data_id', 'int64'),
+                   ('participant_group_relationship_id', 'int64'), ('participant_number', 'int64'),
+                   ('group_id', 'int64'), ('target_participant_group_relationship_id', 'int64'),
+                   ('string_value', 'string'), ('date_created', 'timestamp'), ('last_modified', 'timestamp')],
+                  chat_message_records),
+)
+
+
+def write_columnar_tables(experiment, directory, batch_size=None):
+    """ writes one parquet file per columnar table into the given directory and returns their paths """
+    return [table.write(experiment, os.path.join(directory, table.file_name), batch_size=batch_size)
+            for table in COLUMNAR_TABLES]
+
+
+class ParquetExporter(Exporter):
+
+    """ Exports all columnar tables as parquet files bundled into a single zip archive """
+
+    def __init__(self, name, file_ext='.zip', content_type='application/zip', **kwargs):
+        super(ParquetExporter, self).__init__(name, rows=None, file_ext=file_ext, content_type=content_type,
+                                              **kwargs)
+
+    def write(self, experiment, stream):
+        with tempfile.TemporaryDirectory() as directory:
+            # parquet files are already compressed
+            with zipfile.ZipFile(stream, 'w', compression=zipfile.ZIP_STORED) as archive:
+                for path in write_columnar_tables(experiment, directory):
+                    archive.write(path, os.path.basename(path))
+
+    def stream(self, experiment):
+        # fail before the response starts rather than partway through it
+        get_pyarrow()
+        return self._stream(experiment)
+
+    def _stream(self, experiment):
+        with tempfile.TemporaryFile() as artifact:
+            self.write(experiment, artifact)
+            artifact.seek(0)
+            yield from File(artifact).chunks()
+
+
+PARQUET_EXPORTER = register_exporter(ParquetExporter('parquet'))
+
+
+def get_data_version(experiment):
+    """
+    Returns a fingerprint of everything the exporters read from the given experiment: the experiment's redis state
+    version, which is bumped by every saved or deleted row and by bulk updates (see
+    vcweb.core.view_models.data_values_updated), together with the most recent modification across the experiment
+    and its data values, participant registration and group membership, and the experimenter notes on each round.
+    The database fingerprint covers bulk_create()d rows, which send no signals, and a flushed or expired state
+    version only ever changes the key.
+    """
+    _, all_version, _, _ = StateVersion(experiment.pk).get()
+    timestamps = [experiment.last_modified]
+    for model in (ParticipantRoundDataValue, GroupRoundDataValue, GroupClusterDataValue):
+        timestamps.append(model.objects.filter(round_data__experiment=experiment).aggregate(
+            last_modified=Max('last_modified'))['last_modified'])
+    components = [all_version, max(t for t in timestamps if t is not None).isoformat()]
+    components.extend(sorted(ParticipantExperimentRelationship.objects.filter(experiment=experiment).aggregate(
+        count=Count('pk'), max_pk=Max('pk'), date_created=Max('date_created')).items()))
+    components.extend(sorted(ParticipantGroupRelationship.objects.filter(group__experiment=experiment).aggregate(
+        count=Count('pk'), max_pk=Max('pk'), date_created=Max('date_created'), groups=Sum('group'),
+        active=Count(Case(When(active=True, then=1)))).items()))
+    components.append(experiment.group_set.count())
+    notes = hashlib.sha1()
+    for pk, experimenter_notes in RoundData.objects.filter(experiment=experiment).exclude(
+            experimenter_notes='').order_by('pk').values_list('pk', 'experimenter_notes'):
+        notes.update("{0}:{1}\n".format(pk, experimenter_notes).encode('utf-8'))
+    components.append(notes.hexdigest())
+    return ':'.join(str(c) for c in components)
+
+
+def get_artifact_key(exporter, experiment):
+    data_version = get_data_version(experiment)
+    return hashlib.sha1("{0}:{1}:{2}".format(exporter.name, experiment.pk, data_version).encode(
+        'utf-8')).hexdigest()
+
+
+class ExportJob(object):
+
+    """
+    An export of a single experiment, identified by its content-addressed artifact key. Job state lives in a Redis
+    hash, artifacts on disk in settings.EXPORT_DIRECTORY.
+    """
+
+    Status = Choices(
+        ('QUEUED', _('Queued')),
+        ('RUNNING', _('Running')),
+        ('COMPLETE', _('Complete')),
+        ('FAILED', _('Failed')),
+    )
+
+    QUEUE = 'export.queue'
+    """ Redis list of artifact keys waiting for a worker """
+    PROCESSING = 'export.processing'
+    """ Prefix for each worker's Redis list of the artifact keys it has currently claimed """
+    WORKERS = 'export.workers'
+    """ Redis set of the ids of all workers that may have claimed jobs """
+
+    def __init__(self, key, exporter=None, experiment_pk=None):
+        self.key = key
+        self._exporter = exporter
+        self._experiment_pk = experiment_pk
+        self._properties = None
+
+    @staticmethod
+    def create(exporter, experiment):
+        return ExportJob(get_artifact_key(exporter, experiment), exporter=exporter, experiment_pk=experiment.pk)
+
+    @staticmethod
+    def redis():
+        return RedisPubSub.get_redis_instance()
+
+    @property
+    def redis_key(self):
+        return 'export.job.{0}'.format(self.key)
+
+    @property
+    def properties(self):
+        if self._properties is None:
+            self._properties = {k.decode('utf-8'): v.decode('utf-8')
+                                for k, v in self.redis().hgetall(self.redis_key).items()}
+        return self._properties
+
+    @property
+    def exists(self):
+        return self._exporter is not None or bool(self.properties)
+
+    @property
+    def exporter(self):
+        if self._exporter is None:
+            self._exporter = get_exporter(self.properties['exporter'])
+        return self._exporter
+
+    @property
+    def experiment_pk(self):
+        if self._experiment_pk is None:
+            self._experiment_pk = int(self.properties['experiment_pk'])
+        return self._experiment_pk
+
+    @property
+    def artifact_path(self):
+        return os.path.join(settings.EXPORT_DIRECTORY, self.key + self.exporter.file_ext)
+
+    @property
+    def has_artifact(self):
+        return os.path.exists(self.artifact_path)
+
+    def open_artifact(self):
+        """ returns the artifact opened for reading, or None if it does not exist or has expired and been removed """
+        try:
+            return open(self.artifact_path, 'rb')
+        except FileNotFoundError:
+            return None
+
+    @property
+    def status(self):
+        if self.has_artifact:
+            return ExportJob.Status.COMPLETE
+        return self.properties.get('status')
+
+    def enqueue(self):
+        """ queues this job unless its artifact already exists or it is already waiting for or claimed by a worker """
+        if self.has_artifact:
+            return False
+        r = self.redis()
+        status = r.hget(self.redis_key, 'status')
+        if status is not None and status.decode('utf-8') in (ExportJob.Status.QUEUED, ExportJob.Status.RUNNING):
+            return False
+        pipe = r.pipeline()
+        pipe.hset(self.redis_key, 'exporter', self.exporter.name)
+        pipe.hset(self.redis_key, 'experiment_pk', self.experiment_pk)
+        pipe.hset(self.redis_key, 'status', ExportJob.Status.QUEUED)
+        pipe.hset(self.redis_key, 'date_queued', time.time())
+        pipe.hdel(self.redis_key, 'error')
+        pipe.expire(self.redis_key, settings.EXPORT_JOB_TTL)
+        pipe.lpush(ExportJob.QUEUE, self.key)
+        pipe.execute()
+        self._properties = None
+        return True
+
+    def set_status(self, status, **kwargs):
+        pipe = self.redis().pipeline()
+        pipe.hset(self.redis_key, 'status', status)
+        for k, v in kwargs.items():
+            pipe.hset(self.redis_key, k, v)
+        pipe.expire(self.redis_key, settings.EXPORT_JOB_TTL)
+        pipe.execute()
+        self._properties = None
+
+    def run(self):
+        """
+        Writes the export artifact to a partial file and atomically moves it into place once complete, so that an
+        interrupted job leaves nothing behind and can simply be run again.
+        """
+        if self.has_artifact:
+            self.set_status(ExportJob.Status.COMPLETE)
+            return
+        self.set_status(ExportJob.Status.RUNNING, date_started=time.time())
+        # unique per run in case a worker whose lease expired is still running the same job
+        fd, partial_path = tempfile.mkstemp(prefix=self.key, suffix='.partial', dir=settings.EXPORT_DIRECTORY)
+        os.close(fd)
+        try:
+            experiment = Experiment.objects.select_related('experimenter__user').get(pk=self.experiment_pk)
+            with open(partial_path, 'wb') as artifact:
+                self.exporter.write(experiment, artifact)
+            os.replace(partial_path, self.artifact_path)
+            self.set_status(ExportJob.Status.COMPLETE, date_completed=time.time())
+        except Exception as e:
+            logger.exception("export job %s failed", self.key)
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            self.set_status(ExportJob.Status.FAILED, error=str(e))
+
+    def to_dict(self):
+        return {
+            'key': self.key,
+            'exporter': self.exporter.name,
+            'experimentId': self.experiment_pk,
+            'status': self.status,
+            'error': self.properties.get('error', ''),
+        }
+
+
+def get_processing_key(worker_id):
+    return '{0}.{1}'.format(ExportJob.PROCESSING, worker_id)
+
+
+def get_heartbeat_key(worker_id):
+    return 'export.worker.{0}'.format(worker_id)
+
+
+def requeue_orphaned_jobs():
+    """
+    moves jobs claimed by workers that exited, or stopped renewing their lease, before finishing them back onto the
+    queue. Jobs claimed by live workers are left alone.
+    """
+    r = ExportJob.redis()
+    number_requeued = 0
+    for worker_id in r.smembers(ExportJob.WORKERS):
+        worker_id = worker_id.decode('utf-8')
+        if r.exists(get_heartbeat_key(worker_id)):
+            continue
+        processing_key = get_processing_key(worker_id)
+        while r.rpoplpush(processing_key, ExportJob.QUEUE) is not None:
+            number_requeued += 1
+        r.srem(ExportJob.WORKERS, worker_id)
+    if number_requeued:
+        logger.warning("requeued %s orphaned export jobs", number_requeued)
+    return number_requeued
+
+
+def remove_expired_artifacts(max_age=None):
+    """
+    deletes export artifacts, and partial files abandoned by crashed workers, last modified more than max_age seconds
+    ago. Returns the number of files removed.
+    """
+    if max_age is None:
+        max_age = settings.EXPORT_ARTIFACT_MAX_AGE
+    cutoff = time.time() - max_age
+    number_removed = 0
+    for file_name in os.listdir(settings.EXPORT_DIRECTORY):
+        path = os.path.join(settings.EXPORT_DIRECTORY, file_name)
+        try:
+            if os.path.isfile(path) and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                number_removed += 1
+        except FileNotFoundError:
+            # removed concurrently by another worker
+            pass
+    if number_removed:
+        logger.debug("removed %s expired export artifacts", number_removed)
+    return number_removed
+
+
+def run_export_worker(burst=False, timeout=5, worker_id=None):
+    """
+    Executes queued export jobs until interrupted. In burst mode, returns as soon as the queue is empty and returns
+    the number of jobs that were run. Orphaned jobs are requeued and expired artifacts removed on startup and then
+    once per lease period.
+    """
+    if worker_id is None:
+        worker_id = get_worker_id()
+    r = ExportJob.redis()
+    processing_key = get_processing_key(worker_id)
+    heartbeat = WorkerHeartbeat(get_heartbeat_key(worker_id), settings.EXPORT_WORKER_HEARTBEAT_TTL,
+                                name='export-heartbeat')
+    heartbeat.beat()
+    r.sadd(ExportJob.WORKERS, worker_id)
+    heartbeat.start()
+    number_of_jobs = 0
+    last_maintenance = None
+    try:
+        while True:
+            if last_maintenance is None or time.time() - last_maintenance > heartbeat.ttl:
+                requeue_orphaned_jobs()
+                remove_expired_artifacts()
+                last_maintenance = time.time()
+            key = r.brpoplpush(ExportJob.QUEUE, processing_key, timeout)
+            if key is None:
+                if burst:
+                    return number_of_jobs
+                continue
+            job = ExportJob(key.decode('utf-8'))
+            if job.exists:
+                logger.debug("running export job %s", job.key)
+                job.run()
+                number_of_jobs += 1
+            else:
+                logger.warning("discarding expired export job %s", job.key)
+            r.lrem(processing_key, 1, key)
+    finally:
+        heartbeat.stop()
+        # hand back anything still claimed, e.g. when interrupted mid-job
+        while r.rpoplpush(processing_key, ExportJob.QUEUE) is not None:
+            pass
+        r.srem(ExportJob.WORKERS, worker_id)
@@ -0,0 +1,339 @@
+"""
+Outbound email pipeline.
+
+Request and signal handlers hand their messages to `queue_messages`, which serializes them into a Redis list once the
+surrounding transaction commits. The `mail_worker` management command drains the queue in batches, each sent over a
+single connection to settings.EMAIL_BACKEND, throttled to settings.MAIL_RATE_LIMIT messages per second. Connections
+are opened per batch since mail servers drop idle connections between batches. Messages that
+fail to send are retried with exponential backoff and parked on a failed list after settings.MAIL_MAX_ATTEMPTS.
+Each worker claims messages into its own processing list under a renewable lease, so that only the messages of
+workers that died are requeued. Delivery counters are kept in a Redis hash, see `MailQueue.get_metrics`.
+
+When settings.MAIL_QUEUE_ENABLED is False, messages are sent synchronously as before. Use the locmem or file based
+django email backends to inspect delivered messages locally.
+"""
+import json
+import logging
+import smtplib
+import time
+
+from django.conf import settings
+from django.core import mail
+from django.core.mail import EmailMultiAlternatives
+from django.db import transaction
+
+from ..redis_pubsub import RedisPubSub, WorkerHeartbeat, get_worker_id
+
+logger = logging.getLogger(__name__)
+
+
+def serialize_message(message, attempts=0):
+    if message.attachments:
+        raise ValueError("Queued email messages with attachments are not supported: %s" % message.subject)
+    return json.dumps({
+        'subject': message.subject,
+        'body': message.body,
+        'from_email': message.from_email,
+        'to': message.to,
+        'cc': message.cc,
+        'bcc': message.bcc,
+        'reply_to': message.reply_to,
+        'headers': message.extra_headers,
+        'alternatives': getattr(message, 'alternatives', []),
+        'attempts': attempts,
+        'date_queued': time.time(),
+    })
+
+
+def deserialize_message(data):
+    """ returns an (EmailMultiAlternatives, number of previous delivery attempts) tuple """
+    properties = json.loads(data.decode('utf-8') if isinstance(data, bytes) else data)
+    message = EmailMultiAlternatives(subject=properties['subject'], body=properties['body'],
+                                     from_email=properties['from_email'], to=properties['to'], cc=properties['cc'],
+                                     bcc=properties['bcc'], reply_to=properties['reply_to'],
+                                     headers=properties['headers'])
+    for content, mimetype in properties['alternatives']:
+        message.attach_alternative(content, mimetype)
+    return message, properties['attempts']
+
+
+class RateLimiter(object):
+
+    """ spaces out calls to `wait` so that at most `rate` calls return per second, a rate of 0 disables limiting """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self.next_time = 0
+
+    def wait(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        if self.next_time > now:
+            time.sleep(self.next_time - now)
+        self.next_time = max(now, self.next_time) + self.interval
+
+
+class MailQueue(object):
+
+    """
+    Redis list of serialized messages waiting to be sent, a list per worker of the messages it claimed, a sorted set of
+    messages waiting to be retried scored by their retry time, a list of messages that could not be delivered, and a
+    hash of delivery counters. Workers register themselves in a set and hold a lease while they are alive.
+    """
+
+    def __init__(self, name='mail'):
+        self.name = name
+        self.queue_key = '{0}.queue'.format(name)
+        self.workers_key = '{0}.workers'.format(name)
+        self.retry_key = '{0}.retry'.format(name)
+        self.failed_key = '{0}.failed'.format(name)
+        self.metrics_key = '{0}.metrics'.format(name)
+
+    @staticmethod
+    def redis():
+        return RedisPubSub.get_redis_instance()
+
+    def get_processing_key(self, worker_id):
+        return '{0}.processing.{1}'.format(self.name, worker_id)
+
+    def get_heartbeat_key(self, worker_id):
+        return '{0}.worker.{1}'.format(self.name, worker_id)
+
+    def get_worker_ids(self):
+        return [worker_id.decode('utf-8') for worker_id in self.redis().smembers(self.workers_key)]
+
+    @property
+    def keys(self):
+        worker_ids = self.get_worker_ids()
+        return ((self.queue_key, self.workers_key, self.retry_key, self.failed_key, self.metrics_key) +
+                tuple(self.get_processing_key(worker_id) for worker_id in worker_ids) +
+                tuple(self.get_heartbeat_key(worker_id) for worker_id in worker_ids))
+
+    def push(self, messages):
+        serialized_messages = [serialize_message(message) for message in messages]
+        if not serialized_messages:
+            return 0
+        pipe = self.redis().pipeline()
+        pipe.lpush(self.queue_key, *serialized_messages)
+        pipe.hincrby(self.metrics_key, 'queued', len(serialized_messages))
+        pipe.execute()
+        return len(serialized_messages)
+
+    def register_worker(self, worker_id):
+        self.redis().sadd(self.workers_key, worker_id)
+
+    def unregister_worker(self, worker_id):
+        """ hands the messages still claimed by the given worker back to the queue and forgets the worker """
+        r = self.redis()
+        processing_key = self.get_processing_key(worker_id)
+        number_requeued = 0
+        while r.rpoplpush(processing_key, self.queue_key) is not None:
+            number_requeued += 1
+        r.srem(self.workers_key, worker_id)
+        return number_requeued
+
+    def claim(self, worker_id, batch_size, timeout):
+        """
+        blocks up to timeout seconds for the first message then claims up to batch_size - 1 more without blocking into
+        the given worker's processing list, returns a list of raw claimed messages
+        """
+        r = self.redis()
+        processing_key = self.get_processing_key(worker_id)
+        data = r.brpoplpush(self.queue_key, processing_key, timeout)
+        if data is None:
+            return []
+        batch = [data]
+        while len(batch) < batch_size:
+            data = r.rpoplpush(self.queue_key, processing_key)
+            if data is None:
+                break
+            batch.append(data)
+        return batch
+
+    def complete(self, worker_id, data):
+        self.redis().lrem(self.get_processing_key(worker_id), 1, data)
+
+    def retry(self, worker_id, data, message, attempts):
+        """ schedules a retry with exponential backoff or parks the message on the failed list """
+        pipe = self.redis().pipeline()
+        if attempts < settings.MAIL_MAX_ATTEMPTS:
+            delay = settings.MAIL_RETRY_DELAY * 2 ** (attempts - 1)
+            pipe.zadd(self.retry_key, {serialize_message(message, attempts=attempts): time.time() + delay})
+            pipe.hincrby(self.metrics_key, 'retried')
+        else:
+            pipe.lpush(self.failed_key, serialize_message(message, attempts=attempts))
+            pipe.hincrby(self.metrics_key, 'failed')
+        pipe.lrem(self.get_processing_key(worker_id), 1, data)
+        pipe.execute()
+
+    def requeue_due_retries(self):
+        r = self.redis()
+        due = r.zrangebyscore(self.retry_key, 0, time.time())
+        if not due:
+            return 0
+        pipe = r.pipeline()
+        pipe.zrem(self.retry_key, *due)
+        pipe.lpush(self.queue_key, *due)
+        pipe.execute()
+        return len(due)
+
+    def requeue_orphaned(self):
+        """
+        moves messages claimed by workers that exited, or stopped renewing their lease, before sending them back onto
+        the queue. Messages claimed by live workers are left alone.
+        """
+        r = self.redis()
+        number_requeued = 0
+        for worker_id in self.get_worker_ids():
+            if not r.exists(self.get_heartbeat_key(worker_id)):
+                number_requeued += self.unregister_worker(worker_id)
+        if number_requeued:
+            logger.warning("requeued %s orphaned email messages", number_requeued)
+        return number_requeued
+
+    def record_batch(self, number_sent, elapsed_time):
+        pipe = self.redis().pipeline()
+        pipe.hincrby(self.metrics_key, 'sent', number_sent)
+        pipe.hincrby(self.metrics_key, 'batches')
+        pipe.hincrbyfloat(self.metrics_key, 'send_seconds', elapsed_time)
+        pipe.execute()
+
+    def get_metrics(self):
+        r = self.redis()
+        pipe = r.pipeline()
+        pipe.hgetall(self.metrics_key)
+        pipe.llen(self.queue_key)
+        pipe.zcard(self.retry_key)
+        pipe.llen(self.failed_key)
+        for worker_id in self.get_worker_ids():
+            pipe.llen(self.get_processing_key(worker_id))
+        counters, queued, retrying, failed, *processing = pipe.execute()
+        metrics = {k.decode('utf-8'): float(v) for k, v in counters.items()}
+        send_seconds = metrics.get('send_seconds', 0)
+        metrics.update(
+            queue_length=queued,
+            processing_length=sum(processing),
+            retry_length=retrying,
+            failed_length=failed,
+            messages_per_second=metrics.get('sent', 0) / send_seconds if send_seconds else 0,
+        )
+        return metrics
+
+    def clear(self):
+        self.redis().delete(*self.keys)
+
+
+def get_mail_queue():
+    return MailQueue(settings.MAIL_QUEUE_NAME)
+
+
+def queue_messages(messages, queue=None, on_commit=True):
+    """
+    Queues email messages for delivery by the mail worker once the current transaction commits, or sends them
+    synchronously over a single connection if the mail queue is disabled.
+    """
+    messages = list(messages)
+    if not messages:
+        return
+    if not settings.MAIL_QUEUE_ENABLED:
+        mail.get_connection().send_messages(messages)
+        return
+    if queue is None:
+        queue = get_mail_queue()
+    if on_commit:
+        transaction.on_commit(lambda: queue.push(messages))
+    else:
+        queue.push(messages)
+
+
+def open_connection(connection):
+    """
+    opens the connection, logging instead of raising if the mail server is unavailable. Messages sent over a connection
+    that failed to open try to open one of their own and are retried if that fails as well.
+    """
+    try:
+        connection.open()
+        return True
+    except Exception:
+        logger.exception("unable to connect to mail server")
+        return False
+
+
+def close_connection(connection):
+    try:
+        connection.close()
+    except Exception:
+        logger.exception("unable to close mail server connection")
+
+
+def send_batch(queue, worker_id, connection, batch, rate_limiter):
+    """ sends a claimed batch of messages over a single connection, returns the number of messages sent """
+    number_sent = 0
+    for data in batch:
+        message, attempts = deserialize_message(data)
+        rate_limiter.wait()
+        try:
+            number_sent += connection.send_messages([message]) or 0
+            queue.complete(worker_id, data)
+        except smtplib.SMTPServerDisconnected:
+            logger.warning("mail server disconnected, reopening connection")
+            close_connection(connection)
+            open_connection(connection)
+            queue.retry(worker_id, data, message, attempts + 1)
+        except Exception:
+            logger.exception("unable to send email message %s to %s", message.subject, message.recipients())
+            queue.retry(worker_id, data, message, attempts + 1)
+    return number_sent
+
+
+def run_mail_worker(queue=None, burst=False, timeout=5, batch_size=None, rate_limit=None, connection=None,
+                    worker_id=None):
+    """
+    Sends queued email messages in batches until interrupted, opening a connection for each batch. In burst mode,
+    returns as soon as the queue is empty and returns the number of messages that were sent. Messages orphaned by
+    dead workers are requeued on startup and then once per lease period.
+    """
+    if queue is None:
+        queue = get_mail_queue()
+    if batch_size is None:
+        batch_size = settings.MAIL_BATCH_SIZE
+    if rate_limit is None:
+        rate_limit = settings.MAIL_RATE_LIMIT
+    if connection is None:
+        connection = mail.get_connection(fail_silently=False)
+    if worker_id is None:
+        worker_id = get_worker_id()
+    rate_limiter = RateLimiter(rate_limit)
+    heartbeat = WorkerHeartbeat(queue.get_heartbeat_key(worker_id), settings.MAIL_WORKER_HEARTBEAT_TTL,
+                                name='mail-heartbeat')
+    heartbeat.beat()
+    queue.register_worker(worker_id)
+    heartbeat.start()
+    total_sent = 0
+    last_maintenance = None
+    try:
+        while True:
+            if last_maintenance is None or time.time() - last_maintenance > heartbeat.ttl:
+                queue.requeue_orphaned()
+                last_maintenance = time.time()
+            queue.requeue_due_retries()
+            batch = queue.claim(worker_id, batch_size, timeout)
+            if not batch:
+                if burst:
+                    return total_sent
+                continue
+            start = time.monotonic()
+            open_connection(connection)
+            try:
+                number_sent = send_batch(queue, worker_id, connection, batch, rate_limiter)
+            finally:
+                close_connection(connection)
+            elapsed_time = time.monotonic() - start
+            queue.record_batch(number_sent, elapsed_time)
+            total_sent += number_sent
+            logger.debug("sent %s/%s email messages in %.2fs", number_sent, len(batch), elapsed_time)
+    finally:
+        heartbeat.stop()
+        # hand back anything still claimed, e.g. when interrupted mid-batch
+        queue.unregister_worker(worker_id)
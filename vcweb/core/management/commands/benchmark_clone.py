@@ -0,0 +1,105 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext
+
+from vcweb.core.models import ExperimentConfiguration, RoundConfiguration, RoundParameterValue, copy_model_instance
+
+logger = logging.getLogger(__name__)
+
+
+def per_row_clone(experiment_configuration, creator=None):
+    """ the original one save() per row ExperimentConfiguration.clone, kept as the benchmark baseline """
+    if creator is None:
+        creator = experiment_configuration.creator
+    cloned_experiment_configuration = ExperimentConfiguration.objects.get(pk=experiment_configuration.pk)
+    cloned_experiment_configuration.pk = None
+    cloned_experiment_configuration.creator = creator
+    cloned_experiment_configuration.save()
+    for epv_clone in experiment_configuration.parameter_value_set.all():
+        epv_clone.pk = None
+        epv_clone.experiment_configuration = cloned_experiment_configuration
+        epv_clone.save()
+    for rc in experiment_configuration.round_configuration_set.all():
+        rc_clone = RoundConfiguration.objects.get(pk=rc.pk)
+        rc_clone.pk = None
+        rc_clone.experiment_configuration = cloned_experiment_configuration
+        rc_clone.save()
+        for rpv_clone in RoundParameterValue.objects.filter(round_configuration=rc):
+            rpv_clone.pk = None
+            rpv_clone.round_configuration = rc_clone
+            rpv_clone.save()
+    return cloned_experiment_configuration
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ('Compares the bulk ExperimentConfiguration.clone with the per-row clone it replaced on a configuration '
+            'padded to a given number of rounds. All changes are rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--experiment-configuration', dest='experiment_configuration_id', type=int, default=None,
+                            help='ExperimentConfiguration pk to clone, defaults to the one with the most rounds')
+        parser.add_argument('--rounds', dest='rounds', type=int, default=50,
+                            help='Pad the configuration with copies of its rounds up to this many rounds')
+        parser.add_argument('--repeat', dest='repeat', type=int, default=5, help='Number of clones per method')
+
+    def get_experiment_configuration(self, pk):
+        if pk is not None:
+            try:
+                return ExperimentConfiguration.objects.get(pk=pk)
+            except ExperimentConfiguration.DoesNotExist:
+                raise CommandError("No experiment configuration with id %s" % pk)
+        ec = ExperimentConfiguration.objects.annotate(number_of_rounds=Count('round_configuration_set')).order_by(
+            '-number_of_rounds').first()
+        if ec is None:
+            raise CommandError("No experiment configurations to clone")
+        return ec
+
+    def pad_rounds(self, experiment_configuration, number_of_rounds):
+        """ appends copies of the existing rounds and their parameter values until there are number_of_rounds """
+        round_configurations = list(experiment_configuration.round_configuration_set.order_by('sequence_number'))
+        if not round_configurations:
+            raise CommandError("%s has no rounds to copy" % experiment_configuration)
+        sequence_number = round_configurations[-1].sequence_number
+        index = 0
+        while len(round_configurations) + index < number_of_rounds:
+            source = round_configurations[index % len(round_configurations)]
+            sequence_number += 1
+            rc = copy_model_instance(source, sequence_number=sequence_number, display_number=0)
+            rc.save()
+            RoundParameterValue.objects.bulk_create([copy_model_instance(rpv, round_configuration=rc)
+                                                     for rpv in source.parameter_value_set.all()])
+            index += 1
+
+    def run(self, name, clone, experiment_configuration, repeat):
+        timings = []
+        with CaptureQueriesContext(connection) as queries:
+            for i in range(repeat):
+                start = time.perf_counter()
+                clone(experiment_configuration)
+                timings.append(time.perf_counter() - start)
+        self.stdout.write("%-8s mean=%8.2fms min=%8.2fms queries/clone=%d" % (
+            name, sum(timings) / len(timings) * 1000, min(timings) * 1000, len(queries) // repeat))
+
+    def handle(self, *args, **options):
+        repeat = max(1, options['repeat'])
+        try:
+            with transaction.atomic():
+                ec = self.get_experiment_configuration(options['experiment_configuration_id'])
+                ec = ec.clone()
+                self.pad_rounds(ec, options['rounds'])
+                self.stdout.write("cloning %s: %d rounds, %d experiment and %d round parameter values" % (
+                    ec, ec.round_configuration_set.count(), ec.parameter_value_set.count(),
+                    RoundParameterValue.objects.filter(round_configuration__experiment_configuration=ec).count()))
+                self.run('per-row', per_row_clone, ec, repeat)
+                self.run('bulk', ExperimentConfiguration.clone, ec, repeat)
+                raise Rollback()
+        except Rollback:
+            logger.debug("rolled back benchmark clones")
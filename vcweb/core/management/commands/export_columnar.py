@@ -0,0 +1,33 @@
+import logging
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from vcweb.core.export import write_columnar_tables
+from vcweb.core.models import Experiment
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = ('Exports participant, group, and group cluster data values and chat messages for an experiment as '
+            'parquet files. Requires pyarrow.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('experiment_id', type=int, help='Experiment pk to export')
+        parser.add_argument('--outdir', dest='outdir', default='.',
+                            help='Output directory for the generated parquet files')
+        parser.add_argument('--batch-size', dest='batch_size', type=int, default=None,
+                            help='Number of records per parquet row group, defaults to settings.EXPORT_BATCH_SIZE')
+
+    def handle(self, *args, **options):
+        try:
+            experiment = Experiment.objects.get(pk=options['experiment_id'])
+        except Experiment.DoesNotExist:
+            raise CommandError("No experiment with id %s" % options['experiment_id'])
+        outdir = options['outdir']
+        if not os.path.isdir(outdir):
+            os.makedirs(outdir)
+        for path in write_columnar_tables(experiment, outdir, batch_size=options['batch_size']):
+            logger.debug("wrote %s", path)
+            self.stdout.write(path)
@@ -0,0 +1,22 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from vcweb.core.export import run_export_worker
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Runs queued experiment data export jobs, see vcweb.core.export'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--burst', dest='burst', action='store_true', default=False,
+                            help='Exit once the export queue is empty instead of waiting for new jobs')
+        parser.add_argument('--timeout', dest='timeout', type=int, default=5,
+                            help='Seconds to block waiting for a new export job')
+
+    def handle(self, *args, **options):
+        logger.debug("starting export worker")
+        number_of_jobs = run_export_worker(burst=options['burst'], timeout=options['timeout'])
+        self.stdout.write("Ran %s export jobs" % number_of_jobs)
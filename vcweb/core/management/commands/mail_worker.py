@@ -0,0 +1,33 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from vcweb.core.mailer import get_mail_queue, run_mail_worker
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Sends queued outbound email in batches, see vcweb.core.mailer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--burst', dest='burst', action='store_true', default=False,
+                            help='Exit once the mail queue is empty instead of waiting for new messages')
+        parser.add_argument('--timeout', dest='timeout', type=int, default=5,
+                            help='Seconds to block waiting for a new message')
+        parser.add_argument('--batch-size', dest='batch_size', type=int,
+                            help='Number of messages to send per batch, defaults to settings.MAIL_BATCH_SIZE')
+        parser.add_argument('--rate-limit', dest='rate_limit', type=float,
+                            help='Maximum messages sent per second, defaults to settings.MAIL_RATE_LIMIT')
+        parser.add_argument('--metrics', dest='metrics', action='store_true', default=False,
+                            help='Print mail queue metrics and exit')
+
+    def handle(self, *args, **options):
+        if options['metrics']:
+            for name, value in sorted(get_mail_queue().get_metrics().items()):
+                self.stdout.write("%s: %s" % (name, value))
+            return
+        logger.debug("starting mail worker")
+        number_sent = run_mail_worker(burst=options['burst'], timeout=options['timeout'],
+                                      batch_size=options['batch_size'], rate_limit=options['rate_limit'])
+        self.stdout.write("Sent %s email messages" % number_sent)
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import logging
+
+from django.db import migrations
+
+logger = logging.getLogger(__name__)
+
+INDEX_NAME = 'core_prdv_unique_participant_ready'
+
+
+class UniqueParticipantReady(object):
+    """
+    Guards bulk creation of participant ready data values with a partial unique index on active participant ready data
+    values per participant group relationship and round data. Duplicates from earlier get_or_create races are
+    deactivated first, keeping the most recently created data value which is the one DataValueMixin.get_data_value
+    returns.
+    """
+
+    @staticmethod
+    def forward(apps, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            logger.warning("skipping participant ready unique index on %s", schema_editor.connection.vendor)
+            return
+        Parameter = apps.get_model('core', 'Parameter')
+        participant_ready_parameter = Parameter.objects.filter(name='participant_ready').first()
+        if participant_ready_parameter is None:
+            return
+        schema_editor.execute("""
+            UPDATE core_participantrounddatavalue SET is_active = false
+            WHERE id IN (
+                SELECT id FROM (
+                    SELECT id, row_number() OVER (
+                        PARTITION BY participant_group_relationship_id, round_data_id
+                        ORDER BY date_created DESC, id DESC) AS position
+                    FROM core_participantrounddatavalue
+                    WHERE parameter_id = %(parameter_id)s AND is_active
+                ) AS ranked_data_values
+                WHERE position > 1
+            )""", params={'parameter_id': participant_ready_parameter.pk})
+        schema_editor.execute("""
+            CREATE UNIQUE INDEX {0} ON core_participantrounddatavalue (participant_group_relationship_id, round_data_id)
+            WHERE parameter_id = {1:d} AND is_active""".format(INDEX_NAME, participant_ready_parameter.pk))
+
+    @staticmethod
+    def rollback(apps, schema_editor):
+        if schema_editor.connection.vendor == 'postgresql':
+            schema_editor.execute("DROP INDEX IF EXISTS {0}".format(INDEX_NAME))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_auto_20190125_2337'),
+    ]
+
+    operations = [
+        migrations.RunPython(UniqueParticipantReady.forward, UniqueParticipantReady.rollback),
+    ]
@@ -1,40 +1,48 @@
 import hashlib
 import itertools
 import logging
+import os
 import random
 import string
 import sys
+import threading
 import urllib.error
 import urllib.parse
 import urllib.request
 import xml.etree.ElementTree as ET
-from collections import defaultdict
+from collections import OrderedDict, defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, date, time
 from email.utils import parseaddr
 from enum import Enum
 from string import Template
+from time import monotonic
 from urllib.parse import urlencode
 
 import markdown
 from django.apps import apps
 from django.conf import settings
 from django.contrib.auth.forms import PasswordResetForm
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import User, Group
-from django.core import mail, serializers
+from django.core import serializers
 from django.core.cache import cache
 from django.core.mail import EmailMultiAlternatives
 from django.core.validators import RegexValidator
-from django.db import models, transaction
-from django.db.models import Max, Sum, Count
+from django.db import DatabaseError, IntegrityError, models, transaction
+from django.db.models import Case, Count, Max, Sum, Value, When
+from django.db.models.signals import post_delete, post_migrate, post_save
 from django.dispatch import receiver
 from django.template.defaultfilters import slugify
 from django.template.loader import select_template, get_template
+from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 from model_utils import Choices
 
-from . import signals, simplecache
+from . import signals
 from .decorators import log_signal_errors, retry
 from .http import dumps
+from .mailer import queue_messages
 from ..redis_pubsub import RedisPubSub
 
 logger = logging.getLogger(__name__)
@@ -185,21 +193,19 @@ class ParameterValueMixin(object):
         """
         if parameter is None and name is None:
             raise ValueError("Cannot retrieve parameter value with no name or parameter")
+        if parameter is None:
+            parameter = parameter_registry.get(name=name)
         parameter_value_set = self.parameter_value_set.select_for_update()
         try:
-            if parameter:
-                return parameter_value_set.get(parameter=parameter)
-            elif name:
-                return parameter_value_set.get(parameter__name=name)
+            return parameter_value_set.get(parameter=parameter)
         except parameter_value_set.model.DoesNotExist:
             if inheritable:
-                return self.parent.get_parameter_value(parameter=parameter, name=name, default=default)
+                return self.parent.get_parameter_value(parameter=parameter, default=default)
             else:
-                if parameter is None:
-                    parameter = Parameter.objects.get(name=name)
                 # FIXME: critical section that must be protected, should remove this entirely to avoid auto-creation of parameters. May
                 # be the cause of MultipleObjectExceptions
                 if create:
+                    self._configuration_snapshot = None
                     pv = self.parameter_value_set.create(parameter=parameter)
                     if default is not None:
                         pv.update(default)
@@ -216,6 +222,7 @@ class ParameterValueMixin(object):
         if parameter is None and name is None:
             raise ValueError("Can't set parameter value with no name or parameter given")
         pv = self.get_parameter_value(parameter=parameter, name=name)
+        self._configuration_snapshot = None
         if value is not None:
             pv.update(value)
         elif len(kwargs) == 1:
@@ -233,6 +240,31 @@ class ParameterValueMixin(object):
             raise ValueError("single value required set_parameter_value, received {0} instead".format(kwargs))
         return pv
 
+    @property
+    def configuration_snapshot(self):
+        """ the ConfigurationSnapshot for this configuration, memoized on this instance """
+        snapshot = getattr(self, '_configuration_snapshot', None)
+        if snapshot is None:
+            snapshot = self._configuration_snapshot = ConfigurationSnapshot.for_configuration(self)
+        return snapshot
+
+    def read_parameter_value(self, parameter=None, name=None, default=None, inheritable=False):
+        """
+        read-only version of get_parameter_value served from the cached ConfigurationSnapshot. Takes no row locks and
+        never creates missing parameter values, returns a DefaultValue wrapping the default instead. Use
+        get_parameter_value / set_parameter_value when the parameter value is going to be modified.
+        """
+        if parameter is None and name is None:
+            raise ValueError("Cannot retrieve parameter value with no name or parameter")
+        if parameter is None:
+            parameter = parameter_registry.get(name=name)
+        pv = self.configuration_snapshot.get_value(self, parameter)
+        if pv is not None:
+            return pv
+        if inheritable:
+            return self.parent.read_parameter_value(parameter=parameter, default=default)
+        return DefaultValue(default)
+
 
 class DataValueMixin(object):
     """
@@ -244,8 +276,10 @@ class DataValueMixin(object):
     """
 
     def _criteria(self, parameter=None, parameter_name=None, round_data=None, active=True, **kwargs):
+        if parameter is None and parameter_name is not None:
+            parameter = parameter_registry.get(name=parameter_name)
         return dict([('is_active', active),
-                     ('parameter', parameter) if parameter else ('parameter__name', parameter_name),
+                     ('parameter', parameter),
                      ('round_data', self.experiment.current_round_data if round_data is None else round_data)],
                     **kwargs)
 
@@ -254,24 +288,35 @@ class DataValueMixin(object):
                        create=True, **kwargs):
         if round_data is None:
             round_data = self.experiment.current_round_data
-        criteria = self._criteria(parameter=parameter, parameter_name=parameter_name, round_data=round_data)
+        if parameter is None:
+            parameter = parameter_registry.get(name=parameter_name or kwargs.get('name'))
+        unit_of_work = None if use_filter else DataValueUnitOfWork.get_current()
+        if unit_of_work is not None:
+            key = unit_of_work.get_key(self, parameter, round_data)
+            dv = unit_of_work.identity_map.get(key)
+            if dv is not None:
+                return dv
+        criteria = self._criteria(parameter=parameter, round_data=round_data)
         data_value_set = self.data_value_set.select_related('parameter')
         dvs = data_value_set.filter(**criteria)
         if use_filter:
             return dvs
-        elif dvs.count() > 0:
-            return dvs[0]
-        else:
+        dv = dvs.first()
+        if dv is None:
             logger.warn("No data values found with criteria %s - returning default %s", criteria, default)
-            if parameter is None:
-                parameter = Parameter.objects.get(name='parameter_name')
-            if create:
-                dv = self.data_value_set.create(parameter=parameter, round_data=round_data)
-                if default is not None:
-                    dv.update(default)
-                return dv
-            else:
+            if not create:
                 return DefaultValue(default)
+            if unit_of_work is not None:
+                dv = self.data_value_set.model(parameter=parameter, round_data=round_data,
+                                               **{self.data_value_set.field.name: self})
+                unit_of_work.add(dv)
+            else:
+                dv = self.data_value_set.create(parameter=parameter, round_data=round_data)
+            if default is not None:
+                dv.update(default)
+        if unit_of_work is not None:
+            unit_of_work.identity_map[key] = dv
+        return dv
 
     @transaction.atomic
     def copy_to_next_round(self, *data_values, **kwargs):
@@ -284,6 +329,10 @@ class DataValueMixin(object):
             next_round_data, created = e.get_or_create_round_data(round_configuration=e.next_round,
                                                                   increment_repeated_round_sequence_number=True)
             logger.warn("No explicit next round data, generating next round data %s.", next_round_data)
+        unit_of_work = DataValueUnitOfWork.get_current()
+        if unit_of_work is not None:
+            unit_of_work.copy_to_next_round(data_values, next_round_data)
+            return
         logger.debug("Copying data values %s to next round %s", data_values, next_round_data)
         for existing_dv in data_values:
             # setting pk to None generates a new data value
@@ -302,7 +351,7 @@ class DataValueMixin(object):
             raise ValueError("no value to set")
         if round_data is None:
             round_data = self.experiment.current_round_data
-        dv = self.get_data_value(round_data=round_data, parameter=parameter, **kwargs)
+        dv = self.get_data_value(round_data=round_data, parameter=parameter, parameter_name=parameter_name, **kwargs)
         dv.update(value)
         return dv
 
@@ -649,31 +698,32 @@ class ExperimentConfiguration(ParameterValueMixin, models.Model):
     def namespace(self):
         return self.experiment_metadata.namespace
 
+    @transaction.atomic
     def clone(self, creator=None):
         """
         Returns a deep clone of this experiment configuration including all associated ExperimentParameterValues,
-        RoundParameterValues, and RoundConfigurations
+        RoundParameterValues, and RoundConfigurations. The clone is written with a single INSERT per table, foreign
+        keys to the cloned round configurations are remapped in memory.
         """
         if creator is None:
             creator = self.creator
-        cloned_experiment_configuration = ExperimentConfiguration.objects.get(pk=self.pk)
-        cloned_experiment_configuration.pk = None
-        cloned_experiment_configuration.creator = creator
-        cloned_experiment_configuration.date_created = datetime.now()
+        cloned_experiment_configuration = copy_model_instance(self, creator=creator, date_created=datetime.now())
         cloned_experiment_configuration.save()
-        for epv_clone in self.parameter_value_set.all():
-            epv_clone.pk = None
-            epv_clone.experiment_configuration = cloned_experiment_configuration
-            epv_clone.save()
-        for rc in self.round_configuration_set.all():
-            rc_clone = RoundConfiguration.objects.get(pk=rc.pk)
-            rc_clone.pk = None
-            rc_clone.experiment_configuration = cloned_experiment_configuration
-            rc_clone.save()
-            for rpv_clone in RoundParameterValue.objects.filter(round_configuration=rc):
-                rpv_clone.pk = None
-                rpv_clone.round_configuration = rc_clone
-                rpv_clone.save()
+        ExperimentParameterValue.objects.bulk_create([
+            copy_model_instance(epv, experiment_configuration=cloned_experiment_configuration)
+            for epv in self.parameter_value_set.all()
+        ])
+        round_configurations = list(self.round_configuration_set.all())
+        cloned_round_configurations = RoundConfiguration.objects.bulk_create([
+            copy_model_instance(rc, experiment_configuration=cloned_experiment_configuration)
+            for rc in round_configurations
+        ])
+        cloned_round_configuration_map = {rc.pk: rc_clone for rc, rc_clone in zip(round_configurations,
+                                                                                  cloned_round_configurations)}
+        RoundParameterValue.objects.bulk_create([
+            copy_model_instance(rpv, round_configuration=cloned_round_configuration_map[rpv.round_configuration_id])
+            for rpv in RoundParameterValue.objects.filter(round_configuration__experiment_configuration=self)
+        ])
         return cloned_experiment_configuration
 
     def is_owner(self, user):
@@ -791,6 +841,8 @@ class Experiment(models.Model):
 
     cached_round_sequence_number = None
     ''' caches the round configuration '''
+    round_data_memo = None
+    ''' per-instance (and thus per-request) memo of round data keyed by round data cache key '''
 
     objects = ExperimentQuerySet.as_manager()
 
@@ -966,11 +1018,16 @@ class Experiment(models.Model):
     def current_round_data(self):
         return self.get_round_data(round_configuration=self.current_round)
 
-    # FIXME: consider caching this to avoid a query per invocation
     def get_round_data(self, round_configuration=None, previous_round=False, next_round=False):
+        """
+        Returns the RoundData for the given round configuration (defaults to the current round), or None if it doesn't
+        exist yet. Lookups are memoized on this instance and cached in the django cache (redis) under a key derived from
+        this experiment's pk, the round sequence number and the repeated round sequence number.
+        """
         if round_configuration is None:
             round_configuration = self.current_round
         ps = dict(round_configuration=round_configuration)
+        repeating_round_sequence_number = 0
         if round_configuration.is_repeating_round:
             current = self.current_repeated_round_sequence_number
             if previous_round:
@@ -981,11 +1038,34 @@ class Experiment(models.Model):
             elif next_round:
                 current += 1
             ps.update(repeating_round_sequence_number=current)
-        try:
-            return RoundData.objects.select_related('round_configuration').get(experiment=self, **ps)
-        except RoundData.DoesNotExist:
-            logger.warning("No round data exists yet for round configuration %s", round_configuration)
-            return None
+            repeating_round_sequence_number = current
+        cache_key = RoundData.get_cache_key(self.pk, round_configuration.sequence_number,
+                                            repeating_round_sequence_number)
+        if self.round_data_memo is None:
+            self.round_data_memo = {}
+        round_data = self.round_data_memo.get(cache_key)
+        if round_data is None:
+            round_data = cache.get(cache_key)
+            if round_data is None or round_data.round_configuration_id != round_configuration.pk:
+                try:
+                    round_data = RoundData.objects.get(experiment=self, **ps)
+                except RoundData.DoesNotExist:
+                    logger.warning("No round data exists yet for round configuration %s", round_configuration)
+                    return None
+                cache.set(cache_key, round_data, settings.ROUND_DATA_CACHE_TIMEOUT)
+            # avoid stale round configurations, the caller's round configuration is already loaded
+            round_data.round_configuration = round_configuration
+            self.round_data_memo[cache_key] = round_data
+        return round_data
+
+    def clear_round_data_cache(self):
+        """
+        Clears this instance's round data memo as well as the cached round data for the current round.
+        """
+        self.round_data_memo = None
+        current_round = self.current_round
+        cache.delete(RoundData.get_cache_key(self.pk, current_round.sequence_number,
+                                             self.current_repeated_round_sequence_number))
 
     @property
     def playable_round_data(self):
@@ -1060,9 +1140,7 @@ class Experiment(models.Model):
     @property
     def number_of_ready_participants(self):
         if self.is_round_in_progress:
-            return ParticipantRoundDataValue.objects.filter(parameter=get_participant_ready_parameter(),
-                                                            round_data=self.current_round_data,
-                                                            boolean_value=True).count()
+            return ReadyParticipantsCounter(self.current_round_data).count()
         else:
             return 0
 
@@ -1103,84 +1181,52 @@ class Experiment(models.Model):
         return subject
 
     def notify_participants(self, message, group=None, notify_experimenter=False):
-        redis_client = RedisPubSub.get_redis_instance()
         if group is None:
             channel = RedisPubSub.get_participant_broadcast_channel(self.pk)
         else:
             channel = RedisPubSub.get_participant_group_channel(group.pk)
         logger.debug("notifying participants in channel %s", channel)
-        redis_client.publish(channel, message)
+        RedisPubSub.publish(channel, message)
         if notify_experimenter:
-            redis_client.publish(RedisPubSub.get_experimenter_channel(self.pk), message)
+            self.notify_experimenter(message)
 
     def notify_experimenter(self, message):
-        RedisPubSub.get_redis_instance().publish(RedisPubSub.get_experimenter_channel(self.pk), message)
+        RedisPubSub.publish(RedisPubSub.get_experimenter_channel(self.pk), message)
 
-    @transaction.atomic
     def register_participants(self, users=None, emails=None, institution=None, password=None, sender=None,
                               from_email=None, send_email=True):
         """
-        Registers a set of users with this experiment and returns a list of tuples of the Participants and their
+        Registers a set of users with this experiment and returns a list of tuples of the Users and their
         passwords (to be used in a registration email if needed).
         1. If given a set of emails, it creates Users for those emails if they do not already exist already and then
         proceeds to step 2.
         2. Given a set of users, create Participants for those Users if they do not exist.
+        Every registered user's password is reset to the given password or a random one if none is given. See
+        ParticipantProvisioner for the bulk queries involved.
         """
         number_of_participants = self.participant_set.count()
-        email_messages = []
-        registered_participants = []
         if number_of_participants > 0:
             logger.warning("Experiment %s already has %d participants - aborting", self, number_of_participants)
             return
-        if users is None:
-            if emails is None:
-                logger.warning("No users or emails supplied, aborting.")
-                return
-            users = Experiment.create_users(emails, password)
-
-        creator = self.experimenter.user
-        for user in users:
-            # FIXME: unsafe for concurrent usage, but only one experimenter
-            # at a time should be invoking this
-            (p, created) = Participant.objects.get_or_create(user=user)
-            if institution and p.institution != institution:
-                p.institution = institution
-                p.save()
-            per = ParticipantExperimentRelationship.objects.create(participant=p, experiment=self,
-                                                                   created_by=creator)
-            registered_participants.append((user, password))
-            email_messages.append(self.create_registration_email(per, password=password, is_new_participant=created,
-                                                                 sender=sender, from_email=from_email))
-        if email_messages and send_email:
-            mail.get_connection().send_messages(email_messages)
-        return registered_participants
+        provisioner = ParticipantProvisioner(self, institution=institution, password=password)
+        if users is not None:
+            registrations = provisioner.register_users(users)
+        elif emails is not None:
+            registrations = provisioner.register_emails(emails)
+        else:
+            logger.warning("No users or emails supplied, aborting.")
+            return
+        if send_email:
+            email_messages = [self.render_registration_email(per, password=raw_password, sender=sender,
+                                                             from_email=from_email)
+                              for per, raw_password in registrations]
+            if email_messages:
+                queue_messages(email_messages)
+        return [(per.participant.user, raw_password) for per, raw_password in registrations]
 
     @staticmethod
     def create_users(emails, password):
-        users = []
-        participants_group = PermissionGroup.participant.get_django_group()
-        for email_line in emails:
-            if not email_line:
-                logger.debug("invalid participant data: %s", email_line)
-                continue
-            # FIXME: parsing logic was already performed once in EmailListField.clean, this is redundant
-            (full_name, email_address) = parseaddr(email_line)
-            # lowercase all usernames/email addresses internally and strip all whitespace
-            email_address = email_address.lower().strip()
-            full_name = full_name.strip()
-            with transaction.atomic():
-                userqs = User.objects.select_for_update().filter(
-                    models.Q(email=email_address) | models.Q(username=email_address))
-                if userqs.exists():
-                    u = userqs[0]
-                else:
-                    u = User.objects.create_user(username=email_address, email=email_address, password=password)
-            updated = set_full_name(u, full_name)
-            if updated:
-                u.save()
-            u.groups.add(participants_group)
-            users.append(u)
-        return users
+        return ParticipantProvisioner(password=password).create_users(emails)
 
     def create_registration_email(self, participant_experiment_relationship, password=None, sender=None,
                                   from_email=None, **kwargs):
@@ -1190,16 +1236,21 @@ class Experiment(models.Model):
 
         Override the email template by creating <experiment-namespace>/email/experiment-registration.txt templates
         """
-        participant = participant_experiment_relationship.participant
-        plaintext_template = select_template(['{0}/email/experiment-registration.txt'.format(self.namespace),
-                                              'email/experiment-registration.txt'])
-        user = participant.user
+        user = participant_experiment_relationship.participant.user
         if password is None or not password.strip():
             password = User.objects.make_random_password()
         # FIXME: resets existing user passwords, which might not be a good
         # thing
         user.set_password(password)
         user.save()
+        return self.render_registration_email(participant_experiment_relationship, password=password, sender=sender,
+                                              from_email=from_email)
+
+    def render_registration_email(self, participant_experiment_relationship, password, sender=None, from_email=None):
+        """ returns the registration email for the given participant without touching their password """
+        participant = participant_experiment_relationship.participant
+        plaintext_template = select_template(['{0}/email/experiment-registration.txt'.format(self.namespace),
+                                              'email/experiment-registration.txt'])
         plaintext_content = plaintext_template.render({
             'participant_experiment_relationship': participant_experiment_relationship,
             'participant': participant,
@@ -1220,7 +1271,6 @@ class Experiment(models.Model):
         msg.attach_alternative(html_content, "text/html")
         return msg
 
-    @transaction.atomic
     def setup_demo_participants(self, count=20, institution=None, email_suffix='mailinator.com', username_suffix='asu',
                                 password=None):
         if password is None:
@@ -1229,23 +1279,13 @@ class Experiment(models.Model):
         if number_of_participants > 0:
             logger.warning("Experiment %s already has %d participants - aborting", self, number_of_participants)
             return
-        users = []
-
-        demo_participants_group = PermissionGroup.demo_participant.get_django_group()
-
-        for i in range(1, count + 1):
-            email_address = 's{0}{1}@{2}'.format(i, username_suffix, email_suffix)
-            userqs = User.objects.select_for_update().filter(
-                models.Q(email=email_address) | models.Q(username=email_address))
-            if userqs.exists():
-                user = userqs[0]
-            else:
-                user = User.objects.create_user(username=email_address, email=email_address, password=password,
-                                                first_name='Test Student', last_name=str(i))
-            user.groups.add(demo_participants_group)
-            users.append(user)
-        return self.register_participants(users=users, institution=institution, password=password,
-                                          send_email=False)
+        provisioner = ParticipantProvisioner(self, institution=institution, password=password,
+                                             permission_group=PermissionGroup.demo_participant)
+        registrations = provisioner.register_addresses([
+            ('s{0}{1}@{2}'.format(i, username_suffix, email_suffix), 'Test Student {0}'.format(i))
+            for i in range(1, count + 1)
+        ])
+        return [(per.participant.user, raw_password) for per, raw_password in registrations]
 
     def should_initialize_data_values(self, round_configuration=None):
         if round_configuration is None:
@@ -1261,14 +1301,15 @@ class Experiment(models.Model):
     def initialize_data_values(self, group_parameters=None, participant_parameters=None, group_cluster_parameters=None,
                                round_data=None, defaults=None):
         """
-        FIXME: needs refactoring, replace get_or_create with creates and separate initialization of data values from
-        copy_to_next_round semantics
-        Issues:
-            1. Make it simpler for experiment devs to signal "I have these data values to initialize at the start of
-            each round"
-            2. get_or_create logic has the possibility for degenerate data (e.g., duplicate group round data values)
-            that cause the rest of the rounds to not run properly
+        Creates any missing group cluster, group, and participant data values for the given parameters in the given
+        round data (defaults to the current round data), initialized with the given defaults. Existing data values are
+        loaded in one query per data value type and all missing data values are bulk created, so repeated invocations
+        are idempotent. Returns a dict with the number of data values created for each type.
+
+        FIXME: separate initialization of data values from copy_to_next_round semantics and make it simpler for
+        experiment devs to signal "I have these data values to initialize at the start of each round"
         """
+        created_counts = dict(group_cluster_data_values=0, group_data_values=0, participant_data_values=0)
         if round_data is None:
             round_data = self.current_round_data
 
@@ -1276,7 +1317,7 @@ class Experiment(models.Model):
 
         if not self.should_initialize_data_values(round_configuration):
             logger.debug("ignoring round data initialization for %s", round_configuration)
-            return
+            return created_counts
 
         if group_parameters is None:
             group_parameters = []
@@ -1297,30 +1338,45 @@ class Experiment(models.Model):
                 parameter_defaults[parameter] = {parameter.value_field_name: defaults[parameter]}
         if parameter_defaults:
             logger.debug("setting default values for parameters: %s", parameter_defaults)
-        # create group cluster parameter data values
         if group_cluster_parameters:
-            for group_cluster in self.active_group_clusters:
-                for parameter in group_cluster_parameters:
-                    gcdv, created = round_data.group_cluster_data_value_set.get_or_create(
-                        group_cluster=group_cluster,
-                        parameter=parameter,
-                        defaults=parameter_defaults[parameter])
-                    logger.debug("gcdv: %s (%s)", gcdv, created)
-        for group in self.groups:
-            for parameter in group_parameters:
-                group_data_value, created = round_data.group_data_value_set.get_or_create(
-                    group=group,
-                    parameter=parameter,
-                    defaults=parameter_defaults[parameter])
-                logger.debug("grdv: %s (%s)", group_data_value, created)
-            if participant_parameters:
-                for pgr in group.participant_group_relationship_set.all():
-                    for parameter in participant_parameters:
-                        participant_data_value, created = round_data.participant_data_value_set.get_or_create(
-                            participant_group_relationship=pgr,
-                            parameter=parameter,
-                            defaults=parameter_defaults[parameter])
-                        logger.debug("prdv: %s (%s)", participant_data_value, created)
+            created_counts['group_cluster_data_values'] = self._create_missing_data_values(
+                GroupClusterDataValue, 'group_cluster', self.active_group_clusters.values_list('pk', flat=True),
+                group_cluster_parameters, parameter_defaults, round_data)
+        if group_parameters:
+            created_counts['group_data_values'] = self._create_missing_data_values(
+                GroupRoundDataValue, 'group', self.groups.values_list('pk', flat=True),
+                group_parameters, parameter_defaults, round_data)
+        if participant_parameters:
+            pgr_ids = ParticipantGroupRelationship.objects.filter(group__in=self.groups).order_by(
+                'group', 'participant_number').values_list('pk', flat=True)
+            created_counts['participant_data_values'] = self._create_missing_data_values(
+                ParticipantRoundDataValue, 'participant_group_relationship', pgr_ids,
+                participant_parameters, parameter_defaults, round_data)
+        logger.debug("initialized data values for %s: %s", round_data, created_counts)
+        return created_counts
+
+    @staticmethod
+    def _create_missing_data_values(data_value_model, owner_field_name, owner_ids, parameters, parameter_defaults,
+                                    round_data):
+        """
+        bulk creates data values for every (owner, parameter) pair that doesn't already have a data value in the given
+        round data and returns the number of data values created
+        """
+        owner_ids = list(owner_ids)
+        existing_data_values = set(data_value_model.objects.filter(
+            round_data=round_data,
+            parameter__in=parameters,
+            **{owner_field_name + '__in': owner_ids}).values_list(owner_field_name, 'parameter'))
+        owner_id_field_name = owner_field_name + '_id'
+        missing_data_values = [
+            data_value_model(round_data=round_data, parameter=parameter,
+                             **dict(parameter_defaults[parameter], **{owner_id_field_name: owner_id}))
+            for owner_id in owner_ids
+            for parameter in parameters
+            if (owner_id, parameter.pk) not in existing_data_values
+        ]
+        data_value_model.objects.bulk_create(missing_data_values)
+        return len(missing_data_values)
 
     def log(self, log_message, log_type=ActivityLog.LogType.System, *args, **kwargs):
         if log_message:
@@ -1345,76 +1401,14 @@ class Experiment(models.Model):
 
     @transaction.atomic
     def allocate_groups(self, round_configuration=None, randomize=True):
-        if round_configuration is None:
-            round_configuration = self.current_round
-        preserve_existing_groups = round_configuration.preserve_existing_groups
-        session_id = round_configuration.session_id or ''
-        # clear out all existing groups
-        # cap max group size at 1
-        max_group_size = 1
-        if not round_configuration.is_private_practice_round:
-            max_group_size = self.experiment_configuration.max_group_size
-
-        participants = list(self.participant_set.all())
-        logger.debug("%s allocating groups for %s with session_id %s (randomize? %s)",
-                     self, participants, session_id, randomize)
-        if randomize:
-            random.shuffle(participants)
-        gs = self.group_set
-        if gs.exists():
-            # groups already exist, preserve or delete them
-            # FIXME: would be safer to always preserve as it doesn't carry any risk of data loss, could autogenerate
-            # a session id if one isn't found.
-            if preserve_existing_groups:
-                logger.debug("preserving existing groups")
-                # initialize session_id to round configuration session_id if
-                # unset, abort if none can be found
-                if not session_id:
-                    logger.error("Cannot create a new set of groups because no session id has been set on %s.",
-                                 round_configuration)
-                    raise ValueError(
-                        "Cannot preserve existing groups without round_configuration.session id {0}".format(
-                            round_configuration))
-            else:
-                logger.debug("deleting existing groups")
-                # FIXME: fairly expensive operation to log all group members
-                gqs = gs.all()
-                for g in gqs:
-                    self.log("reallocating/deleting group {0}".format(
-                        g.participant_group_relationship_set.all()))
-                    gqs.delete()
-        # existing groups, if any, should have been handled. now allocate participants to fresh groups
-        current_group = self.group_set.create(number=1, max_size=max_group_size, session_id=session_id)
-        for p in participants:
-            # group.add_participant will create a new group as needed if the current one becomes full.
-            # pgr.group always refers to the next group to be filled
-            pgr = current_group.add_participant(p)
-            current_group = pgr.group
-        # Groups have all been populated. Check if group clusters should be created to share data across multiple
-        # groups.
-        self.create_group_clusters(round_configuration)
+        """
+        Allocates all participants in this experiment to fresh groups and, if the round configuration requires it,
+        group clusters. See GroupAllocator.
+        """
+        return GroupAllocator(self, round_configuration, randomize=randomize).allocate()
 
     def create_group_clusters(self, round_configuration):
-        session_id = round_configuration.session_id
-        if round_configuration.create_group_clusters:
-            logger.debug("deleting existing group clusters and creating anew with session id %s", session_id)
-            self.group_cluster_set.filter(session_id=session_id).delete()
-            gs = self.group_set.filter(session_id=session_id)
-            group_cluster_size = round_configuration.group_cluster_size
-            groups = list(gs)
-            if len(groups) % group_cluster_size != 0:
-                logger.error("cannot create clusters with %s groups per cluster with %s groups, not evenly divisible",
-                             group_cluster_size, len(groups))
-                return
-            random.shuffle(groups)
-            current_group_cluster = None
-            logger.debug("creating group clusters with %s groups per cluster", group_cluster_size)
-            for index, group in enumerate(groups):
-                if current_group_cluster is None or index >= group_cluster_size and (index % group_cluster_size == 0):
-                    # the current group cluster is full, create a new one
-                    current_group_cluster = self.group_cluster_set.create(session_id=session_id, name=group.identifier)
-                # add group to the cluster
-                GroupRelationship.objects.create(cluster=current_group_cluster, group=group)
+        GroupAllocator(self, round_configuration).create_group_clusters()
 
     def get_round_configuration(self, sequence_number):
         return RoundConfiguration.objects.select_related('experiment_configuration').get(
@@ -1444,6 +1438,7 @@ class Experiment(models.Model):
         else:
             logger.warning("trying to advance past the last round - no-op")
             return None
+        self.clear_round_data_cache()
         return self.start_round()
 
     @transaction.atomic
@@ -1471,20 +1466,44 @@ class Experiment(models.Model):
             ps['repeating_round_sequence_number'] = rrsn
         self.round_data_set.select_for_update()
         round_data, created = self.round_data_set.get_or_create(**ps)
+        if created:
+            ReadyParticipantsCounter(round_data).reset()
         if self.experiment_configuration.is_experimenter_driven:
             # create participant ready data values for every round in
             # experimenter driven experiments
             logger.debug("creating participant ready participant values for experimenter driven experiment")
-            # FIXME: use bulk_create for this?
-            # https://docs.djangoproject.com/en/dev/ref/models/querysets/#bulk-create
-            for pgr in self.participant_group_relationships:
-                pgr.data_value_set.get_or_create(
-                    parameter=get_participant_ready_parameter(),
-                    round_data=round_data,
-                    defaults={'boolean_value': False})
+            self.create_participant_ready_data_values(round_data)
         logger.debug("round data %s - newly created? %s ", round_data, created)
         return round_data, created
 
+    def create_participant_ready_data_values(self, round_data):
+        """
+        Bulk creates participant ready data values for all participants in this experiment that don't already have
+        one in the given round data. Concurrent creation is guarded by the partial unique index on active participant
+        ready data values (see migration 0016), if we lose the race we retry once against the updated set of existing
+        data values.
+        """
+        participant_ready_parameter = get_participant_ready_parameter()
+        for attempt in range(2):
+            existing_pgr_ids = set(ParticipantRoundDataValue.objects.filter(
+                parameter=participant_ready_parameter,
+                round_data=round_data,
+            ).values_list('participant_group_relationship', flat=True))
+            missing_data_values = [
+                ParticipantRoundDataValue(participant_group_relationship_id=pgr_id, round_data=round_data,
+                                          parameter=participant_ready_parameter, boolean_value=False)
+                for pgr_id in self.participant_group_relationships.values_list('pk', flat=True)
+                if pgr_id not in existing_pgr_ids
+            ]
+            try:
+                with transaction.atomic():
+                    ParticipantRoundDataValue.objects.bulk_create(missing_data_values)
+                return len(missing_data_values)
+            except IntegrityError:
+                if attempt > 0:
+                    raise
+                logger.warning("concurrent participant ready data value creation for %s, retrying", round_data)
+
     @log_signal_errors
     @transaction.atomic
     def start_round(self, sender=None):
@@ -1500,6 +1519,7 @@ class Experiment(models.Model):
         # (participant ready parameters for instance) are associated with the correct participant group
         # relationships.
         self.get_or_create_round_data(round_configuration=current_round_configuration)
+        self.clear_round_data_cache()
         self.current_round_start_time = datetime.now()
         self.log('Starting round')
         self.save()
@@ -1582,6 +1602,8 @@ class Experiment(models.Model):
         self.current_round_sequence_number = 1
         self.current_repeated_round_sequence_number = 0
         self.save()
+        # restart and clear both go through here
+        self.clear_round_data_cache()
 
     @transaction.atomic
     def clear(self):
@@ -1659,14 +1681,21 @@ class Experiment(models.Model):
     def to_json(self, include_round_data=False, *args, **kwargs):
         return dumps(self.to_dict(include_round_data=include_round_data, *args, **kwargs))
 
-    def clone(self, experimenter=None):
-        """ returns a fresh copy of this experiment with an optional new experimenter """
+    @transaction.atomic
+    def clone(self, experimenter=None, clone_configuration=False):
+        """
+        returns a fresh copy of this experiment with an optional new experimenter. The copy shares this experiment's
+        configuration unless clone_configuration is set, in which case it gets a deep clone of the configuration.
+        """
         if not experimenter:
             experimenter = self.experimenter
+        experiment_configuration = self.experiment_configuration
+        if clone_configuration:
+            experiment_configuration = experiment_configuration.clone(creator=experimenter)
         return Experiment.objects.create(experimenter=experimenter,
                                          authentication_code=self.authentication_code,
                                          experiment_metadata=self.experiment_metadata,
-                                         experiment_configuration=self.experiment_configuration,
+                                         experiment_configuration=experiment_configuration,
                                          duration=self.duration,
                                          status=Experiment.Status.INACTIVE)
 
@@ -1909,20 +1938,26 @@ class RoundConfiguration(ParameterValueMixin, models.Model):
 
 class ParameterQuerySet(models.query.QuerySet):
 
+    def _get_scoped(self, scope, **kwargs):
+        # plain lookups by name or pk are served by the process-wide parameter registry
+        if not self.query.where and kwargs and set(kwargs) <= {'name', 'pk'}:
+            return parameter_registry.get(scope=scope, **kwargs)
+        return self.get(scope=scope, **kwargs)
+
     def for_participant(self, **kwargs):
-        return self.get(scope=Parameter.Scope.PARTICIPANT, **kwargs)
+        return self._get_scoped(Parameter.Scope.PARTICIPANT, **kwargs)
 
     def for_group(self, **kwargs):
-        return self.get(scope=Parameter.Scope.GROUP, **kwargs)
+        return self._get_scoped(Parameter.Scope.GROUP, **kwargs)
 
     def for_round(self, **kwargs):
-        return self.get(scope=Parameter.Scope.ROUND, **kwargs)
+        return self._get_scoped(Parameter.Scope.ROUND, **kwargs)
 
     def for_experiment(self, **kwargs):
-        return self.get(scope=Parameter.Scope.EXPERIMENT, **kwargs)
+        return self._get_scoped(Parameter.Scope.EXPERIMENT, **kwargs)
 
     def for_group_cluster(self, **kwargs):
-        return self.get(scope=Parameter.Scope.GROUP_CLUSTER, **kwargs)
+        return self._get_scoped(Parameter.Scope.GROUP_CLUSTER, **kwargs)
 
 
 class ParameterManager(models.Manager):
@@ -2065,6 +2100,208 @@ class Parameter(models.Model):
         ordering = ['name']
 
 
+class ParameterRegistry(object):
+
+    """
+    Process-wide registry of all Parameters keyed by name and pk, loaded with a single query at app ready or on first
+    use. Saving or deleting a Parameter invalidates the registry in the current process immediately and in every other
+    process through a redis pub/sub message once the transaction commits. Invalidated registries are reloaded lazily.
+    Every lookup makes sure that the current process is listening for invalidations, so that forked (e.g., uWSGI)
+    workers subscribe on their first lookup even though they inherit a loaded registry from their parent.
+    """
+
+    def __init__(self, channel='vcweb.parameters'):
+        self.channel = channel
+        self.lock = threading.Lock()
+        # (parameters by name, parameters by pk), replaced as a whole so that lookups always see a consistent pair
+        self.parameters = None
+        self.listener = None
+        self.listener_pid = None
+        self.loaded_pid = None
+        # incremented by every invalidation so that a load racing with an invalidation doesn't keep stale parameters
+        self.generation = 0
+        # monotonic time of the last reload caused by a lookup miss
+        self.last_miss_reload = None
+
+    def load(self):
+        generation = self.generation
+        parameters = list(Parameter.objects.all())
+        loaded = ({p.name: p for p in parameters}, {p.pk: p for p in parameters})
+        with self.lock:
+            if generation == self.generation:
+                self.parameters = loaded
+                self.loaded_pid = os.getpid()
+        return loaded
+
+    def warm_up(self):
+        try:
+            logger.debug("loaded %s parameters", len(self.load()[1]))
+        except DatabaseError:
+            # e.g., before the initial migration
+            logger.warning("unable to load parameters, deferring until first use", exc_info=True)
+
+    def invalidate(self):
+        with self.lock:
+            self.generation += 1
+            self.parameters = None
+
+    def publish(self):
+        """ notifies the registries in all other processes that parameters have changed """
+        RedisPubSub.get_redis_instance().publish(self.channel, 'invalidate')
+
+    def listen(self):
+        """ subscribes to invalidations from other processes in a daemon thread, once per (forked) process """
+        pid = os.getpid()
+        if self.listener_pid == pid or not settings.PARAMETER_REGISTRY_LISTEN:
+            return
+        with self.lock:
+            if self.listener_pid == pid:
+                return
+            self.listener_pid = pid
+        try:
+            pubsub = RedisPubSub.get_redis_instance().pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{self.channel: lambda message: self.invalidate()})
+            self.listener = pubsub.run_in_thread(sleep_time=1, daemon=True,
+                                                 exception_handler=self._handle_listener_error)
+        except Exception:
+            logger.exception("unable to subscribe to parameter invalidations")
+            self.listener_pid = None
+            return
+        if self.loaded_pid != pid:
+            # inherited from the parent process, invalidations sent since the fork were missed
+            self.invalidate()
+
+    def _handle_listener_error(self, exception, pubsub, thread):
+        # invalidations may have been missed, start over with a new subscription on the next lookup
+        logger.warning("parameter invalidation listener failed: %s", exception)
+        thread.stop()
+        self.listener_pid = None
+        self.invalidate()
+
+    def _lookup(self, parameters, name=None, pk=None):
+        parameters_by_name, parameters_by_pk = parameters
+        return parameters_by_name.get(name) if pk is None else parameters_by_pk.get(int(pk))
+
+    def get(self, name=None, scope=None, pk=None):
+        """ returns the Parameter with the given name or pk, raises Parameter.DoesNotExist if it doesn't exist """
+        if name is None and pk is None:
+            raise ValueError("Cannot look up a parameter with no name or pk")
+        self.listen()
+        parameters = self.parameters
+        if parameters is None:
+            # not loaded yet or invalidated
+            parameters = self.load()
+        parameter = self._lookup(parameters, name, pk)
+        if parameter is None and self.should_reload_on_miss():
+            # possibly created by another process before its invalidation arrived
+            parameter = self._lookup(self.load(), name, pk)
+        if parameter is None or (scope is not None and parameter.scope != scope):
+            raise Parameter.DoesNotExist("No parameter with name %s, pk %s and scope %s" % (name, pk, scope))
+        return parameter
+
+    def should_reload_on_miss(self):
+        """ rate limits reloads caused by lookups of unknown parameters to one per PARAMETER_REGISTRY_MISS_INTERVAL """
+        now = monotonic()
+        last_miss_reload = self.last_miss_reload
+        if last_miss_reload is not None and now - last_miss_reload < settings.PARAMETER_REGISTRY_MISS_INTERVAL:
+            return False
+        self.last_miss_reload = now
+        return True
+
+
+parameter_registry = ParameterRegistry()
+
+
+class ParameterValueSnapshot(namedtuple('ParameterValueSnapshot',
+                                        'parameter_id string_value int_value float_value boolean_value')):
+
+    """ immutable, read-only stand-in for an ExperimentParameterValue or RoundParameterValue """
+
+    __slots__ = ()
+
+    @property
+    def parameter(self):
+        return parameter_registry.get(pk=self.parameter_id)
+
+    @property
+    def value(self):
+        parameter = self.parameter
+        value = getattr(self, parameter.value_field_name, None)
+        if value is None:
+            return parameter.none_value
+        if parameter.is_foreign_key:
+            return parameter.lookup(pk=value)
+        return value
+
+
+class ConfigurationSnapshot(object):
+
+    """
+    Immutable snapshot of the experiment and round parameter values of an ExperimentConfiguration and all of its
+    RoundConfigurations, loaded with two queries and cached in the django cache. Saving or deleting an
+    ExperimentParameterValue or RoundParameterValue invalidates the cached snapshot of its experiment configuration.
+    """
+
+    VALUE_FIELDS = ('parameter_id', 'string_value', 'int_value', 'float_value', 'boolean_value')
+
+    def __init__(self, experiment_configuration_pk, experiment_values, round_values):
+        self.experiment_configuration_pk = experiment_configuration_pk
+        # parameter pk -> ParameterValueSnapshot
+        self.experiment_values = experiment_values
+        # round configuration pk -> parameter pk -> ParameterValueSnapshot
+        self.round_values = round_values
+
+    @staticmethod
+    def get_cache_key(experiment_configuration_pk):
+        return 'configuration_snapshot.{0}'.format(experiment_configuration_pk)
+
+    @classmethod
+    def load(cls, experiment_configuration_pk):
+        experiment_values = {}
+        for values in ExperimentParameterValue.objects.filter(
+                experiment_configuration_id=experiment_configuration_pk).order_by('pk').values_list(
+                *cls.VALUE_FIELDS):
+            pv = ParameterValueSnapshot(*values)
+            experiment_values.setdefault(pv.parameter_id, pv)
+        round_values = defaultdict(dict)
+        for values in RoundParameterValue.objects.filter(
+                round_configuration__experiment_configuration_id=experiment_configuration_pk).order_by(
+                'pk').values_list('round_configuration_id', *cls.VALUE_FIELDS):
+            pv = ParameterValueSnapshot(*values[1:])
+            round_values[values[0]].setdefault(pv.parameter_id, pv)
+        return cls(experiment_configuration_pk, experiment_values, dict(round_values))
+
+    @classmethod
+    def get(cls, experiment_configuration_pk):
+        key = cls.get_cache_key(experiment_configuration_pk)
+        snapshot = cache.get(key)
+        if snapshot is None:
+            snapshot = cls.load(experiment_configuration_pk)
+            cache.set(key, snapshot, settings.CONFIGURATION_SNAPSHOT_CACHE_TIMEOUT)
+        return snapshot
+
+    @classmethod
+    def for_configuration(cls, configuration):
+        if isinstance(configuration, RoundConfiguration):
+            return cls.get(configuration.experiment_configuration_id)
+        return cls.get(configuration.pk)
+
+    @classmethod
+    def invalidate(cls, experiment_configuration_pk):
+        key = cls.get_cache_key(experiment_configuration_pk)
+        cache.delete(key)
+        # concurrent readers may have cached the previous values again before this transaction commits
+        transaction.on_commit(lambda: cache.delete(key))
+
+    def get_value(self, configuration, parameter):
+        """ returns the ParameterValueSnapshot for the given configuration and parameter or None """
+        if isinstance(configuration, RoundConfiguration):
+            values = self.round_values.get(configuration.pk, {})
+        else:
+            values = self.experiment_values
+        return values.get(parameter.pk)
+
+
 class ParameterizedValue(models.Model):
     """
     Base type for GroupRoundDataValue and ParticipantRoundDataValues
@@ -2078,6 +2315,19 @@ class ParameterizedValue(models.Model):
     last_modified = models.DateTimeField(auto_now=True)
     is_active = models.BooleanField(default=True)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(ParameterizedValue, cls).from_db(db, field_names, values)
+        # resolve the parameter from the parameter registry instead of a query per data value
+        parameter_id = instance.__dict__.get('parameter_id')
+        if parameter_id is not None:
+            try:
+                setattr(instance, cls._meta.get_field('parameter').get_cache_name(),
+                        parameter_registry.get(pk=parameter_id))
+            except Parameter.DoesNotExist:
+                pass
+        return instance
+
     @property
     def cache_key(self):
         """
@@ -2088,20 +2338,16 @@ class ParameterizedValue(models.Model):
 
     @property
     def cached_value(self):
+        if self.parameter.is_foreign_key:
+            # referenced model instances are cached by ForeignKeyValueResolver
+            if '_resolved_foreign_key' not in self.__dict__:
+                resolve_foreign_key_values([self])
+            return self.value
         ck = self.cache_key
         cv = cache.get(ck)
         if cv is None:
             cv = self.value
-            if isinstance(cv, models.Model):
-                cache.set(ck, serializers.serialize('json', [cv]))
-            else:
-                cache.set(ck, cv)
-            return cv
-        if self.parameter.is_foreign_key:
-            try:
-                return next(serializers.deserialize('json', cv)).object
-            except serializers.base.DeserializationError as e:
-                logger.exception("unable to deserialize %s", cv)
+            cache.set(ck, cv)
         return cv
 
     @property
@@ -2110,6 +2356,10 @@ class ParameterizedValue(models.Model):
         if value is None:
             return self.parameter.none_value
         if self.parameter.is_foreign_key:
+            # (pk, model instance) primed by ForeignKeyValueResolver
+            resolved = self.__dict__.get('_resolved_foreign_key')
+            if resolved is not None and resolved[0] == value:
+                return resolved[1]
             return self.parameter.lookup(pk=value)
         else:
             return value
@@ -2135,7 +2385,12 @@ class ParameterizedValue(models.Model):
         setattr(self, attr, val)
         if submitted is not None:
             self.submitted = submitted
-        self.save()
+        unit_of_work = DataValueUnitOfWork.get_current()
+        if unit_of_work is not None and unit_of_work.tracks(self):
+            field_name = self.parameter.value_field_name if attr == 'value' else attr
+            unit_of_work.register_update(self, field_name, *(['submitted'] if submitted is not None else []))
+        else:
+            self.save()
 
     def to_dict(self, cacheable=False, **kwargs):
         p = self.parameter
@@ -2156,6 +2411,278 @@ class ParameterizedValue(models.Model):
         abstract = True
 
 
+class ForeignKeyValueResolver(object):
+
+    """
+    Resolves the model instances referenced by foreign key parameter values for batches of ParameterizedValues with
+    a single cache get_many and at most one in_bulk query per referenced model class, instead of a Parameter.lookup
+    per data value. Resolved instances are kept for the lifetime of the resolver so that it can be reused across
+    batches, e.g., the rounds of an export.
+    """
+
+    def __init__(self, use_cache=True):
+        self.use_cache = use_cache
+        # model class -> pk -> model instance
+        self.objects = defaultdict(dict)
+
+    @staticmethod
+    def get_cache_key(model, pk):
+        return 'foreign_key_value.{0}.{1}'.format(model._meta.label_lower, pk)
+
+    def fetch(self, model, pks):
+        objects = self.objects[model]
+        missing = set(pks).difference(objects)
+        if missing and self.use_cache:
+            cached = cache.get_many([self.get_cache_key(model, pk) for pk in missing])
+            for obj in cached.values():
+                objects[obj.pk] = obj
+            missing.difference_update(objects)
+        if missing:
+            loaded = model.objects.in_bulk(list(missing))
+            objects.update(loaded)
+            if loaded and self.use_cache:
+                cache.set_many({self.get_cache_key(model, pk): obj for pk, obj in loaded.items()},
+                               settings.FOREIGN_KEY_VALUE_CACHE_TIMEOUT)
+        return objects
+
+    def resolve(self, data_values):
+        """
+        primes the value of every foreign key data value in data_values with its referenced model instance and returns
+        data_values as a list
+        """
+        data_values = list(data_values)
+        pks = defaultdict(set)
+        for dv in data_values:
+            if dv.parameter.is_foreign_key and dv.int_value is not None:
+                pks[dv.parameter.get_model_class()].add(dv.int_value)
+        for model, model_pks in pks.items():
+            self.fetch(model, model_pks)
+        for dv in data_values:
+            if dv.parameter.is_foreign_key and dv.int_value is not None:
+                obj = self.objects[dv.parameter.get_model_class()].get(dv.int_value)
+                # dangling references are left to the DoesNotExist raised by Parameter.lookup
+                if obj is not None:
+                    dv._resolved_foreign_key = (dv.int_value, obj)
+        return data_values
+
+
+def resolve_foreign_key_values(data_values, use_cache=True):
+    return ForeignKeyValueResolver(use_cache=use_cache).resolve(data_values)
+
+
+def bulk_update_data_values(model, field_name, values):
+    """
+    Sets field_name on each data value in values (a dict of data value pk -> new value) with a single UPDATE ... CASE
+    statement instead of one save() per data value. Also touches last_modified as save() would.
+    """
+    if not values:
+        return 0
+    cases = [When(pk=pk, then=Value(value)) for pk, value in values.items()]
+    return model.objects.filter(pk__in=list(values)).update(
+        last_modified=timezone.now(),
+        **{field_name: Case(*cases, output_field=model._meta.get_field(field_name))})
+
+
+def get_or_create_data_values(model, owner_field_name, owner_ids, round_data, parameter_defaults):
+    """
+    Set-based equivalent of DataValueMixin.get_data_value for many owners and parameters. Returns a dict mapping
+    (owner pk, parameter pk) to the latest active data value, bulk creating any missing data values with the default
+    given in parameter_defaults (a dict of Parameter -> default value or None).
+    """
+    owner_attname = owner_field_name + '_id'
+    data_values = {}
+    for dv in model.objects.filter(round_data=round_data,
+                                   parameter__in=list(parameter_defaults),
+                                   is_active=True,
+                                   **{owner_field_name + '__pk__in': owner_ids}).order_by('-date_created', '-pk'):
+        data_values.setdefault((getattr(dv, owner_attname), dv.parameter_id), dv)
+    missing_data_values = []
+    for owner_id in owner_ids:
+        for parameter, default in parameter_defaults.items():
+            if (owner_id, parameter.pk) not in data_values:
+                logger.warning("No %s data value for %s %s - creating with default %s", parameter, owner_field_name,
+                               owner_id, default)
+                dv = model(parameter=parameter, round_data=round_data, **{owner_attname: owner_id})
+                if default is not None:
+                    dv.value = default
+                missing_data_values.append(dv)
+    for dv in model.objects.bulk_create(missing_data_values):
+        data_values[(getattr(dv, owner_attname), dv.parameter_id)] = dv
+    return data_values
+
+
+@transaction.atomic
+def bulk_copy_to_next_round(experiment, data_values, next_round_data=None):
+    """
+    Set-based equivalent of DataValueMixin.copy_to_next_round for data values belonging to any number of owners,
+    issuing one INSERT per data value model.
+    """
+    if experiment.is_last_round:
+        return []
+    if next_round_data is None:
+        next_round_data, created = experiment.get_or_create_round_data(round_configuration=experiment.next_round,
+                                                                       increment_repeated_round_sequence_number=True)
+    copies = defaultdict(list)
+    for existing_dv in data_values:
+        copies[type(existing_dv)].append(copy_data_value(existing_dv, next_round_data))
+    logger.debug("Copying %d data values to next round %s", len(data_values), next_round_data)
+    return [dv for model, dvs in copies.items() for dv in model.objects.bulk_create(dvs)]
+
+
+@transaction.atomic
+def bulk_log_group_activity(group_activity_logs, log_type=ActivityLog.LogType.System):
+    """
+    Set-based equivalent of ExperimentGroup.log for a list of (group, round configuration, log message) tuples,
+    writing the GroupActivityLogs in the given order with two INSERTs. bulk_create doesn't support multi-table
+    inheritance, so the ActivityLog parent rows are bulk created first and the GroupActivityLog rows are then inserted
+    with their parent links.
+    """
+    group_activity_logs = [GroupActivityLog(group=group, round_configuration=round_configuration,
+                                            log_message=log_message, log_type=log_type)
+                           for group, round_configuration, log_message in group_activity_logs if log_message]
+    if not group_activity_logs:
+        return []
+    activity_logs = ActivityLog.objects.bulk_create([ActivityLog(log_message=gal.log_message, log_type=gal.log_type)
+                                                     for gal in group_activity_logs])
+    for gal, activity_log in zip(group_activity_logs, activity_logs):
+        logger.debug(gal.log_message)
+        gal.activitylog_ptr = activity_log
+        gal.pk = activity_log.pk
+        gal.date_created = activity_log.date_created
+    GroupActivityLog._base_manager._insert(group_activity_logs, fields=GroupActivityLog._meta.local_concrete_fields,
+                                           using=GroupActivityLog.objects.db)
+    return group_activity_logs
+
+
+def copy_model_instance(instance, **kwargs):
+    """
+    returns an unsaved copy of the given model instance with all concrete, non primary key field values, overridden
+    by the given kwargs
+    """
+    model = type(instance)
+    copy = model(**{f.attname: getattr(instance, f.attname) for f in model._meta.concrete_fields
+                    if not f.primary_key})
+    for name, value in kwargs.items():
+        setattr(copy, name, value)
+    return copy
+
+
+def copy_data_value(data_value, round_data):
+    """ returns an unsaved copy of the given data value for the given round data """
+    return copy_model_instance(data_value, round_data=round_data)
+
+
+class DataValueUnitOfWork(object):
+
+    """
+    Opt-in unit of work for participant, group and group cluster data values, e.g.,
+
+        with DataValueUnitOfWork():
+            for pgr in group.participant_group_relationship_set.all():
+                storage_dv = pgr.get_data_value(parameter=get_storage_parameter())
+                storage_dv.update_int(storage_dv.int_value + harvest)
+                pgr.copy_to_next_round(storage_dv)
+
+    Within it, DataValueMixin.get_data_value returns the same instance for a given owner, parameter and round data
+    and creates missing data values in memory. ParameterizedValue updates and DataValueMixin.copy_to_next_round are
+    buffered and written when the unit of work exits, with one INSERT per data value model and one UPDATE per
+    modified field, inside the transaction that the unit of work runs in. Querysets and aggregates don't see buffered
+    writes, call flush() before running them. Nested units of work join the outermost one.
+
+    Buffered writes don't send post_save signals; signals.data_values_flushed is sent with the written data values
+    after every flush instead.
+    """
+
+    _local = threading.local()
+
+    def __init__(self):
+        # (owner model, owner pk, parameter pk, round data pk) -> data value
+        self.identity_map = {}
+        # unsaved data values and next round copies
+        self.new_data_values = []
+        self.new_data_value_ids = set()
+        # (data value model, pk) -> (data value, set of modified field names)
+        self.updated_data_values = {}
+        self.atomic = None
+
+    @classmethod
+    def get_current(cls):
+        return getattr(cls._local, 'current', None)
+
+    @staticmethod
+    def get_key(owner, parameter, round_data):
+        return (type(owner), owner.pk, parameter.pk, round_data.pk)
+
+    @staticmethod
+    def tracks(data_value):
+        # multi-table subclasses like ChatMessage can't be bulk created and are saved immediately
+        return type(data_value) in (ParticipantRoundDataValue, GroupRoundDataValue, GroupClusterDataValue)
+
+    def add(self, data_value):
+        if id(data_value) not in self.new_data_value_ids:
+            self.new_data_value_ids.add(id(data_value))
+            self.new_data_values.append(data_value)
+
+    def register_update(self, data_value, *field_names):
+        if data_value.pk is None:
+            # written in full by the bulk INSERT
+            self.add(data_value)
+        else:
+            data_value, updated_fields = self.updated_data_values.setdefault((type(data_value), data_value.pk),
+                                                                             (data_value, set()))
+            updated_fields.update(field_names)
+
+    def copy_to_next_round(self, data_values, next_round_data):
+        for data_value in data_values:
+            self.add(copy_data_value(data_value, next_round_data))
+
+    def flush(self):
+        new_data_values = defaultdict(list)
+        for dv in self.new_data_values:
+            new_data_values[type(dv)].append(dv)
+        for model, dvs in new_data_values.items():
+            model.objects.bulk_create(dvs)
+        updated_values = defaultdict(dict)
+        for (model, pk), (dv, field_names) in self.updated_data_values.items():
+            for field_name in field_names:
+                # converted as save() would, e.g., int truncation
+                field = model._meta.get_field(field_name)
+                updated_values[(model, field_name)][pk] = field.get_prep_value(getattr(dv, field_name))
+        for (model, field_name), values in updated_values.items():
+            bulk_update_data_values(model, field_name, values)
+        flushed_data_values = self.new_data_values + [dv for dv, field_names in self.updated_data_values.values()]
+        logger.debug("flushed %d new and %d updated data values", len(self.new_data_values),
+                     len(self.updated_data_values))
+        self.new_data_values = []
+        self.new_data_value_ids = set()
+        self.updated_data_values = {}
+        if flushed_data_values:
+            signals.data_values_flushed.send(sender=DataValueUnitOfWork, data_values=flushed_data_values)
+
+    def __enter__(self):
+        current = self.get_current()
+        if current is not None:
+            return current
+        self.atomic = transaction.atomic()
+        self.atomic.__enter__()
+        self._local.current = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.atomic is None:
+            # joined an enclosing unit of work
+            return False
+        atomic, self.atomic = self.atomic, None
+        self._local.current = None
+        if exc_type is None:
+            try:
+                self.flush()
+            except Exception:
+                atomic.__exit__(*sys.exc_info())
+                raise
+        return atomic.__exit__(exc_type, exc_value, traceback)
+
+
 class ExperimentParameterValue(ParameterizedValue):
     """ Represents an experiment configuration parameter applicable across the entire experiment """
     experiment_configuration = models.ForeignKey(ExperimentConfiguration, related_name='parameter_value_set')
@@ -2321,30 +2848,34 @@ class ExperimentGroup(models.Model, DataValueMixin):
         return self.get_data_value(parameter=parameter, **kwargs).value
 
     def get_round_configuration_value(self, parameter=None, name=None, current_round_configuration=None, **kwargs):
+        """
+        returns the RoundParameterValue for the given parameter in the current round from the cached configuration
+        snapshot, or None if there isn't one
+        """
         if current_round_configuration is None:
             current_round_configuration = self.current_round
-        round_configuration_value = None
+        if parameter is None and name is None:
+            logger.warn("No parameter or parameter name specified: %s", kwargs)
+            return None
         try:
-            if parameter is not None:
-                round_configuration_value = RoundParameterValue.objects.get(
-                    parameter=parameter, round_configuration=current_round_configuration)
-            elif name is not None:
-                round_configuration_value = RoundParameterValue.objects.get(
-                    parameter__name=name,
-                    round_configuration=current_round_configuration)
-            else:
-                logger.warn("No parameter or parameter name specified: %s", **kwargs)
-        except:
+            round_configuration_value = current_round_configuration.read_parameter_value(parameter=parameter,
+                                                                                         name=name)
+        except Parameter.DoesNotExist:
+            round_configuration_value = None
+        if round_configuration_value is None or isinstance(round_configuration_value, DefaultValue):
             logger.debug("no round configuration value found for parameter (%s, %s) in round: %s", parameter, name,
                          current_round_configuration)
+            return None
         return round_configuration_value
 
     def _criteria(self, parameter=None, parameter_name=None, round_data=None, **kwargs):
         if round_data is None:
             round_data = self.current_round_data
+        if parameter is None and parameter_name is not None:
+            parameter = parameter_registry.get(name=parameter_name)
         criteria = dict([
             ('is_active', True),
-            ('parameter', parameter) if parameter else ('parameter__name', parameter_name),
+            ('parameter', parameter),
             ('round_data', round_data)
         ])
         criteria.update(kwargs)
@@ -2454,6 +2985,124 @@ class GroupRelationship(models.Model):
         ordering = ['date_created']
 
 
+class GroupAllocator(object):
+
+    """
+    Allocates an experiment's participants to fresh groups of at most max group size participants and optionally
+    clusters those groups. The group and cluster layout is computed in memory from the (by default shuffled) list of
+    participants and written with one bulk_create per model. Participants end up in the same groups, with the same
+    participant numbers, as when they are added one at a time via ExperimentGroup.add_participant.
+    """
+
+    def __init__(self, experiment, round_configuration=None, randomize=True):
+        self.experiment = experiment
+        self.round_configuration = experiment.current_round if round_configuration is None else round_configuration
+        self.randomize = randomize
+        self.session_id = self.round_configuration.session_id or ''
+        # cap max group size at 1 for private practice rounds
+        if self.round_configuration.is_private_practice_round:
+            self.max_group_size = 1
+        else:
+            self.max_group_size = experiment.experiment_configuration.max_group_size
+
+    @staticmethod
+    def partition(items, size):
+        """ splits items into consecutive chunks of size items, the last chunk may be smaller """
+        return [items[index:index + size] for index in range(0, len(items), size)]
+
+    @transaction.atomic
+    def allocate(self):
+        """ returns the list of newly created groups """
+        participants = list(self.experiment.participant_set.all())
+        logger.debug("%s allocating groups for %d participants with session_id %s (randomize? %s)",
+                     self.experiment, len(participants), self.session_id, self.randomize)
+        if self.randomize:
+            random.shuffle(participants)
+        self.clear_existing_groups()
+        groups = self.create_groups(participants)
+        # Groups have all been populated. Check if group clusters should be created to share data across multiple
+        # groups.
+        self.create_group_clusters()
+        return groups
+
+    def clear_existing_groups(self):
+        e = self.experiment
+        if not e.group_set.exists():
+            return
+        # groups already exist, preserve or delete them
+        # FIXME: would be safer to always preserve as it doesn't carry any risk of data loss, could autogenerate
+        # a session id if one isn't found.
+        if self.round_configuration.preserve_existing_groups:
+            logger.debug("preserving existing groups")
+            if not self.session_id:
+                logger.error("Cannot create a new set of groups because no session id has been set on %s.",
+                             self.round_configuration)
+                raise ValueError("Cannot preserve existing groups without round_configuration.session id {0}".format(
+                    self.round_configuration))
+        else:
+            logger.debug("deleting existing groups")
+            memberships = defaultdict(list)
+            for pgr in ParticipantGroupRelationship.objects.select_related('group', 'participant__user').filter(
+                    group__experiment=e).order_by('group__number', 'group', 'participant_number'):
+                memberships[pgr.group].append(pgr.participant)
+            e.log("reallocating/deleting groups {0}".format('; '.join(
+                "{0}: {1}".format(group, ', '.join(str(participant) for participant in participants))
+                for group, participants in memberships.items())))
+            e.group_set.all().delete()
+
+    def create_groups(self, participants):
+        if self.max_group_size > 0:
+            # always create at least one group
+            members = self.partition(participants, self.max_group_size) or [[]]
+        else:
+            # unlimited group size
+            members = [participants]
+        e = self.experiment
+        groups = ExperimentGroup.objects.bulk_create([
+            ExperimentGroup(number=number, max_size=self.max_group_size, experiment=e, session_id=self.session_id)
+            for number in range(1, len(members) + 1)
+        ])
+        round_joined = e.current_round
+        pgrs = ParticipantGroupRelationship.objects.bulk_create([
+            ParticipantGroupRelationship(participant=participant, group=group, round_joined=round_joined,
+                                         participant_number=participant_number)
+            for group, group_members in zip(groups, members)
+            for participant_number, participant in enumerate(group_members, start=1)
+        ])
+        for pgr in pgrs:
+            signals.participant_added.send_robust(pgr.group, experiment=e, time=datetime.now(),
+                                                  participant_group_relationship=pgr)
+        return groups
+
+    def create_group_clusters(self):
+        rc = self.round_configuration
+        if not rc.create_group_clusters:
+            return []
+        session_id = rc.session_id
+        e = self.experiment
+        logger.debug("deleting existing group clusters and creating anew with session id %s", session_id)
+        e.group_cluster_set.filter(session_id=session_id).delete()
+        groups = list(e.group_set.filter(session_id=session_id))
+        group_cluster_size = rc.group_cluster_size
+        if len(groups) % group_cluster_size != 0:
+            logger.error("cannot create clusters with %s groups per cluster with %s groups, not evenly divisible",
+                         group_cluster_size, len(groups))
+            return []
+        random.shuffle(groups)
+        logger.debug("creating group clusters with %s groups per cluster", group_cluster_size)
+        cluster_groups = self.partition(groups, group_cluster_size)
+        group_clusters = GroupCluster.objects.bulk_create([
+            GroupCluster(experiment=e, session_id=session_id, name=clustered_groups[0].identifier)
+            for clustered_groups in cluster_groups
+        ])
+        GroupRelationship.objects.bulk_create([
+            GroupRelationship(cluster=group_cluster, group=group)
+            for group_cluster, clustered_groups in zip(group_clusters, cluster_groups)
+            for group in clustered_groups
+        ])
+        return group_clusters
+
+
 class RoundData(models.Model):
     """
     round-specific data for a given experiment.  Contains related sets to group_data
@@ -2486,6 +3135,15 @@ class RoundData(models.Model):
     def session_id(self):
         return self.round_configuration.session_id
 
+    @property
+    def cache_key(self):
+        return RoundData.get_cache_key(self.experiment_id, self.round_configuration.sequence_number,
+                                       self.repeating_round_sequence_number)
+
+    @staticmethod
+    def get_cache_key(experiment_pk, sequence_number, repeating_round_sequence_number=0):
+        return "round_data:{0}:{1}:{2}".format(experiment_pk, sequence_number, repeating_round_sequence_number)
+
     def __str__(self):
         return "Data for round {0}".format(self.round_number)
 
@@ -2494,6 +3152,167 @@ class RoundData(models.Model):
         unique_together = (('round_configuration', 'repeating_round_sequence_number', 'experiment'),)
 
 
+class ReadyParticipantsCounter(object):
+
+    """
+    Redis set of the participant group relationship pks that are ready in a given round data, kept alongside the
+    participant ready data values so that ready counts are a single SCARD instead of a COUNT query. A sentinel member
+    distinguishes an initialized empty set from a missing key, missing keys are rebuilt from the database.
+    """
+
+    SENTINEL = '-'
+
+    # only add to initialized sets, returns the number of ready participants or -1 if the set needs to be rebuilt
+    ADD_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return -1
+end
+redis.call('SADD', KEYS[1], unpack(ARGV))
+return redis.call('SCARD', KEYS[1]) - 1
+"""
+
+    def __init__(self, round_data):
+        self.round_data = round_data
+
+    @staticmethod
+    def redis():
+        return RedisPubSub.get_redis_instance()
+
+    @staticmethod
+    def get_key(round_data_pk):
+        return 'ready_participants.{0}'.format(round_data_pk)
+
+    @property
+    def key(self):
+        return ReadyParticipantsCounter.get_key(self.round_data.pk)
+
+    def count(self):
+        number_of_members = self.redis().scard(self.key)
+        if number_of_members == 0:
+            return self.rebuild()
+        return number_of_members - 1
+
+    def rebuild(self):
+        ready_pgr_ids = set(ParticipantRoundDataValue.objects.filter(
+            parameter=get_participant_ready_parameter(),
+            round_data=self.round_data,
+            boolean_value=True,
+        ).values_list('participant_group_relationship', flat=True))
+        pipe = self.redis().pipeline()
+        pipe.sadd(self.key, ReadyParticipantsCounter.SENTINEL, *ready_pgr_ids)
+        pipe.expire(self.key, settings.READY_PARTICIPANTS_TTL)
+        pipe.execute()
+        return len(ready_pgr_ids)
+
+    def add(self, *participant_group_relationship_ids):
+        if not participant_group_relationship_ids:
+            return self.count()
+        number_ready = self.redis().eval(ReadyParticipantsCounter.ADD_SCRIPT, 1, self.key,
+                                         *participant_group_relationship_ids)
+        if number_ready < 0:
+            return self.rebuild()
+        return number_ready
+
+    def reset(self):
+        self.redis().delete(self.key)
+
+
+class ReadyStatusPublisher(object):
+
+    """
+    Coalesces participant ready broadcasts for an experiment into at most one aggregated participant_ready event per
+    channel every settings.READY_STATUS_INTERVAL seconds. Ready events within an interval are folded into a single
+    trailing event carrying the latest count, and the event where all participants are ready is always sent
+    immediately. Trailing events are scheduled in Redis rather than in the web worker so that they survive worker
+    restarts, and are sent by the sockjs server or the next participant ready request, see flush_due.
+    """
+
+    DUE = 'ready_status.due'
+    """ Redis sorted set of scheduled trailing events, scored by the unix time they are due """
+
+    def __init__(self, experiment, round_data=None):
+        self.experiment_pk = experiment.pk
+        if round_data is None:
+            round_data = experiment.current_round_data
+        self.counter = ReadyParticipantsCounter(round_data)
+
+    @staticmethod
+    def redis():
+        return RedisPubSub.get_redis_instance()
+
+    @staticmethod
+    def get_throttle_key(experiment_pk):
+        return 'ready_status.{0}.sent'.format(experiment_pk)
+
+    @property
+    def throttle_key(self):
+        return ReadyStatusPublisher.get_throttle_key(self.experiment_pk)
+
+    @property
+    def pending_key(self):
+        return 'ready_status.{0}.pending'.format(self.experiment_pk)
+
+    def publish(self, number_of_ready_participants, number_of_participants):
+        """ returns True if a ready status event was sent immediately, False if it was deferred or dropped """
+        interval = int(settings.READY_STATUS_INTERVAL * 1000)
+        r = self.redis()
+        ReadyStatusPublisher.flush_due()
+        if (interval <= 0 or number_of_ready_participants >= number_of_participants or
+                r.set(self.throttle_key, 1, nx=True, px=interval)):
+            self.send(self.experiment_pk, number_of_ready_participants, number_of_participants)
+            return True
+        if r.set(self.pending_key, 1, nx=True, px=interval):
+            # first deferred event in this interval, schedule the trailing event for when the interval ends
+            due = timezone.now().timestamp() + max(r.pttl(self.throttle_key), 0) / 1000.0
+            event = '{0}:{1}:{2}'.format(self.experiment_pk, self.counter.round_data.pk, number_of_participants)
+            r.zadd(ReadyStatusPublisher.DUE, {event: due})
+        return False
+
+    @staticmethod
+    def flush_due(now=None):
+        """
+        Sends every scheduled trailing event that is due and returns the number sent. Safe to call concurrently from
+        any number of processes, each event is claimed by exactly one caller.
+        """
+        r = ReadyStatusPublisher.redis()
+        if now is None:
+            now = timezone.now().timestamp()
+        number_sent = 0
+        for event in r.zrangebyscore(ReadyStatusPublisher.DUE, '-inf', now):
+            if not r.zrem(ReadyStatusPublisher.DUE, event):
+                continue
+            experiment_pk, round_data_pk, number_of_participants = (int(v) for v in event.decode('utf-8').split(':'))
+            try:
+                number_of_ready_participants = r.scard(ReadyParticipantsCounter.get_key(round_data_pk)) - 1
+                # a missing ready set means the round has since ended
+                if number_of_ready_participants >= 0:
+                    r.set(ReadyStatusPublisher.get_throttle_key(experiment_pk), 1,
+                          px=int(settings.READY_STATUS_INTERVAL * 1000))
+                    ReadyStatusPublisher.send(experiment_pk, number_of_ready_participants, number_of_participants)
+                    number_sent += 1
+            except Exception:
+                logger.exception("unable to send trailing ready status for experiment %s", experiment_pk)
+        return number_sent
+
+    @staticmethod
+    def send(experiment_pk, number_of_ready_participants, number_of_participants):
+        all_participants_ready = number_of_ready_participants >= number_of_participants
+        event = dumps({
+            'event_type': 'participant_ready',
+            'message': "%s of %s participants are ready." % (number_of_ready_participants, number_of_participants),
+            'number_of_ready_participants': number_of_ready_participants,
+            'number_of_participants': number_of_participants,
+            'all_participants_ready': all_participants_ready,
+        })
+        RedisPubSub.publish(RedisPubSub.get_participant_broadcast_channel(experiment_pk), event)
+        RedisPubSub.publish(RedisPubSub.get_experimenter_channel(experiment_pk), event)
+        if all_participants_ready:
+            RedisPubSub.publish(RedisPubSub.get_experimenter_channel(experiment_pk), dumps({
+                'event_type': 'info',
+                'message': "All participants are ready to move on to the next round.",
+            }))
+
+
 class GroupClusterDataValue(ParameterizedValue):
     group_cluster = models.ForeignKey(GroupCluster, related_name='data_value_set')
     round_data = models.ForeignKey(RoundData, related_name='group_cluster_data_value_set')
@@ -2563,21 +3382,19 @@ class ParticipantQuerySet(models.query.QuerySet):
 
     def invitation_eligible(self, experiment_metadata_pk, only_undergrad=True, gender=None,
                             port_of_mars=False, institution_name=None, institution=None):
-        # invited_in_last_threshold_days contains all Invitations that were generated in last threshold days for the
-        # given Experiment metadata
-        invited_in_last_threshold_days = Invitation.objects.already_invited(
-            experiment_metadata_pk=experiment_metadata_pk).values_list('participant__pk', flat=True)
-
-        # already_participated is the list of participants who has already participated in the
-        # given Experiment Metadata(in the past or currently participating)
+        """
+        Returns the participants that can be invited to sessions of the given experiment metadata. Ineligible
+        participants, i.e., those who have already received invitations in the last threshold days, have already
+        participated in the same experiment, or have 'mailinator.com' in their email, are excluded with correlated
+        NOT EXISTS subqueries so the eligible set can be counted or sampled without leaving the database.
+        """
+        # recently_invited: Invitations that were generated in last threshold days for the given Experiment metadata
+        recently_invited = Invitation.objects.already_invited(
+            experiment_metadata_pk=experiment_metadata_pk).filter(participant=models.OuterRef('pk'))
+        # already_participated: signups of participants who have already participated in the given Experiment
+        # Metadata (in the past or currently participating)
         already_participated = ParticipantSignup.objects.registered_or_participated(
-            experiment_metadata_pk=experiment_metadata_pk).values_list('invitation__participant__pk', flat=True)
-
-        invalid_participants = self.invalid_participants().values_list('pk', flat=True)
-        # a list of participant pks who have already received invitations in last threshold days, have already
-        # participated in the same experiment, or have 'mailinator.com' in their name
-        ineligible_participants = list(set(itertools.chain(invited_in_last_threshold_days,
-                                                           already_participated, invalid_participants)))
+            experiment_metadata_pk=experiment_metadata_pk).filter(invitation__participant=models.OuterRef('pk'))
 
         criteria = dict(can_receive_invitations=True, user__is_active=True)
         if port_of_mars:
@@ -2595,7 +3412,18 @@ class ParticipantQuerySet(models.query.QuerySet):
         if gender in ('M', 'F'):
             criteria.update(gender=gender)
 
-        return self.filter(**criteria).exclude(pk__in=ineligible_participants)
+        return self.annotate(
+            recently_invited=models.Exists(recently_invited.values('pk')),
+            already_participated=models.Exists(already_participated.values('pk')),
+        ).filter(recently_invited=False, already_participated=False, **criteria).exclude(
+            user__email__contains='mailinator.com')
+
+    def random_sample(self, size):
+        """
+        Returns at most size participants chosen uniformly at random by the database (ORDER BY RANDOM() LIMIT size)
+        with their users, instead of materializing every candidate for random.sample
+        """
+        return self.select_related('user').order_by('?')[:size]
 
 
 class Participant(CommonsUser):
@@ -2737,17 +3565,192 @@ class ParticipantExperimentRelationship(models.Model):
         a no-op if participant_identifier is already set.
         """
         if not self.participant_identifier:
-            sha1 = hashlib.sha1()
-            sha1.update(self.participant.email.encode('utf-8'))
-            self.participant_identifier = sha1.hexdigest()
+            self.participant_identifier = ParticipantExperimentRelationship.make_participant_identifier(
+                self.participant.email)
             self.sequential_participant_identifier = self.experiment.participant_set.count() + 1
         return self.participant_identifier
 
+    @staticmethod
+    def make_participant_identifier(email):
+        sha1 = hashlib.sha1()
+        sha1.update(email.encode('utf-8'))
+        return sha1.hexdigest()
+
     def __str__(self):
         return "Experiment {0} - participant {1} (created {2})".format(self.experiment, self.participant,
                                                                        self.date_created)
 
 
+def make_passwords(raw_passwords):
+    """
+    Returns salted hashes of the given raw passwords. PBKDF2 hashing runs in hashlib.pbkdf2_hmac, which releases the
+    GIL, so larger batches are spread over a pool of PASSWORD_HASHING_THREADS threads. Threads are used instead of
+    processes since forking a multi-threaded uWSGI worker can deadlock. Call this outside of database transactions.
+    """
+    raw_passwords = list(raw_passwords)
+    if len(raw_passwords) < settings.PASSWORD_HASHING_POOL_THRESHOLD:
+        return [make_password(raw_password) for raw_password in raw_passwords]
+    threads = min(settings.PASSWORD_HASHING_THREADS or os.cpu_count() or 1, len(raw_passwords))
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        return list(executor.map(make_password, raw_passwords))
+
+
+class ParticipantProvisioner(object):
+
+    """
+    Creates Users, Participants and ParticipantExperimentRelationships in bulk. Existing users are resolved with a
+    single query on their email addresses and usernames, missing rows are written with one bulk_create per model and
+    passwords are hashed with make_passwords before the database transaction starts, instead of a select_for_update,
+    create_user and set_password per participant.
+    """
+
+    def __init__(self, experiment=None, institution=None, password=None, permission_group=PermissionGroup.participant):
+        self.experiment = experiment
+        self.institution = institution
+        self.password = password
+        self.permission_group = permission_group
+
+    @staticmethod
+    def parse_emails(emails):
+        """ returns a list of unique (email address, full name) tuples for the given RFC 2822 email lines """
+        addresses = []
+        for email_line in emails:
+            if not email_line:
+                logger.debug("invalid participant data: %s", email_line)
+                continue
+            # FIXME: parsing logic was already performed once in EmailListField.clean, this is redundant
+            (full_name, email_address) = parseaddr(email_line)
+            # lowercase all usernames/email addresses internally and strip all whitespace
+            addresses.append((email_address.lower().strip(), full_name.strip()))
+        return addresses
+
+    def generate_passwords(self, count):
+        """ returns a list of count (raw password, hashed password) tuples, random unless a password was given """
+        if self.password is None or not self.password.strip():
+            raw_passwords = [User.objects.make_random_password() for i in range(count)]
+        else:
+            raw_passwords = [self.password] * count
+        return list(zip(raw_passwords, make_passwords(raw_passwords)))
+
+    def create_users(self, emails):
+        addresses = self.parse_emails(emails)
+        passwords = self.generate_passwords(len(addresses))
+        with transaction.atomic():
+            users = self.get_or_create_users(addresses, [hashed for raw, hashed in passwords])
+        return list(users.values())
+
+    def register_emails(self, emails):
+        return self.register_addresses(self.parse_emails(emails))
+
+    def register_addresses(self, addresses):
+        """
+        Registers (email address, full name) tuples with the experiment, creating Users for unknown email addresses,
+        and returns a list of (ParticipantExperimentRelationship, raw password) tuples.
+        """
+        passwords = self.generate_passwords(len(addresses))
+        with transaction.atomic():
+            users = self.get_or_create_users(addresses, [hashed for raw, hashed in passwords])
+            # duplicate email addresses keep the password of their first occurrence, as in get_or_create_users
+            raw_passwords = {}
+            for (email_address, full_name), (raw, hashed) in zip(addresses, passwords):
+                raw_passwords.setdefault(email_address, raw)
+            return self.register([(user, raw_passwords[email_address]) for email_address, user in users.items()])
+
+    def register_users(self, users):
+        """ registers existing users with the experiment, resetting their passwords """
+        users = list(users)
+        passwords = self.generate_passwords(len(users))
+        for user, (raw, hashed) in zip(users, passwords):
+            user.password = hashed
+        with transaction.atomic():
+            self.update_field(User, 'password', {user.pk: user.password for user in users})
+            return self.register([(user, raw) for user, (raw, hashed) in zip(users, passwords)])
+
+    @staticmethod
+    def update_field(model, field_name, values):
+        """ sets field_name on each row in values (a dict of pk -> value) with a single UPDATE ... CASE statement """
+        if not values:
+            return 0
+        cases = [When(pk=pk, then=Value(value)) for pk, value in values.items()]
+        return model.objects.filter(pk__in=list(values)).update(
+            **{field_name: Case(*cases, output_field=model._meta.get_field(field_name))})
+
+    def get_or_create_users(self, addresses, hashed_passwords):
+        """
+        Returns an ordered dict of email address -> User for the given (email address, full name) tuples. Existing
+        users get the given hashed passwords and any missing names, unknown email addresses get new Users. Duplicate
+        email addresses resolve to the same User.
+        """
+        email_addresses = [email_address for email_address, full_name in addresses]
+        existing_users = {}
+        for user in User.objects.filter(models.Q(email__in=email_addresses) | models.Q(username__in=email_addresses)):
+            existing_users.setdefault(user.email, user)
+            existing_users.setdefault(user.username, user)
+        users = OrderedDict()
+        new_users = []
+        updated_fields = defaultdict(dict)
+        for (email_address, full_name), hashed_password in zip(addresses, hashed_passwords):
+            if email_address in users:
+                continue
+            user = existing_users.get(email_address)
+            if user is None:
+                user = User(username=User.normalize_username(email_address), email=email_address,
+                            password=hashed_password)
+                set_full_name(user, full_name)
+                new_users.append(user)
+            else:
+                user.password = hashed_password
+                updated_fields['password'][user.pk] = hashed_password
+                if set_full_name(user, full_name):
+                    updated_fields['first_name'][user.pk] = user.first_name
+                    updated_fields['last_name'][user.pk] = user.last_name
+            users[email_address] = user
+        User.objects.bulk_create(new_users)
+        for field_name, values in updated_fields.items():
+            self.update_field(User, field_name, values)
+        if self.permission_group is not None:
+            self.add_to_group(list(users.values()), self.permission_group.get_django_group())
+        return users
+
+    @staticmethod
+    def add_to_group(users, group):
+        UserGroup = User.groups.through
+        members = set(UserGroup.objects.filter(group=group, user__in=users).values_list('user', flat=True))
+        UserGroup.objects.bulk_create([UserGroup(user_id=user.pk, group_id=group.pk)
+                                       for user in users if user.pk not in members])
+
+    def register(self, users):
+        """
+        Creates missing Participants for the given (User, raw password) tuples and relates them to the experiment,
+        returns a list of (ParticipantExperimentRelationship, raw password) tuples.
+        """
+        user_ids = [user.pk for user, raw_password in users]
+        participants = {p.user_id: p for p in Participant.objects.filter(user__in=user_ids)}
+        if self.institution is not None:
+            Participant.objects.filter(pk__in=[p.pk for p in participants.values()]).exclude(
+                institution=self.institution).update(institution=self.institution)
+            for p in participants.values():
+                p.institution = self.institution
+        new_participants = [Participant(user=user, institution=self.institution)
+                            for user, raw_password in users if user.pk not in participants]
+        participants.update((p.user_id, p) for p in Participant.objects.bulk_create(new_participants))
+        creator = self.experiment.experimenter.user
+        sequence_number = self.experiment.participant_set.count()
+        relationships = []
+        for user, raw_password in users:
+            participant = participants[user.pk]
+            participant.user = user
+            sequence_number += 1
+            relationships.append(ParticipantExperimentRelationship(
+                participant=participant, experiment_id=self.experiment.pk, created_by=creator,
+                participant_identifier=ParticipantExperimentRelationship.make_participant_identifier(user.email),
+                sequential_participant_identifier=sequence_number))
+        relationships = ParticipantExperimentRelationship.objects.bulk_create(relationships)
+        for per in relationships:
+            per.experiment = self.experiment
+        return list(zip(relationships, (raw_password for user, raw_password in users)))
+
+
 class ParticipantGroupRelationshipQuerySet(models.query.QuerySet):
 
     def for_experiment(self, experiment, **kwargs):
@@ -2827,6 +3830,7 @@ class ParticipantGroupRelationship(models.Model, DataValueMixin):
         dv.submitted = True
         dv.boolean_value = True
         dv.save()
+        ReadyParticipantsCounter(round_data).add(self.pk)
         return dv
 
     def get_round_configuration_value(self, **kwargs):
@@ -3115,6 +4119,7 @@ class ExperimentSession(models.Model):
 
         if existing_invitation.signup_set.exists():
             existing_invitation.signup_set.update(attendance=attendance)
+            SessionSeatReservations(self).invalidate()
         else:
             ParticipantSignup.objects.create(invitation=existing_invitation, attendance=attendance)
 
@@ -3315,6 +4320,165 @@ class ParticipantSignup(models.Model):
         ordering = ['invitation__experiment_session']
 
 
+class SessionSeatReservations(object):
+
+    """
+    Redis hash of the registered and waitlisted seats of an experiment session, so that concurrent signups claim seats
+    with one atomic script instead of counting ParticipantSignups under a lock. The hash holds the registered and
+    waitlist counts and the seat of each participant, i.e., participant.<pk> -> registered | waitlist. Reservations are
+    written to ParticipantSignups by the caller, missing or stale hashes are rebuilt from those signups.
+
+    A reservation is only visible in the database once the caller has saved its ParticipantSignup, so every seat handed
+    out is also recorded in a pending hash for settings.SUBJECT_POOL_SEAT_PENDING_TTL seconds. Rebuilds merge the
+    pending seats into the seats read from the database, and invalidate() only marks the hash stale so that no
+    reservations are taken while the rebuild is outstanding. Flushing the whole Redis database still loses the seats in
+    flight at that moment.
+    """
+
+    REGISTERED = 'registered'
+    WAITLIST = 'waitlist'
+    STALE = 'stale'
+
+    # returns 1 for a registered seat, 2 for a waitlist seat, 0 if the session is full or -1 if the hash needs to be
+    # rebuilt. Reserving is idempotent and moves waitlisted participants into open seats.
+    # KEYS[1]: seats hash, KEYS[2]: pending seats hash, ARGV: participant pk, capacity, waitlist capacity, ttl,
+    # current timestamp, pending ttl
+    RESERVE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 or redis.call('HEXISTS', KEYS[1], 'stale') == 1 then
+    return -1
+end
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+local member = 'participant.' .. ARGV[1]
+local current = redis.call('HGET', KEYS[1], member)
+local seat = nil
+if current == 'registered' then
+    seat = 'registered'
+elseif tonumber(redis.call('HGET', KEYS[1], 'registered')) < tonumber(ARGV[2]) then
+    if current == 'waitlist' then
+        redis.call('HINCRBY', KEYS[1], 'waitlist', -1)
+    end
+    redis.call('HINCRBY', KEYS[1], 'registered', 1)
+    redis.call('HSET', KEYS[1], member, 'registered')
+    seat = 'registered'
+elseif current == 'waitlist' then
+    seat = 'waitlist'
+elseif tonumber(redis.call('HGET', KEYS[1], 'waitlist')) < tonumber(ARGV[3]) then
+    redis.call('HINCRBY', KEYS[1], 'waitlist', 1)
+    redis.call('HSET', KEYS[1], member, 'waitlist')
+    seat = 'waitlist'
+else
+    return 0
+end
+redis.call('HSET', KEYS[2], member, seat .. ':' .. (tonumber(ARGV[5]) + tonumber(ARGV[6])))
+redis.call('EXPIRE', KEYS[2], ARGV[6])
+if seat == 'registered' then
+    return 1
+end
+return 2
+"""
+
+    # frees the participant's seat and returns it, if any. KEYS[1]: seats hash, KEYS[2]: pending seats hash,
+    # ARGV[1]: participant pk
+    RELEASE_SCRIPT = """
+local member = 'participant.' .. ARGV[1]
+redis.call('HDEL', KEYS[2], member)
+local current = redis.call('HGET', KEYS[1], member)
+if current then
+    redis.call('HINCRBY', KEYS[1], current, -1)
+    redis.call('HDEL', KEYS[1], member)
+end
+return current
+"""
+
+    # only replaces missing or stale hashes so that concurrent rebuilds cannot drop reservations made in between, and
+    # adds the pending seats whose signups may not have been written yet.
+    # KEYS[1]: seats hash, KEYS[2]: pending seats hash, ARGV: ttl, current timestamp, followed by participant member,
+    # seat pairs
+    REBUILD_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 and redis.call('HEXISTS', KEYS[1], 'stale') == 0 then
+    return 0
+end
+local seats = {}
+for index = 3, #ARGV, 2 do
+    seats[ARGV[index]] = ARGV[index + 1]
+end
+local pending = redis.call('HGETALL', KEYS[2])
+for index = 1, #pending, 2 do
+    local seat, expires = string.match(pending[index + 1], '^(%a+):(%d+)$')
+    if tonumber(expires) > tonumber(ARGV[2]) then
+        seats[pending[index]] = seat
+    else
+        redis.call('HDEL', KEYS[2], pending[index])
+    end
+end
+local counts = {registered = 0, waitlist = 0}
+redis.call('DEL', KEYS[1])
+for member, seat in pairs(seats) do
+    counts[seat] = counts[seat] + 1
+    redis.call('HSET', KEYS[1], member, seat)
+end
+redis.call('HSET', KEYS[1], 'registered', counts['registered'])
+redis.call('HSET', KEYS[1], 'waitlist', counts['waitlist'])
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return 1
+"""
+
+    def __init__(self, experiment_session):
+        self.experiment_session = experiment_session
+
+    @staticmethod
+    def redis():
+        return RedisPubSub.get_redis_instance()
+
+    @property
+    def key(self):
+        return 'session_seats.{0}'.format(self.experiment_session.pk)
+
+    @property
+    def pending_key(self):
+        return 'session_seats.{0}.pending'.format(self.experiment_session.pk)
+
+    def reserve(self, participant):
+        """
+        Claims a registered seat, or a waitlist seat when the session is full, for the given participant. Returns the
+        matching ParticipantSignup.ATTENDANCE value or None if both the session and its waitlist are full.
+        """
+        experiment_session = self.experiment_session
+        for attempt in range(2):
+            seat = self.redis().eval(SessionSeatReservations.RESERVE_SCRIPT, 2, self.key, self.pending_key,
+                                     participant.pk, experiment_session.capacity, experiment_session.waitlist_capacity,
+                                     settings.SUBJECT_POOL_SEAT_RESERVATION_TTL, int(timezone.now().timestamp()),
+                                     settings.SUBJECT_POOL_SEAT_PENDING_TTL)
+            if seat >= 0:
+                return {1: ParticipantSignup.ATTENDANCE.registered, 2: ParticipantSignup.ATTENDANCE.waitlist}.get(seat)
+            self.rebuild()
+        logger.error("unable to reserve a seat in %s for %s", experiment_session, participant)
+        return None
+
+    def release(self, participant):
+        self.redis().eval(SessionSeatReservations.RELEASE_SCRIPT, 2, self.key, self.pending_key, participant.pk)
+
+    def rebuild(self):
+        seats = {}
+        for participant_pk, attendance in ParticipantSignup.objects.registered_or_waitlisted(
+                experiment_session_pk=self.experiment_session.pk).values_list('invitation__participant', 'attendance'):
+            seat = (SessionSeatReservations.REGISTERED if attendance == ParticipantSignup.ATTENDANCE.registered
+                    else SessionSeatReservations.WAITLIST)
+            seats['participant.{0}'.format(participant_pk)] = seat
+        self.redis().eval(SessionSeatReservations.REBUILD_SCRIPT, 2, self.key, self.pending_key,
+                          settings.SUBJECT_POOL_SEAT_RESERVATION_TTL, int(timezone.now().timestamp()),
+                          *itertools.chain.from_iterable(seats.items()))
+
+    def invalidate(self):
+        """
+        marks the reservations stale so that they are rebuilt from the session's signups and pending seats on the next
+        reservation
+        """
+        r = self.redis()
+        r.hset(self.key, SessionSeatReservations.STALE, 1)
+        r.expire(self.key, settings.SUBJECT_POOL_SEAT_RESERVATION_TTL)
+
+
 def compare_dates(date1, date2):
     if date1 == date2:
         return ''
@@ -3334,24 +4498,20 @@ class SpoolParticipantStatistics(models.Model):
             self.participant, self.absences, self.discharges, self.participations, self.invitations)
 
 
-@simplecache
 def get_chat_message_parameter():
-    return Parameter.objects.get(name='chat_message', scope=Parameter.Scope.PARTICIPANT)
+    return Parameter.objects.for_participant(name='chat_message')
 
 
-@simplecache
 def get_comment_parameter():
-    return Parameter.objects.get(name='comment', scope=Parameter.Scope.PARTICIPANT)
+    return Parameter.objects.for_participant(name='comment')
 
 
-@simplecache
 def get_like_parameter():
-    return Parameter.objects.get(name='like', scope=Parameter.Scope.PARTICIPANT)
+    return Parameter.objects.for_participant(name='like')
 
 
-@simplecache
 def get_participant_ready_parameter():
-    return Parameter.objects.get(name='participant_ready', scope=Parameter.Scope.PARTICIPANT)
+    return Parameter.objects.for_participant(name='participant_ready')
 
 
 SCALAR_DATA_FIELDS = (models.CharField, models.TextField, models.IntegerField, models.PositiveIntegerField,
@@ -3403,7 +4563,7 @@ def set_full_name(user, full_name):
 
 
 def send_markdown_email(**kwargs):
-    return create_markdown_email(**kwargs).send()
+    queue_messages([create_markdown_email(**kwargs)])
 
 
 def create_markdown_email(template=None, context=None, subject=None, from_email=settings.DEFAULT_FROM_EMAIL,
@@ -3420,6 +4580,65 @@ def create_markdown_email(template=None, context=None, subject=None, from_email=
     return msg
 
 
+@receiver(post_save, sender=Parameter, dispatch_uid='invalidate-parameter-registry-on-save')
+@receiver(post_delete, sender=Parameter, dispatch_uid='invalidate-parameter-registry-on-delete')
+def invalidate_parameter_registry(sender, **kwargs):
+    parameter_registry.invalidate()
+    transaction.on_commit(parameter_registry.publish)
+
+
+@receiver(post_migrate, dispatch_uid='invalidate-parameter-registry-on-migrate')
+def invalidate_parameter_registry_on_migrate(sender, **kwargs):
+    # data migrations create parameters through historical models, which don't send signals to Parameter receivers
+    parameter_registry.invalidate()
+
+
+@receiver(post_save, sender=ExperimentParameterValue, dispatch_uid='invalidate-configuration-snapshot-epv-save')
+@receiver(post_delete, sender=ExperimentParameterValue, dispatch_uid='invalidate-configuration-snapshot-epv-delete')
+def invalidate_experiment_configuration_snapshot(sender, instance=None, raw=False, **kwargs):
+    if not raw:
+        ConfigurationSnapshot.invalidate(instance.experiment_configuration_id)
+
+
+@receiver(post_save, sender=RoundParameterValue, dispatch_uid='invalidate-configuration-snapshot-rpv-save')
+@receiver(post_delete, sender=RoundParameterValue, dispatch_uid='invalidate-configuration-snapshot-rpv-delete')
+def invalidate_round_configuration_snapshot(sender, instance=None, raw=False, **kwargs):
+    if not raw:
+        experiment_configuration_pk = RoundConfiguration.objects.filter(
+            pk=instance.round_configuration_id).values_list('experiment_configuration_id', flat=True).first()
+        if experiment_configuration_pk is not None:
+            ConfigurationSnapshot.invalidate(experiment_configuration_pk)
+
+
+@receiver(post_save, sender=RoundData, dispatch_uid='invalidate-cached-round-data-on-save')
+@receiver(post_delete, sender=RoundData, dispatch_uid='invalidate-cached-round-data-on-delete')
+def invalidate_cached_round_data(sender, instance=None, **kwargs):
+    cache.delete(instance.cache_key)
+
+
+@receiver(post_save, sender=ParticipantRoundDataValue, dispatch_uid='remove-unready-participants')
+def remove_unready_participant(sender, instance=None, raw=False, **kwargs):
+    # keep the ready participants set in sync when a participant ready flag is cleared or deactivated
+    if raw or (instance.boolean_value and instance.is_active):
+        return
+    if instance.parameter_id == get_participant_ready_parameter().pk:
+        ReadyParticipantsCounter.redis().srem(ReadyParticipantsCounter.get_key(instance.round_data_id),
+                                              instance.participant_group_relationship_id)
+
+
+@receiver(post_delete, sender=RoundData, dispatch_uid='remove-ready-participants-on-delete')
+def remove_ready_participants(sender, instance=None, **kwargs):
+    ReadyParticipantsCounter(instance).reset()
+
+
+@receiver(post_save, sender=ExperimentSession, dispatch_uid='invalidate-session-seats-on-create')
+@receiver(post_delete, sender=ExperimentSession, dispatch_uid='invalidate-session-seats-on-delete')
+def invalidate_session_seat_reservations(sender, instance=None, created=True, raw=False, **kwargs):
+    # guard against stale reservations left behind by a deleted session or a recycled primary key
+    if created and not raw:
+        SessionSeatReservations(instance).invalidate()
+
+
 @receiver(signals.system_daily_tick, dispatch_uid='send-reminder-emails')
 def send_reminder_emails(sender, start=None, **kwargs):
     """
@@ -3429,7 +4648,7 @@ def send_reminder_emails(sender, start=None, **kwargs):
     if not settings.ENVIRONMENT.is_production:
         logger.debug("not sending reminder emails in non-prod mode")
         return
-    mail.get_connection().send_messages(create_reminder_emails())
+    queue_messages(create_reminder_emails())
 
 
 def create_reminder_emails():
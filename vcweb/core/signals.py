@@ -5,6 +5,7 @@ experiment_started = Signal(providing_args=["experiment", "timestamp", "experime
 participant_added = Signal(providing_args=['experiment', 'timestamp', 'participant_group_relationship'])
 round_started = Signal(providing_args=["experiment", 'timestamp', 'round_configuration'])
 round_ended = Signal(providing_args=['experiment', 'timestamp', 'round_configuration'])
+data_values_flushed = Signal(providing_args=['data_values'])
 minute_tick = Signal(providing_args=['time'])
 hour_tick = Signal(providing_args=['time'])
 system_daily_tick = Signal(providing_args=['timestamp'])
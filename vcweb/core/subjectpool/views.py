@@ -11,8 +11,9 @@ from django.views.decorators.http import require_GET, require_POST
 
 from vcweb.core.decorators import group_required, ownership_required
 from vcweb.core.http import JsonResponse, dumps
+from vcweb.core.mailer import queue_messages
 from vcweb.core.models import (Participant, ParticipantSignup, PermissionGroup, ExperimentSession, ExperimentMetadata,
-                               Invitation, send_markdown_email)
+                               Invitation, SessionSeatReservations, send_markdown_email)
 from vcweb.core.views import mimetypes
 
 from .forms import (SessionInviteForm, ExperimentSessionForm, ParticipantAttendanceForm, CancelSignupForm)
@@ -22,7 +23,7 @@ from datetime import datetime
 from time import mktime
 
 import logging
-import random
+import redis
 import unicodecsv
 import markdown
 
@@ -142,7 +143,7 @@ def get_invitations_count(request):
                 institution=form.cleaned_data.get('affiliated_institution'),
                 port_of_mars=form.cleaned_data.get('port_of_mars'),
                 only_undergrad=form.cleaned_data.get('only_undergrad'))
-            return JsonResponse({'success': True, 'invitesCount': len(potential_participants)})
+            return JsonResponse({'success': True, 'invitesCount': potential_participants.count()})
     return JsonResponse({'success': False, 'invitesCount': 0, 'errors': form.errors})
 
 
@@ -175,25 +176,17 @@ def send_invitations(request):
             # invitations belong to same experiment metadata (This has to be ensured as it is a constraint)
             experiment_metadata_pk = experiment_metadata_pk_list[0]
 
-            potential_participants = list(Participant.objects.invitation_eligible(
+            potential_participants = Participant.objects.invitation_eligible(
                 experiment_metadata_pk,
                 institution=affiliated_institution,
                 only_undergrad=form.cleaned_data.get('only_undergrad'),
-                gender=form.cleaned_data.get('gender')))
-            potential_participants_count = len(potential_participants)
-
-            final_participants = None
+                gender=form.cleaned_data.get('gender'))
+            # if there are less candidate participants than the number of requested participants, use them all
+            final_participants = list(potential_participants.random_sample(invitation_count))
 
-            if potential_participants_count == 0:
-                final_participants = []
+            if not final_participants:
                 message = "There are no more eligible participants that can be invited for this experiment."
             else:
-                if potential_participants_count < invitation_count:
-                    # less candidate participants than the number of requested
-                    # participants, use them all
-                    final_participants = potential_participants
-                else:
-                    final_participants = random.sample(potential_participants, invitation_count)
                 message = "Invitations were sent to %s / %s participants." % (len(final_participants), invitation_count)
 
                 today = timezone.now()
@@ -215,7 +208,7 @@ def send_invitations(request):
                     msg = EmailMultiAlternatives(subject=invitation_subject, body=plaintext_content,
                                                  from_email=from_email, to=[from_email], bcc=recipient_list)
                     msg.attach_alternative(html_content, "text/html")
-                    msg.send()
+                    queue_messages([msg])
                 else:
                     logger.debug("Sending invitation emails in non-production environment is disabled: %s",
                                  recipient_list)
@@ -266,6 +259,7 @@ def manage_participant_attendance(request, pk=None):
             messages.success(request, 'Your changes were successfully saved.')
             if formset.has_changed():
                 formset.save()
+                SessionSeatReservations(es).invalidate()
         else:
             logger.debug("The formset was invalid with errors %s", formset.errors)
             messages.error(request, _("Invalid data. Please Try again."))
@@ -321,6 +315,7 @@ def cancel_experiment_session_signup(request):
         es = invitation.experiment_session
         if request.user.participant == invitation.participant:
             signup.delete()
+            SessionSeatReservations(es).release(invitation.participant)
             messages.success(request, _("You are no longer signed up for %s - thanks for letting us know!" % es))
         else:
             logger.error(
@@ -331,6 +326,25 @@ def cancel_experiment_session_signup(request):
     return redirect('core:dashboard')
 
 
+def get_available_attendance(experiment_session):
+    """
+    Returns the attendance for a new signup by counting the session's signups, or None if the session and its waitlist
+    are full. Must be called in a transaction, used when the redis seat reservations are unavailable.
+    """
+    # lock on the experiment session's signups to prevent concurrent participant signups for an experiment session
+    # exceeding its capacity
+    signup_count = ParticipantSignup.objects.select_for_update().registered(
+        experiment_session_pk=experiment_session.pk).count()
+    if signup_count < experiment_session.capacity:
+        return ParticipantSignup.ATTENDANCE.registered
+    elif experiment_session.waitlist:
+        # signups are full, check if waitlists are full
+        wc = ParticipantSignup.objects.waitlist(experiment_session_pk=experiment_session.pk).count()
+        if wc < experiment_session.waitlist_capacity:
+            return ParticipantSignup.ATTENDANCE.waitlist
+    return None
+
+
 @group_required(PermissionGroup.participant)
 @require_POST
 def submit_experiment_session_signup(request):
@@ -341,42 +355,52 @@ def submit_experiment_session_signup(request):
     invitation_pk = request.POST.get('invitation_pk')
     experiment_metadata_pk = request.POST.get('experiment_metadata_pk')
     invitation = get_object_or_404(Invitation.objects.select_related('experiment_session'), pk=invitation_pk)
-    attendance = ParticipantSignup.ATTENDANCE.registered
-    registered = waitlist = False
-    message = ""
+    participant = user.participant
+    experiment_session = invitation.experiment_session
+    # claim a seat atomically in redis instead of counting signups under a lock on the experiment session
+    reservations = SessionSeatReservations(experiment_session)
+    try:
+        attendance = reservations.reserve(participant)
+    except redis.RedisError:
+        logger.exception("unable to reserve a seat in %s, counting signups instead", experiment_session)
+        reservations = attendance = None
 
-    # lock on the experiment session to prevent concurrent participant signups for an experiment session
-    # exceeding its capacity
-    with transaction.atomic():
-        participant_signups = ParticipantSignup.objects.select_for_update().registered(
-            experiment_session_pk=invitation.experiment_session_id)
-        signup_count = participant_signups.count()
-
-        experiment_session = invitation.experiment_session
-        # verify for the vacancy in the selected experiment session before creating or updating participant signup entry
-        if signup_count < experiment_session.capacity:
-            registered = True
+    try:
+        with transaction.atomic():
+            if reservations is None:
+                attendance = get_available_attendance(experiment_session)
+            if attendance is not None:
+                # Check for any already registered or waitlisted participant signups for the current user
+                ps = ParticipantSignup.objects.registered_or_waitlisted(
+                    invitation__participant=participant, experiment_metadata_pk=experiment_metadata_pk).select_related(
+                    'invitation__experiment_session').first()
+                if ps is None:
+                    ps = ParticipantSignup()
+                    previous_experiment_session = None
+                else:
+                    previous_experiment_session = ps.invitation.experiment_session
+                ps.invitation = invitation
+                ps.attendance = attendance
+                ps.save()
+    except Exception:
+        if reservations is not None and attendance is not None:
+            reservations.release(participant)
+        raise
+
+    if attendance is not None:
+        if attendance == ParticipantSignup.ATTENDANCE.registered:
             message = '''You are now registered for this experiment session. A confirmation email has been sent and you
             should also receive a reminder email one day before the session. Thanks in advance for participating!'''
-        elif experiment_session.waitlist:
-            # signups are full, check if waitlists are full
-            wc = ParticipantSignup.objects.waitlist(experiment_session_pk=invitation.experiment_session_id).count()
-            if wc < experiment_session.waitlist_capacity:
-                waitlist = True
-                attendance = ParticipantSignup.ATTENDANCE.waitlist
-                message = """This experiment session is currently full, but you have been added to the waitlist. You may
-                still be able to participate in this experiment if other participants leave the experiment."""
-
-    if registered or waitlist:
-        # Check for any already registered or waitlisted participant signups for the current user
-        ps = ParticipantSignup.objects.registered_or_waitlisted(invitation__participant=user.participant,
-                                                                experiment_metadata_pk=experiment_metadata_pk)
-
-        ps = ps.first() if ps.exists() else ParticipantSignup()
-
-        ps.invitation = invitation
-        ps.attendance = attendance
-        ps.save()
+        else:
+            message = """This experiment session is currently full, but you have been added to the waitlist. You may
+            still be able to participate in this experiment if other participants leave the experiment."""
+        if previous_experiment_session is not None and previous_experiment_session != experiment_session:
+            # moved from another session of the same experiment, free up the seat held there
+            try:
+                SessionSeatReservations(previous_experiment_session).release(participant)
+            except redis.RedisError:
+                logger.exception("unable to release the seat held by %s in %s", participant,
+                                 previous_experiment_session)
 
         messages.success(request, _(message))
         send_markdown_email(template="subjectpool/email/confirmation-email.txt",
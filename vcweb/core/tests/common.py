@@ -3,18 +3,25 @@ import random
 from datetime import datetime, date
 from django.conf import settings
 from django.core.urlresolvers import reverse
+from django.db import connection, transaction
 from django.test import TestCase
 from django.test.client import RequestFactory, Client
+from django.test.utils import CaptureQueriesContext
 from django.utils.http import urlencode
 
 from ..models import (Experiment, Experimenter, ExperimentConfiguration, RoundConfiguration, Parameter, ExperimentGroup,
-                      User, PermissionGroup, Participant, ParticipantSignup, Institution, ExperimentSession, Invitation)
+                      User, PermissionGroup, Participant, ParticipantSignup, Institution, ExperimentSession, Invitation,
+                      GroupActivityLog)
 
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+class Rollback(Exception):
+    pass
+
+
 class BaseVcwebTest(TestCase):
 
     """
@@ -187,6 +194,31 @@ class BaseVcwebTest(TestCase):
                 return e
             e.advance_to_next_round()
 
+    def run_on_commit_callbacks(self):
+        """ runs the transaction.on_commit callbacks registered so far, they never run on their own inside a test """
+        callbacks = connection.run_on_commit
+        connection.run_on_commit = []
+        for savepoint_ids, callback in callbacks:
+            callback()
+
+    def run_and_rollback(self, func, result_func):
+        """
+        calls func inside a transaction that is always rolled back and returns the value of result_func, evaluated
+        before the rollback, along with the number of queries issued by func. Used to compare set-based
+        implementations against their per-row equivalents on the same fixture.
+        """
+        try:
+            with transaction.atomic():
+                with CaptureQueriesContext(connection) as queries:
+                    func()
+                raise Rollback(result_func(), len(queries))
+        except Rollback as rollback:
+            return rollback.args
+
+    def get_group_activity_logs(self, experiment):
+        return sorted(GroupActivityLog.objects.filter(group__experiment=experiment).values_list(
+            'group', 'round_configuration', 'log_message', 'log_type'))
+
     def reload_experiment(self):
         self.experiment = Experiment.objects.get(pk=self.experiment.pk)
         return self.experiment
@@ -285,19 +317,10 @@ class SubjectPoolTest(BaseVcwebTest):
         return experiment_session_pks
 
     def get_final_participants(self):
-        potential_participants = list(Participant.objects.invitation_eligible(
-            self.experiment_metadata.pk, institution_name=self.get_default_institution().name))
-        potential_participants_count = len(potential_participants)
-        # logger.debug(potential_participants)
         number_of_invitations = 50
-
-        final_participants = []
-        if potential_participants_count > 0:
-            if potential_participants_count < number_of_invitations:
-                final_participants = potential_participants
-            else:
-                final_participants = random.sample(potential_participants, number_of_invitations)
-        return final_participants
+        return list(Participant.objects.invitation_eligible(
+            self.experiment_metadata.pk, institution_name=self.get_default_institution().name).random_sample(
+            number_of_invitations))
 
     def setup_participant_signup(self, participant_list, es_pk_list):
         participant_list = participant_list[:25]
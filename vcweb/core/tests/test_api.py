@@ -1,6 +1,9 @@
-from ..models import ExperimentConfiguration, Experiment, ChatMessage
+from ..models import (ExperimentConfiguration, Experiment, ChatMessage, ReadyParticipantsCounter,
+                      ReadyStatusPublisher)
+from ..view_models import StateVersion
 from .common import BaseVcwebTest
 import json
+import time
 from datetime import datetime
 
 
@@ -62,6 +65,42 @@ class SaveExperimentNoteTest(BaseVcwebTest):
         self.assertEqual(e.get_round_data(e.previous_round).experimenter_notes, note)
 
 
+class ExperimentModelTest(BaseVcwebTest):
+
+    def test_conditional_get(self):
+        e = self.experiment
+        e.activate()
+        # on_commit callbacks never run inside a test case
+        state_version = StateVersion(e.pk)
+        state_version.bump(experiment=True, round_in_progress=False)
+        self.assertTrue(self.login_experimenter(self.experimenter))
+        url = self.reverse('core:experiment_model', query_parameters={'pk': e.pk})
+        response = self.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['pk'], e.pk)
+        etag = response['ETag']
+        response = self.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        group = e.groups.first()
+        state_version.bump(group_pks=[group.pk])
+        response = self.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_group_versions(self):
+        e = self.experiment
+        state_version = StateVersion(e.pk)
+        state_version.bump(experiment=True, round_in_progress=False)
+        group, other_group = e.group_set.all()[:2]
+        etag = state_version.get_etag([group.pk])
+        other_etag = state_version.get_etag([other_group.pk])
+        state_version.bump(group_pks=[group.pk])
+        self.assertNotEqual(etag, state_version.get_etag([group.pk]))
+        self.assertEqual(other_etag, state_version.get_etag([other_group.pk]))
+        state_version.bump(experiment=True)
+        self.assertNotEqual(other_etag, state_version.get_etag([other_group.pk]))
+
+
 class HandleChatMessageTest(BaseVcwebTest):
 
     def test(self):
@@ -75,3 +114,58 @@ class HandleChatMessageTest(BaseVcwebTest):
             self.assertTrue(json.loads(response.content)['success'])
             self.assertEqual(ChatMessage.objects.get(participant_group_relationship=pgr).string_value,
                              'Chat message from %s' % pgr)
+
+
+class ParticipantReadyTest(BaseVcwebTest):
+
+    def test(self):
+        e = self.advance_to_data_round()
+        round_data = e.current_round_data
+        pgrs = list(e.participant_group_relationships)
+        with self.settings(READY_STATUS_INTERVAL=0.05):
+            for number_of_ready_participants, pgr in enumerate(pgrs, 1):
+                self.assertTrue(self.login_participant(pgr.participant))
+                response = self.post(self.reverse('core:participant_ready'), {'participant_group_id': pgr.pk})
+                response_dict = json.loads(response.content)
+                self.assertEqual(number_of_ready_participants, response_dict['number_of_ready_participants'])
+                # readying again is idempotent
+                response = self.post(self.reverse('core:participant_ready'), {'participant_group_id': pgr.pk})
+                self.assertEqual(number_of_ready_participants,
+                                 json.loads(response.content)['number_of_ready_participants'])
+        self.assertTrue(response_dict['all_participants_ready'])
+        self.assertTrue(e.all_participants_ready)
+        # counts are rebuilt from the participant ready data values when the redis set is missing
+        counter = ReadyParticipantsCounter(round_data)
+        counter.reset()
+        self.assertEqual(len(pgrs), counter.count())
+        e.advance_to_next_round()
+        self.assertEqual(0, e.number_of_ready_participants)
+
+    def test_coalesced_ready_status(self):
+        e = self.advance_to_data_round()
+        publisher = ReadyStatusPublisher(e)
+        r = publisher.redis()
+        r.delete(publisher.throttle_key, publisher.pending_key, ReadyStatusPublisher.DUE)
+        publisher.counter.rebuild()
+        with self.settings(READY_STATUS_INTERVAL=60):
+            self.assertTrue(publisher.publish(1, 10))
+            # folded into a single trailing event at the end of the interval
+            self.assertFalse(publisher.publish(2, 10))
+            self.assertFalse(publisher.publish(3, 10))
+            self.assertEqual(1, r.zcard(ReadyStatusPublisher.DUE))
+            self.assertEqual(0, ReadyStatusPublisher.flush_due())
+            # sent once it is due, by whichever process gets to it first
+            self.assertEqual(1, ReadyStatusPublisher.flush_due(now=time.time() + 60))
+            self.assertEqual(0, ReadyStatusPublisher.flush_due(now=time.time() + 60))
+            # all participants ready is always sent immediately
+            self.assertTrue(publisher.publish(10, 10))
+        r.delete(publisher.throttle_key, publisher.pending_key, ReadyStatusPublisher.DUE)
+
+    def test_unready_participant(self):
+        e = self.advance_to_data_round()
+        pgr = e.participant_group_relationships.first()
+        dv = pgr.set_participant_ready()
+        self.assertEqual(1, e.number_of_ready_participants)
+        dv.boolean_value = False
+        dv.save()
+        self.assertEqual(0, e.number_of_ready_participants)
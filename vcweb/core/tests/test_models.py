@@ -1,14 +1,27 @@
 from datetime import datetime, timedelta, date
 import logging
+import os
+import smtplib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-from django.core import serializers
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import mail, serializers
+from django.core.cache import cache
+from django.core.mail.backends.locmem import EmailBackend
 
 from .common import BaseVcwebTest, SubjectPoolTest
 from .. import signals
+from ..http import dumps
+from ..mailer import MailQueue, queue_messages, run_mail_worker
 from ..models import (ParticipantRoundDataValue, Participant, ParticipantExperimentRelationship,
                       BookmarkedExperimentMetadata, ParticipantGroupRelationship, ExperimentMetadata, Parameter,
-                      RoundParameterValue, Institution, Invitation, ParticipantSignup, DefaultValue,
-                      create_reminder_emails)
+                      RoundConfiguration, RoundParameterValue, Institution, Invitation, ParticipantSignup, DefaultValue,
+                      RoundData, Experiment, DataValueUnitOfWork, ForeignKeyValueResolver, GroupRoundDataValue,
+                      create_reminder_emails, get_participant_ready_parameter, parameter_registry,
+                      PermissionGroup, ExperimentSession, SessionSeatReservations, resolve_foreign_key_values)
+from ...redis_pubsub import LiveEventBuffer, RedisPubSub
 
 logger = logging.getLogger(__name__)
 
@@ -86,6 +99,31 @@ class ExperimentConfigurationTest(BaseVcwebTest):
                 original_rpv = original_rc.parameter_value_set.get(**criteria)
                 self.assertNotEqual(original_rpv.pk, rpv.pk)
 
+    def test_clone_round_parameter_values(self):
+        ec = self.experiment.experiment_configuration
+        parameter = self.create_parameter(name='test_clone_round_parameter', scope=Parameter.Scope.ROUND,
+                                          parameter_type='int')
+        for index, rc in enumerate(ec.round_configuration_set.order_by('sequence_number')):
+            for value in range(index % 4):
+                RoundParameterValue.objects.create(parameter=parameter, round_configuration=rc, value=value)
+        existing_rpv_ids = set(RoundParameterValue.objects.values_list('pk', flat=True))
+        ecc = ec.clone()
+        cloned_round_configurations = dict(ecc.round_configuration_set.values_list('pk', 'sequence_number'))
+        cloned_rpvs = RoundParameterValue.objects.exclude(pk__in=existing_rpv_ids)
+        self.assertTrue(cloned_rpvs.exists())
+        # every new round parameter value must point at a round configuration of the clone
+        for rpv in cloned_rpvs:
+            self.assertIn(rpv.round_configuration_id, cloned_round_configurations)
+
+        def round_parameter_values(experiment_configuration):
+            return sorted(RoundParameterValue.objects.filter(
+                round_configuration__experiment_configuration=experiment_configuration).values_list(
+                'round_configuration__sequence_number', 'parameter', 'int_value', 'string_value'))
+
+        self.assertEqual(round_parameter_values(ec), round_parameter_values(ecc))
+        self.assertEqual(cloned_rpvs.count(),
+                         RoundParameterValue.objects.filter(round_configuration__experiment_configuration=ec).count())
+
     def test_serialization_stream(self):
         pass
 
@@ -212,6 +250,41 @@ class ExperimentTest(BaseVcwebTest):
         self.assertFalse(self.experiment.start_round(sender=self),
                          "subsequent start rounds should be no-ops that return false")
 
+    def test_initialize_data_values(self):
+        e = self.advance_to_data_round()
+        round_configuration = e.current_round
+        round_configuration.initialize_data_values = True
+        round_configuration.save()
+        round_data = e.current_round_data
+        group_parameter = self.create_parameter(name='test_group_parameter', scope=Parameter.Scope.GROUP,
+                                                parameter_type='int')
+        participant_parameter = self.create_parameter(name='test_participant_parameter',
+                                                      scope=Parameter.Scope.PARTICIPANT, parameter_type='int')
+        kwargs = dict(group_parameters=[group_parameter], participant_parameters=[participant_parameter],
+                      round_data=round_data, defaults={participant_parameter: 7})
+        created_counts = e.initialize_data_values(**kwargs)
+        self.assertEqual(e.groups.count(), created_counts['group_data_values'])
+        self.assertEqual(e.participant_group_relationships.count(), created_counts['participant_data_values'])
+        self.assertEqual(0, created_counts['group_cluster_data_values'])
+        for pgr in e.participant_group_relationships:
+            self.assertEqual(7, pgr.get_data_value(parameter=participant_parameter, round_data=round_data).int_value)
+        # subsequent initializations should be no-ops
+        created_counts = e.initialize_data_values(**kwargs)
+        self.assertEqual(0, sum(created_counts.values()))
+
+    def test_participant_ready_data_values(self):
+        e = self.advance_to_data_round()
+        self.assertTrue(e.experiment_configuration.is_experimenter_driven)
+        round_data = e.current_round_data
+        participant_ready_data_values = ParticipantRoundDataValue.objects.filter(
+            round_data=round_data, parameter=get_participant_ready_parameter())
+        self.assertEqual(e.participant_group_relationships.count(), participant_ready_data_values.count())
+        self.assertFalse(participant_ready_data_values.filter(boolean_value=True).exists())
+        # subsequent invocations should not create any additional participant ready data values
+        self.assertEqual(0, e.create_participant_ready_data_values(round_data))
+        e.get_or_create_round_data()
+        self.assertEqual(e.participant_group_relationships.count(), participant_ready_data_values.count())
+
     def test_group_allocation(self):
         experiment = self.experiment
         experiment.allocate_groups(randomize=False)
@@ -230,6 +303,24 @@ class ExperimentTest(BaseVcwebTest):
             self.assertEqual(
                 participant_number % group.max_size, pgr.participant.pk % group.max_size)
 
+    def test_randomized_group_allocation(self):
+        experiment = self.experiment
+        experiment.allocate_groups()
+        old_group_pks = set(experiment.group_set.values_list('pk', flat=True))
+        experiment.allocate_groups()
+        groups = list(experiment.group_set.all())
+        self.assertFalse(old_group_pks.intersection(g.pk for g in groups), "existing groups should be deleted")
+        max_group_size = experiment.experiment_configuration.max_group_size
+        self.assertEqual([g.number for g in groups], list(range(1, len(groups) + 1)))
+        participant_ids = []
+        for g in groups:
+            pgrs = list(g.participant_group_relationship_set.order_by('participant_number'))
+            self.assertTrue(0 < len(pgrs) <= max_group_size)
+            self.assertEqual([pgr.participant_number for pgr in pgrs], list(range(1, len(pgrs) + 1)))
+            participant_ids.extend(pgr.participant_id for pgr in pgrs)
+        self.assertEqual(sorted(participant_ids),
+                         sorted(experiment.participant_set.values_list('pk', flat=True)))
+
     def test_next_round(self):
         experiment = self.experiment
         round_number = experiment.current_round_sequence_number
@@ -241,6 +332,107 @@ class ExperimentTest(BaseVcwebTest):
                 round_number += 1
                 self.assertEqual(experiment.current_round_sequence_number, round_number)
 
+    def test_round_data_cache(self):
+        e = self.advance_to_data_round()
+        round_data = e.current_round_data
+        with self.assertNumQueries(0):
+            self.assertEqual(round_data, e.current_round_data)
+        self.assertEqual(round_data, cache.get(round_data.cache_key))
+        # a fresh instance (i.e., the next request) is served from the cache
+        fresh_experiment = Experiment.objects.get(pk=e.pk)
+        fresh_experiment.current_round
+        with self.assertNumQueries(0):
+            self.assertEqual(round_data, fresh_experiment.current_round_data)
+        round_data.experimenter_notes = 'notes'
+        round_data.save()
+        self.assertIsNone(cache.get(round_data.cache_key))
+        e.advance_to_next_round()
+        self.assertNotEqual(round_data, e.current_round_data)
+        self.assertEqual(e.current_round, e.current_round_data.round_configuration)
+        e.restart()
+        self.assertFalse(RoundData.objects.filter(pk=round_data.pk).exists())
+        self.assertIsNone(cache.get(round_data.cache_key))
+        self.assertEqual(e.current_round, e.current_round_data.round_configuration)
+
+    def test_notify_participants_replay_buffer(self):
+        e = self.experiment
+        channel = RedisPubSub.get_participant_broadcast_channel(e.pk)
+        replay_key = RedisPubSub.get_replay_key(channel)
+        r = RedisPubSub.get_redis_instance()
+        r.delete(replay_key)
+        messages = [dumps({'event_type': 'update', 'message': str(i)}) for i in range(3)]
+        for message in messages:
+            e.notify_participants(message)
+        events = r.xrange(replay_key)
+        self.assertEqual(messages, [fields[b'data'].decode('utf-8') for sequence, fields in events])
+        sequences = [sequence.decode('utf-8') for sequence, fields in events]
+        self.assertEqual(sequences, sorted(sequences, key=RedisPubSub.parse_sequence))
+        self.assertTrue(0 < r.ttl(replay_key) <= settings.REDIS_REPLAY_BUFFER_TTL)
+        # events after the first one are replayed from its successor
+        missed_events = r.xrange(replay_key, min=RedisPubSub.get_next_sequence(sequences[0]))
+        self.assertEqual(messages[1:], [fields[b'data'].decode('utf-8') for sequence, fields in missed_events])
+        self.assertEqual((sequences[0], messages[0]),
+                         RedisPubSub.parse_message('{0} {1}'.format(sequences[0], messages[0])))
+        self.assertEqual((None, messages[0]), RedisPubSub.parse_message(messages[0]))
+        r.delete(replay_key)
+
+    def test_live_events_during_replay(self):
+        """ events published between subscribing and replaying are sent once, after the missed events """
+        e = self.experiment
+        channel = RedisPubSub.get_participant_broadcast_channel(e.pk)
+        replay_key = RedisPubSub.get_replay_key(channel)
+        r = RedisPubSub.get_redis_instance()
+        r.delete(replay_key)
+        last_seen = RedisPubSub.publish(channel, dumps({'message': 'seen'}))
+        missed = [RedisPubSub.publish(channel, dumps({'message': 'missed %s' % i})) for i in range(2)]
+        # the reconnecting client subscribes, then an event is published before its replay reads the buffer
+        live_event_buffer = LiveEventBuffer()
+        during_subscribe = RedisPubSub.publish(channel, dumps({'message': 'during subscribe'}))
+        live_event_buffer.hold(channel, during_subscribe, 'during subscribe')
+        delivered = []
+        for sequence, fields in r.xrange(replay_key, min=RedisPubSub.get_next_sequence(last_seen)):
+            sequence = sequence.decode('utf-8')
+            delivered.append(sequence)
+            live_event_buffer.replayed(channel, sequence)
+        # published after the replay read the buffer but before the held events were released
+        during_replay = RedisPubSub.publish(channel, dumps({'message': 'during replay'}))
+        live_event_buffer.hold(channel, during_replay, 'during replay')
+        delivered.extend(sequence for channel, sequence, message in live_event_buffer.release())
+        self.assertEqual(delivered, missed + [during_subscribe, during_replay])
+        self.assertEqual(live_event_buffer.release(), [])
+        r.delete(replay_key)
+
+    def test_replay_incomplete(self):
+        """ reconnecting clients only need an update if events newer than the last one they saw were dropped """
+        e = self.experiment
+        channel = RedisPubSub.get_participant_broadcast_channel(e.pk)
+        replay_key = RedisPubSub.get_replay_key(channel)
+        sequence_key = RedisPubSub.get_replay_sequence_key(channel)
+        r = RedisPubSub.get_redis_instance()
+        r.delete(replay_key, sequence_key)
+
+        def is_replay_incomplete(last_sequence):
+            published, trimmed = [value.decode('utf-8') if value else None
+                                  for value in r.hmget(sequence_key, 'published', 'trimmed')]
+            return RedisPubSub.is_replay_incomplete(last_sequence, published, trimmed, r.exists(replay_key))
+
+        with self.settings(REDIS_REPLAY_BUFFER_LENGTH=2):
+            sequences = [RedisPubSub.publish(channel, dumps({'message': str(i)})) for i in range(4)]
+        self.assertEqual(2, r.xlen(replay_key))
+        self.assertTrue(is_replay_incomplete(sequences[0]))
+        # only the client's last seen event was trimmed
+        self.assertFalse(is_replay_incomplete(sequences[1]))
+        self.assertFalse(is_replay_incomplete(sequences[3]))
+        # an expired replay buffer only matters to clients that had not seen the last published event
+        r.delete(replay_key)
+        self.assertFalse(is_replay_incomplete(sequences[3]))
+        self.assertTrue(is_replay_incomplete(sequences[2]))
+        # the next event starts a new buffer, everything before it stays lost
+        sequences.append(RedisPubSub.publish(channel, dumps({'message': 'after expiry'})))
+        self.assertTrue(is_replay_incomplete(sequences[2]))
+        self.assertFalse(is_replay_incomplete(sequences[3]))
+        r.delete(replay_key, sequence_key)
+
     def test_elapsed_time(self):
         e = self.experiment
         e.activate()
@@ -335,6 +527,27 @@ class ExperimentRegistrationTest(BaseVcwebTest):
         emails = ['test%s@asu.edu' % index for index in range(number_of_participants)]
         e.register_participants(emails=emails, institution=institution, password='test')
 
+    def test_bulk_registration(self):
+        e = self.experiment.clone()
+        institution = Institution.objects.get(pk=1)
+        existing_user = User.objects.create_user(username='test0@asu.edu', email='test0@asu.edu', password='old')
+        emails = ['Test Participant%s <TEST%s@asu.edu>' % (index, index) for index in range(25)] + ['test1@asu.edu']
+        with self.settings(PASSWORD_HASHING_POOL_THRESHOLD=10):
+            registered = e.register_participants(emails=emails, institution=institution, password='test',
+                                                 send_email=False)
+        self.assertEqual(len(registered), 25)
+        self.assertEqual(e.participant_set.count(), 25)
+        self.assertEqual(User.objects.filter(email__endswith='@asu.edu', email__startswith='test').count(), 25)
+        for user, password in registered:
+            user.refresh_from_db()
+            self.assertTrue(user.check_password('test'))
+            self.assertEqual(user.participant.institution, institution)
+            self.assertTrue(user.groups.filter(name=PermissionGroup.participant.value).exists())
+        existing_user.refresh_from_db()
+        self.assertEqual(existing_user.last_name, 'Participant0')
+        self.assertEqual(sorted(e.participant_relationship_set.values_list('sequential_participant_identifier',
+                                                                          flat=True)), list(range(1, 26)))
+
 
 class ParticipantExperimentRelationshipTest(BaseVcwebTest):
 
@@ -446,6 +659,84 @@ class SubjectPoolInvitationTest(SubjectPoolTest):
 
             self.setup_participant_signup(final_participants, es_pk_list)
 
+    def test_eligible_count_and_sample(self):
+        self.setup_participants()
+        es_pk_list = self.setup_experiment_sessions()
+        eligible = Participant.objects.invitation_eligible(
+            self.experiment_metadata.pk, institution_name=self.get_default_institution().name)
+        eligible_pks = set(eligible.values_list('pk', flat=True))
+        self.assertTrue(eligible_pks)
+        self.assertEqual(eligible.count(), len(eligible_pks))
+        sample = list(eligible.random_sample(5))
+        self.assertEqual(len(sample), min(5, len(eligible_pks)))
+        self.assertEqual(len(set(p.pk for p in sample)), len(sample))
+        self.assertTrue(set(p.pk for p in sample) <= eligible_pks)
+        # recently invited participants are no longer eligible
+        Invitation.objects.bulk_create([Invitation(participant=p, experiment_session_id=es_pk_list[0],
+                                                   sender=self.demo_experimenter.user) for p in sample])
+        self.assertEqual(eligible.count(), len(eligible_pks) - len(sample))
+        self.assertEqual(eligible.count(), len(eligible.random_sample(len(eligible_pks))))
+
+
+class SessionSeatReservationsTest(SubjectPoolTest):
+
+    def test_concurrent_reservations(self):
+        """ many threads racing for the seats of one experiment session never overbook it """
+        self.setup_participants(number=60)
+        es = ExperimentSession.objects.get(pk=self.setup_experiment_sessions(number=1, capacity=10)[0])
+        es.waitlist = True
+        es.save()
+        participants = list(Participant.objects.all())
+        reservations = SessionSeatReservations(es)
+        reservations.invalidate()
+        # rebuild from the test transaction up front, the worker threads only talk to redis
+        reservations.rebuild()
+        barrier = threading.Barrier(len(participants))
+
+        def reserve(participant):
+            barrier.wait()
+            return participant, SessionSeatReservations(es).reserve(participant)
+
+        with ThreadPoolExecutor(max_workers=len(participants)) as executor:
+            results = dict(executor.map(reserve, participants))
+        seats = list(results.values())
+        self.assertEqual(seats.count(ParticipantSignup.ATTENDANCE.registered), es.capacity)
+        self.assertEqual(seats.count(ParticipantSignup.ATTENDANCE.waitlist), es.waitlist_capacity)
+        self.assertEqual(seats.count(None), len(participants) - es.capacity - es.waitlist_capacity)
+        counts = RedisPubSub.get_redis_instance().hmget(reservations.key, 'registered', 'waitlist')
+        self.assertEqual([int(count) for count in counts], [es.capacity, es.waitlist_capacity])
+
+        registered = [p for p, seat in results.items() if seat == ParticipantSignup.ATTENDANCE.registered]
+        waitlisted = [p for p, seat in results.items() if seat == ParticipantSignup.ATTENDANCE.waitlist]
+        # reserving again is idempotent
+        self.assertEqual(reservations.reserve(registered[0]), ParticipantSignup.ATTENDANCE.registered)
+        # released seats go to the next participant, waitlisted participants move up
+        reservations.release(registered[0])
+        self.assertEqual(reservations.reserve(waitlisted[0]), ParticipantSignup.ATTENDANCE.registered)
+        self.assertEqual(reservations.reserve(registered[0]), ParticipantSignup.ATTENDANCE.waitlist)
+        reservations.invalidate()
+
+    def test_invalidate_keeps_pending_reservations(self):
+        """ seats reserved but not yet written as signups survive an invalidated hash until they expire """
+        self.setup_participants(number=2)
+        es = ExperimentSession.objects.get(pk=self.setup_experiment_sessions(number=1, capacity=1)[0])
+        first, second = Participant.objects.all()[:2]
+        reservations = SessionSeatReservations(es)
+        reservations.invalidate()
+        self.assertEqual(reservations.reserve(first), ParticipantSignup.ATTENDANCE.registered)
+        # the experimenter edits attendance before the first participant's signup has been written
+        reservations.invalidate()
+        self.assertIsNone(reservations.reserve(second))
+        reservations.release(first)
+        self.assertEqual(reservations.reserve(second), ParticipantSignup.ATTENDANCE.registered)
+        # pending seats without a signup are dropped once they expire
+        reservations.release(second)
+        with self.settings(SUBJECT_POOL_SEAT_PENDING_TTL=0):
+            self.assertEqual(reservations.reserve(second), ParticipantSignup.ATTENDANCE.registered)
+            reservations.invalidate()
+            self.assertEqual(reservations.reserve(first), ParticipantSignup.ATTENDANCE.registered)
+        reservations.invalidate()
+
 
 class ParameterizedValueMixinTest(BaseVcwebTest):
 
@@ -502,6 +793,34 @@ class ParameterizedValueMixinTest(BaseVcwebTest):
         self.assertFalse(type(pv) is DefaultValue)
         self.assertEqual(pv.int_value, 17)
 
+    def test_read_parameter_value(self):
+        e = self.experiment
+        e.activate()
+        cr = e.current_round
+        ec = e.experiment_configuration
+        parameter = self.create_parameter(name='snapshot_parameter', scope=Parameter.Scope.ROUND,
+                                          parameter_type='int')
+        pv = cr.read_parameter_value(parameter=parameter, default=17)
+        self.assertTrue(type(pv) is DefaultValue)
+        self.assertEqual(pv.int_value, 17)
+        self.assertFalse(cr.parameter_value_set.filter(parameter=parameter).exists())
+        cr.set_parameter_value(parameter=parameter, value=23)
+        self.assertEqual(cr.read_parameter_value(parameter=parameter, default=17).int_value, 23)
+        parameter_registry.load()
+        with self.assertNumQueries(0):
+            self.assertEqual(cr.read_parameter_value(name='snapshot_parameter').value, 23)
+        group = e.groups.first()
+        self.assertEqual(group.get_round_configuration_value(name='snapshot_parameter').int_value, 23)
+        self.assertIsNone(group.get_round_configuration_value(parameter=self.create_parameter(
+            name='unset_snapshot_parameter', scope=Parameter.Scope.ROUND, parameter_type='int')))
+        # edits through other instances invalidate the cached snapshot
+        RoundParameterValue.objects.get(round_configuration=cr, parameter=parameter).update(29)
+        round_configuration = RoundConfiguration.objects.get(pk=cr.pk)
+        self.assertEqual(round_configuration.read_parameter_value(parameter=parameter).int_value, 29)
+        ec.set_parameter_value(parameter=parameter, value=31)
+        other_round = ec.round_configuration_set.exclude(pk=cr.pk).first()
+        self.assertEqual(other_round.read_parameter_value(parameter=parameter, inheritable=True).int_value, 31)
+
 
 class DataValueMixinTest(BaseVcwebTest):
 
@@ -540,6 +859,118 @@ class DataValueMixinTest(BaseVcwebTest):
             self.assertFalse(type(dv) is DefaultValue)
             self.assertEqual(dv.string_value, expected_test_value)
 
+    def test_unit_of_work(self):
+        e = self.experiment
+        e.activate()
+        parameter = self.create_parameter(scope=Parameter.Scope.GROUP, name='unit_of_work_parameter',
+                                          parameter_type='int')
+        groups = list(e.groups)
+        round_data = e.current_round_data
+        existing_dv = groups[0].set_data_value(parameter=parameter, value=1, round_data=round_data)
+        with DataValueUnitOfWork():
+            for g in groups:
+                dv = g.get_data_value(parameter=parameter, round_data=round_data, default=0)
+                self.assertIs(dv, g.get_data_value(parameter=parameter, round_data=round_data))
+                dv.update_int(dv.int_value + 10)
+            # writes are buffered until the unit of work exits
+            self.assertEqual(GroupRoundDataValue.objects.get(pk=existing_dv.pk).int_value, 1)
+            self.assertEqual(GroupRoundDataValue.objects.filter(parameter=parameter).count(), 1)
+        values = dict(GroupRoundDataValue.objects.filter(parameter=parameter, round_data=round_data).values_list(
+            'group', 'int_value'))
+        self.assertEqual(len(values), len(groups))
+        self.assertEqual(values[groups[0].pk], 11)
+        for g in groups[1:]:
+            self.assertEqual(values[g.pk], 10)
+
+
+class ParameterRegistryTest(BaseVcwebTest):
+
+    def test_lookups(self):
+        parameter_registry.load()
+        participant_ready_parameter = Parameter.objects.get(name='participant_ready')
+        with self.assertNumQueries(0):
+            self.assertEqual(get_participant_ready_parameter(), participant_ready_parameter)
+            self.assertEqual(Parameter.objects.for_participant(name='participant_ready'), participant_ready_parameter)
+            self.assertEqual(parameter_registry.get(pk=participant_ready_parameter.pk), participant_ready_parameter)
+            self.assertIs(get_participant_ready_parameter(), get_participant_ready_parameter())
+        with self.assertRaises(Parameter.DoesNotExist):
+            Parameter.objects.for_group(name='participant_ready')
+        with self.assertRaises(Parameter.DoesNotExist):
+            parameter_registry.get(name='nonexistent_parameter')
+        # repeated misses don't reload the registry
+        with self.assertNumQueries(0), self.assertRaises(Parameter.DoesNotExist):
+            parameter_registry.get(name='nonexistent_parameter')
+
+    def test_forked_process(self):
+        """ a registry inherited from a parent process subscribes and reloads on its first lookup """
+        participant_ready_parameter = Parameter.objects.get(name='participant_ready')
+        parameter_registry.load()
+        if parameter_registry.listener is not None:
+            parameter_registry.listener.stop()
+        parameter_registry.loaded_pid = parameter_registry.listener_pid = -1
+        with self.settings(PARAMETER_REGISTRY_LISTEN=True), self.assertNumQueries(1):
+            self.assertEqual(get_participant_ready_parameter(), participant_ready_parameter)
+        self.assertEqual(parameter_registry.listener_pid, os.getpid())
+        self.assertEqual(parameter_registry.loaded_pid, os.getpid())
+
+    def test_invalidation(self):
+        parameter_registry.load()
+        parameter = self.create_parameter(name='registry_parameter', scope=Parameter.Scope.GROUP,
+                                          parameter_type='int')
+        self.assertEqual(Parameter.objects.for_group(name='registry_parameter'), parameter)
+        parameter.display_name = 'Registry Parameter'
+        parameter.save()
+        self.assertEqual(Parameter.objects.for_group(name='registry_parameter').label, 'Registry Parameter')
+
+    def test_data_value_parameters(self):
+        e = self.experiment
+        e.activate()
+        for pgr in e.participant_group_relationships:
+            pgr.set_participant_ready()
+        parameter_registry.load()
+        data_values = list(ParticipantRoundDataValue.objects.filter(parameter=get_participant_ready_parameter()))
+        self.assertTrue(data_values)
+        with self.assertNumQueries(0):
+            for dv in data_values:
+                self.assertEqual(dv.parameter, get_participant_ready_parameter())
+                self.assertTrue(dv.value)
+
+
+class ForeignKeyValueResolverTest(BaseVcwebTest):
+
+    def test_resolve(self):
+        e = self.experiment
+        e.activate()
+        parameter = self.create_parameter(name='institution_parameter', scope=Parameter.Scope.PARTICIPANT,
+                                          parameter_type='foreignkey')
+        parameter.class_name = 'core.Institution'
+        parameter.save()
+        institutions = [Institution.objects.create(name='resolver institution %s' % i) for i in range(3)]
+        round_data = e.current_round_data
+        for index, pgr in enumerate(e.participant_group_relationships):
+            ParticipantRoundDataValue.objects.create(participant_group_relationship=pgr, round_data=round_data,
+                                                     parameter=parameter,
+                                                     int_value=institutions[index % len(institutions)].pk)
+        cache.delete_many([ForeignKeyValueResolver.get_cache_key(Institution, i.pk) for i in institutions])
+        parameter_registry.load()
+        data_values = list(ParticipantRoundDataValue.objects.filter(parameter=parameter))
+        self.assertTrue(data_values)
+        with self.assertNumQueries(1):
+            resolve_foreign_key_values(data_values)
+            for dv in data_values:
+                self.assertIn(dv.value, institutions)
+                self.assertEqual(dv.value.pk, dv.int_value)
+                self.assertEqual(dv.cached_value, dv.value)
+        # a new resolver is served from the cache
+        data_values = list(ParticipantRoundDataValue.objects.filter(parameter=parameter))
+        with self.assertNumQueries(0):
+            ForeignKeyValueResolver().resolve(data_values)
+            self.assertEqual(set(dv.value for dv in data_values), set(institutions))
+        # values changed after resolution are looked up again
+        dv = data_values[0]
+        dv.int_value = institutions[-1].pk if dv.int_value != institutions[-1].pk else institutions[0].pk
+        self.assertEqual(dv.value.pk, dv.int_value)
+
 
 class BookmarkedExperimentMetadataTest(BaseVcwebTest):
 
@@ -586,3 +1017,106 @@ class SubjectPoolReminderTest(SubjectPoolTest):
         for email in emails:
             self.assertTrue('automated email to remind you' in email.body)
             self.assertTrue(len(email.recipients()) > 0)
+
+
+class RejectingEmailBackend(EmailBackend):
+
+    def send_messages(self, messages):
+        raise smtplib.SMTPDataError(554, 'rejected')
+
+
+class UnreachableEmailBackend(EmailBackend):
+
+    def __init__(self, *args, **kwargs):
+        super(UnreachableEmailBackend, self).__init__(*args, **kwargs)
+        self.number_of_connections = 0
+
+    def open(self):
+        self.number_of_connections += 1
+        raise ConnectionRefusedError(111, 'Connection refused')
+
+    def send_messages(self, messages):
+        raise smtplib.SMTPServerDisconnected('please run connect() first')
+
+
+class MailQueueTest(SubjectPoolTest):
+
+    def setUp(self, **kwargs):
+        super(MailQueueTest, self).setUp(**kwargs)
+        self.queue = MailQueue('test.mail')
+        self.queue.clear()
+
+    def tearDown(self):
+        self.queue.clear()
+        super(MailQueueTest, self).tearDown()
+
+    def queue_reminder_emails(self):
+        tomorrow = date.today() + timedelta(1)
+        self.initialize(number_of_experiment_sessions=5, start_date=tomorrow)
+        emails = create_reminder_emails()
+        with self.settings(MAIL_QUEUE_ENABLED=True):
+            queue_messages(emails, queue=self.queue, on_commit=False)
+        return emails
+
+    def test_batched_delivery(self):
+        emails = self.queue_reminder_emails()
+        self.assertEqual(5, self.queue.get_metrics()['queue_length'])
+        self.assertEqual(5, run_mail_worker(queue=self.queue, burst=True, timeout=1, batch_size=2, rate_limit=0))
+        self.assertEqual(5, len(mail.outbox))
+        for email, sent_email in zip(emails, mail.outbox):
+            self.assertEqual(email.subject, sent_email.subject)
+            self.assertEqual(email.body, sent_email.body)
+            self.assertEqual(email.recipients(), sent_email.recipients())
+            self.assertEqual(email.alternatives, sent_email.alternatives)
+        metrics = self.queue.get_metrics()
+        self.assertEqual(5, metrics['sent'])
+        self.assertEqual(3, metrics['batches'])
+        self.assertEqual(0, metrics['queue_length'])
+        self.assertEqual(0, metrics['processing_length'])
+
+    def test_failed_delivery(self):
+        self.queue_reminder_emails()
+        with self.settings(MAIL_MAX_ATTEMPTS=2):
+            self.assertEqual(0, run_mail_worker(queue=self.queue, burst=True, timeout=1, rate_limit=0,
+                                                connection=RejectingEmailBackend()))
+            metrics = self.queue.get_metrics()
+            self.assertEqual(5, metrics['retry_length'])
+            self.assertEqual(0, metrics['processing_length'])
+            # make all retries due immediately, the second failed attempt parks them on the failed list
+            r = self.queue.redis()
+            r.zadd(self.queue.retry_key, {member: 0 for member in r.zrange(self.queue.retry_key, 0, -1)})
+            self.assertEqual(0, run_mail_worker(queue=self.queue, burst=True, timeout=1, rate_limit=0,
+                                                connection=RejectingEmailBackend()))
+        metrics = self.queue.get_metrics()
+        self.assertEqual(0, metrics['retry_length'])
+        self.assertEqual(5, metrics['failed_length'])
+        self.assertEqual(0, len(mail.outbox))
+
+    def test_unreachable_mail_server(self):
+        self.queue_reminder_emails()
+        connection = UnreachableEmailBackend()
+        # connections are opened per batch and failures to reconnect don't stop the worker
+        self.assertEqual(0, run_mail_worker(queue=self.queue, burst=True, timeout=1, batch_size=2, rate_limit=0,
+                                            connection=connection))
+        self.assertEqual(3 + 5, connection.number_of_connections)
+        metrics = self.queue.get_metrics()
+        self.assertEqual(5, metrics['retry_length'])
+        self.assertEqual(0, metrics['processing_length'])
+
+    def test_orphaned_messages(self):
+        self.queue_reminder_emails()
+        queue = self.queue
+        r = queue.redis()
+        # claimed by a live worker that is still sending them
+        queue.register_worker('live')
+        r.set(queue.get_heartbeat_key('live'), 1, ex=60)
+        self.assertEqual(2, len(queue.claim('live', 2, 1)))
+        self.assertEqual(3, run_mail_worker(queue=queue, burst=True, timeout=1, rate_limit=0))
+        self.assertEqual(2, queue.get_metrics()['processing_length'])
+        self.assertEqual(3, len(mail.outbox))
+        # the live worker's lease expires without it sending its messages
+        r.delete(queue.get_heartbeat_key('live'))
+        self.assertEqual(2, run_mail_worker(queue=queue, burst=True, timeout=1, rate_limit=0))
+        self.assertEqual(5, len(mail.outbox))
+        self.assertEqual(0, queue.get_metrics()['processing_length'])
+        self.assertNotIn('live', queue.get_worker_ids())
@@ -1,14 +1,31 @@
+import io
+import itertools
 import json
 import logging
+import os
 import random
+import shutil
+import tempfile
+import zipfile
+from collections import defaultdict
 
+import redis
 from django.contrib.auth import get_user_model
 from django.contrib.auth.forms import AuthenticationForm
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
 
 from .common import BaseVcwebTest, SubjectPoolTest
-from ..models import (Participant, ExperimentMetadata, ExperimentSession, Invitation, ParticipantSignup,
-                      PermissionGroup, BookmarkedExperimentMetadata)
+from ..models import (Participant, ParticipantRoundDataValue, ExperimentMetadata, ExperimentSession, Invitation,
+                      ParticipantSignup, PermissionGroup, BookmarkedExperimentMetadata, ChatMessage,
+                      SessionSeatReservations, get_model_fields)
+from ..export import (COLUMNAR_TABLES, DATA_EXPORTER, ExportJob, experiment_data_rows, get_chat_messages,
+                      get_heartbeat_key, get_processing_key, get_participant_data_values, remove_expired_artifacts,
+                      run_export_worker)
 from ..views import (DashboardViewModel, ExperimenterDashboardViewModel)
+from ..view_models import data_values_updated
+from ...redis_pubsub import RedisPubSub
 
 logger = logging.getLogger(__name__)
 
@@ -234,6 +251,237 @@ class ArchiveApiTest(BaseVcwebTest):
         self.assertFalse(self.experiment.is_active)
 
 
+class DownloadDataTest(BaseVcwebTest):
+
+    def export_rows(self):
+        with CaptureQueriesContext(connection) as context:
+            rows = list(experiment_data_rows(self.experiment))
+        return rows, len(context)
+
+    def test_streaming_csv(self):
+        e = self.advance_to_data_round()
+        self.login_experimenter()
+        response = self.get(self.reverse('core:download_data', kwargs={'pk': e.pk, 'file_type': 'csv'}))
+        self.assertEqual(200, response.status_code)
+        self.assertTrue(response.streaming)
+        content = b''.join(response.streaming_content).decode('utf-8')
+        self.assertTrue(content.startswith('Group ID,Group Number,Group Cluster ID'))
+        for pgr in e.participant_group_relationships:
+            self.assertTrue(pgr.participant.email in content)
+
+    def test_fixed_number_of_queries(self):
+        e = self.advance_to_data_round()
+        rows, initial_number_of_queries = self.export_rows()
+        number_of_rounds = 0
+        while e.has_next_round and number_of_rounds < 3:
+            e.advance_to_next_round()
+            number_of_rounds += 1
+        e.round_data_set.update(experimenter_notes='notes')
+        rows, number_of_queries = self.export_rows()
+        self.assertEqual(initial_number_of_queries, number_of_queries)
+        self.assertEqual(e.round_data_set.count(),
+                         len([row for row in rows if row[4:5] == ['Experimenter Notes']]))
+
+    def per_round_data_rows(self, experiment):
+        """ generates the data rows one round at a time, the way download_data did before it was streamed """
+        yield ['Group ID', 'Group Number', 'Group Cluster ID', 'Session ID', 'Participant ID', 'Participant Email']
+        group_to_cluster_dict = defaultdict(str)
+        for group_cluster in experiment.group_cluster_set.all():
+            for g in group_cluster.group_relationship_set.select_related('group').values_list('group', flat=True):
+                group_to_cluster_dict[g] = group_cluster.pk
+        for group in experiment.group_set.order_by('pk').all():
+            for pgr in group.participant_group_relationship_set.select_related('participant__user').all():
+                yield [group.pk, group.number, group_to_cluster_dict[group.pk], group.session_id, pgr.pk,
+                       pgr.participant.email]
+        yield ['Round', 'Participant ID', 'Participant Number', 'Group ID', 'Parameter', 'Value',
+               'Creation Date', 'Creation Time', 'Last Modified Date', 'Last Modified Time']
+        lookup_table_parameters = set()
+        for round_data in experiment.round_data_set.select_related('round_configuration').all():
+            round_number = round_data.round_number
+            if round_data.experimenter_notes:
+                yield [round_number, experiment.experimenter.email, '', '', 'Experimenter Notes',
+                       round_data.experimenter_notes, '', '', '', '']
+            for data_value in round_data.participant_data_value_set.select_related(
+                    'participant_group_relationship__group', 'parameter').all():
+                pgr = data_value.participant_group_relationship
+                if data_value.parameter.is_foreign_key:
+                    lookup_table_parameters.add(data_value.parameter)
+                dc = data_value.date_created
+                lm = data_value.last_modified
+                yield [round_number, pgr.pk, pgr.participant_number, pgr.group.pk, data_value.parameter.label,
+                       data_value.value, dc.date(), dc.time(), lm.date(), lm.time()]
+            chat_messages = ChatMessage.objects.filter(round_data=round_data)
+            if chat_messages.count() > 0:
+                for chat_message in chat_messages.order_by('participant_group_relationship__group', 'date_created'):
+                    pgr = chat_message.participant_group_relationship
+                    dc = chat_message.date_created
+                    lm = chat_message.last_modified
+                    yield [round_number, pgr.pk, pgr.participant_number, pgr.group.pk, "Chat Message",
+                           chat_message.string_value, dc.date(), dc.time(), lm.date(), lm.time()]
+            for data_value in round_data.group_data_value_set.select_related('group').all():
+                dc = data_value.date_created
+                lm = data_value.last_modified
+                yield [round_number, '', '', data_value.group.pk, data_value.parameter.label,
+                       data_value.value, dc.date(), dc.time(), lm.date(), lm.time()]
+        if lookup_table_parameters:
+            yield ['Lookup Tables']
+            for ltp in lookup_table_parameters:
+                model = ltp.get_model_class()
+                data_fields = get_model_fields(model)
+                yield list(itertools.chain(['Type', 'ID'], [f.verbose_name for f in data_fields]))
+                for obj in model.objects.order_by('pk').all():
+                    yield list(itertools.chain([model.__name__, obj.pk], [getattr(obj, f.name) for f in data_fields]))
+
+    def test_matches_per_round_rows(self):
+        e = self.advance_to_data_round()
+        number_of_rounds = 0
+        while e.has_next_round and number_of_rounds < 3:
+            round_data = e.current_round_data
+            round_data.experimenter_notes = 'notes for round %s' % round_data.round_number
+            round_data.save()
+            # a different number of chat messages per participant and round
+            for index, pgr in enumerate(e.participant_group_relationships):
+                for message_number in range((index + number_of_rounds) % 3):
+                    ChatMessage.objects.create(participant_group_relationship=pgr, round_data=round_data,
+                                               string_value='message %s from %s' % (message_number, pgr))
+            e.advance_to_next_round()
+            number_of_rounds += 1
+        self.assertTrue(number_of_rounds > 1)
+        self.assertTrue(ChatMessage.objects.filter(round_data__experiment=e).exists())
+        self.assertEqual(list(self.per_round_data_rows(e)), list(experiment_data_rows(e)))
+
+
+class ExportJobTest(BaseVcwebTest):
+
+    def setUp(self, **kwargs):
+        super(ExportJobTest, self).setUp(**kwargs)
+        self.export_directory = tempfile.mkdtemp()
+        self.export_settings = override_settings(EXPORT_DIRECTORY=self.export_directory)
+        self.export_settings.enable()
+        RedisPubSub.get_redis_instance().delete(ExportJob.QUEUE, ExportJob.WORKERS)
+
+    def tearDown(self):
+        self.export_settings.disable()
+        shutil.rmtree(self.export_directory)
+        super(ExportJobTest, self).tearDown()
+
+    def start_export(self, experiment, exporter_name='data'):
+        response = self.post(self.reverse('core:start_export', kwargs={'pk': experiment.pk,
+                                                                       'exporter_name': exporter_name}))
+        self.assertEqual(200, response.status_code)
+        return json.loads(response.content.decode('utf-8'))['job']
+
+    def test_export_job(self):
+        e = self.advance_to_data_round()
+        self.login_experimenter()
+        job = self.start_export(e)
+        self.assertEqual(ExportJob.Status.QUEUED, job['status'])
+        self.assertEqual(1, run_export_worker(burst=True, timeout=1))
+        response = self.get(job['statusUrl'])
+        self.assertEqual(ExportJob.Status.COMPLETE, json.loads(response.content.decode('utf-8'))['job']['status'])
+        response = self.get(job['downloadUrl'])
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(b''.join(DATA_EXPORTER.stream(e)), b''.join(response.streaming_content))
+        # repeat exports of an unchanged experiment are served from the cached artifact
+        self.assertEqual(job['key'], self.start_export(e)['key'])
+        self.assertEqual(0, run_export_worker(burst=True, timeout=1))
+        response = self.get(self.reverse('core:download_data', kwargs={'pk': e.pk, 'file_type': 'csv'}))
+        self.assertEqual(b''.join(DATA_EXPORTER.stream(e)), b''.join(response.streaming_content))
+        # modifying a data value invalidates the cached artifact
+        ParticipantRoundDataValue.objects.filter(round_data__experiment=e).first().save()
+        self.assertNotEqual(job['key'], self.start_export(e)['key'])
+
+    def test_export_invalidation(self):
+        e = self.advance_to_data_round()
+        self.login_experimenter()
+        key = self.start_export(e)['key']
+        # so do experimenter notes, which have no modification time of their own
+        round_data = e.current_round_data
+        round_data.experimenter_notes = 'participant 3 left early'
+        round_data.save()
+        notes_key = self.start_export(e)['key']
+        self.assertNotEqual(key, notes_key)
+        # and group membership
+        pgr = e.participant_group_relationships.first()
+        pgr.active = False
+        pgr.save()
+        membership_key = self.start_export(e)['key']
+        self.assertNotEqual(notes_key, membership_key)
+        # bulk updates leave last_modified alone and bump the experiment's state version instead
+        ParticipantRoundDataValue.objects.filter(round_data__experiment=e).update(is_active=False)
+        data_values_updated(e.pk)
+        self.run_on_commit_callbacks()
+        self.assertNotEqual(membership_key, self.start_export(e)['key'])
+
+    def test_orphaned_jobs(self):
+        e = self.advance_to_data_round()
+        self.login_experimenter()
+        r = RedisPubSub.get_redis_instance()
+        job = self.start_export(e)
+        # claimed by a live worker that is still running it
+        r.brpoplpush(ExportJob.QUEUE, get_processing_key('live'), 1)
+        r.sadd(ExportJob.WORKERS, 'live')
+        r.set(get_heartbeat_key('live'), 1, ex=60)
+        self.assertEqual(0, run_export_worker(burst=True, timeout=1))
+        self.assertEqual([job['key'].encode('utf-8')], r.lrange(get_processing_key('live'), 0, -1))
+        # the live worker's lease expires without it finishing the job
+        r.delete(get_heartbeat_key('live'))
+        self.assertEqual(1, run_export_worker(burst=True, timeout=1))
+        self.assertFalse(r.exists(get_processing_key('live')))
+        self.assertFalse(r.sismember(ExportJob.WORKERS, 'live'))
+        self.assertEqual(ExportJob.Status.COMPLETE, ExportJob(job['key']).status)
+
+    def test_remove_expired_artifacts(self):
+        e = self.advance_to_data_round()
+        self.login_experimenter()
+        job = ExportJob(self.start_export(e)['key'])
+        run_export_worker(burst=True, timeout=1)
+        self.assertEqual(0, remove_expired_artifacts())
+        self.assertTrue(job.has_artifact)
+        self.assertEqual(1, remove_expired_artifacts(max_age=-1))
+        self.assertFalse(job.has_artifact)
+        response = self.get(self.reverse('core:download_export', kwargs={'pk': e.pk, 'key': job.key}))
+        self.assertEqual(404, response.status_code)
+
+    def test_invalid_export(self):
+        e = self.experiment
+        self.login_experimenter()
+        response = self.post(self.reverse('core:start_export', kwargs={'pk': e.pk, 'exporter_name': 'invalid'}))
+        self.assertEqual(404, response.status_code)
+        response = self.get(self.reverse('core:export_status', kwargs={'pk': e.pk, 'key': '0' * 40}))
+        self.assertEqual(404, response.status_code)
+
+
+class ColumnarExportTest(BaseVcwebTest):
+
+    def test_export_command(self):
+        import pyarrow.parquet
+        e = self.advance_to_data_round()
+        e.advance_to_next_round()
+        outdir = tempfile.mkdtemp()
+        try:
+            call_command('export_columnar', e.pk, outdir=outdir, batch_size=7)
+            self.assertEqual(sorted(table.file_name for table in COLUMNAR_TABLES), sorted(os.listdir(outdir)))
+            participant_data_values = pyarrow.parquet.read_table(
+                os.path.join(outdir, 'participant_data_values.parquet')).to_pydict()
+            self.assertEqual(get_participant_data_values(e).count(),
+                             len(participant_data_values['participant_group_relationship_id']))
+            self.assertTrue(set(participant_data_values['participant_group_relationship_id']).issubset(
+                e.participant_group_relationships.values_list('pk', flat=True)))
+            chat_messages = pyarrow.parquet.read_table(os.path.join(outdir, 'chat_messages.parquet'))
+            self.assertEqual(get_chat_messages(e).count(), chat_messages.num_rows)
+        finally:
+            shutil.rmtree(outdir)
+
+    def test_download_parquet(self):
+        e = self.advance_to_data_round()
+        self.login_experimenter()
+        response = self.get(self.reverse('core:download_data', kwargs={'pk': e.pk, 'file_type': 'parquet'}))
+        self.assertEqual(200, response.status_code)
+        with zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content))) as archive:
+            self.assertEqual(sorted(table.file_name for table in COLUMNAR_TABLES), sorted(archive.namelist()))
+
+
 class CheckEmailTest(BaseVcwebTest):
 
     def test_email_available(self):
@@ -419,6 +667,28 @@ class SubjectPoolViewTest(SubjectPoolTest):
         ps = ParticipantSignup.objects.waitlist(experiment_session_pk=invitation.experiment_session_id)
         self.assertFalse(ps.exists())
 
+    def test_experiment_session_signup_without_redis(self):
+        """ signups fall back to counting participant signups when the seat reservations are unreachable """
+        participants = self.setup_participants(number=2)
+        es_pk_list = self.setup_experiment_sessions(number=1, capacity=1)
+        self.setup_invitations(participants, es_pk_list)
+        unreachable = redis.Redis(host='localhost', port=1, socket_connect_timeout=1)
+        redis_instance = SessionSeatReservations.redis
+        SessionSeatReservations.redis = staticmethod(lambda: unreachable)
+        try:
+            for participant in participants:
+                self.assertTrue(self.login_participant(participant))
+                invitation = Invitation.objects.get(participant=participant)
+                response = self.post(self.reverse('subjectpool:submit_experiment_session_signup'), {
+                    'invitation_pk': invitation.pk,
+                    'experiment_metadata_pk': invitation.experiment_session.experiment_metadata_id
+                })
+                self.assertEqual(302, response.status_code)
+        finally:
+            SessionSeatReservations.redis = staticmethod(redis_instance)
+        self.assertEqual(1, ParticipantSignup.objects.registered(experiment_session_pk=es_pk_list[0]).count())
+        self.assertEqual(1, ParticipantSignup.objects.filter(invitation__experiment_session__pk__in=es_pk_list).count())
+
     def test_manage_participant_attendance(self):
         e = self.create_experimenter()
         self.assertTrue(self.login_experimenter(e))
@@ -6,7 +6,7 @@ from rest_framework import routers
 
 from . import views
 from .api import (get_round_data, save_experimenter_notes, create_experiment, clone_experiment, is_email_available,
-                  handle_chat_message, check_ready_participants, participant_ready, )
+                  handle_chat_message, check_ready_participants, participant_ready, get_experiment_model, )
 from .views import (dashboard, LoginView, LogoutView, monitor, RegisterEmailListView, RegisterTestParticipantsView,
                     completed_survey, toggle_bookmark_experiment_metadata, check_survey_completed, ParticipateView,
                     download_data, download_participants, export_configuration, get_dashboard_view_model,
@@ -15,7 +15,7 @@ from .views import (dashboard, LoginView, LogoutView, monitor, RegisterEmailList
                     unsubscribe, update_round_param_value, update_experiment_param_value,
                     update_experiment_configuration, OstromlabFaqList, cas_asu_registration,
                     cas_asu_registration_submit, account_profile, update_account_profile, update_participants,
-                    audit_report)
+                    audit_report, start_export, export_status, download_export)
 
 logger = logging.getLogger(__name__)
 
@@ -47,6 +47,10 @@ urlpatterns = [
         name='register_test_participants'),
     url(r'^experiment/(?P<pk>\d+)/download/(?P<file_type>[\w]+)$', download_data, name='download_data'),
     url(r'^experiment/(?P<pk>\d+)/download-participants/$', download_participants, name='download_participants'),
+    url(r'^experiment/(?P<pk>\d+)/exports/(?P<exporter_name>[\w-]+)$', start_export, name='start_export'),
+    url(r'^experiment/(?P<pk>\d+)/exports/(?P<key>[0-9a-f]{40})/status$', export_status, name='export_status'),
+    url(r'^experiment/(?P<pk>\d+)/exports/(?P<key>[0-9a-f]{40})/download$', download_export,
+        name='download_export'),
     url(r'^experiment/(?P<pk>\d+)/export/configuration(?P<file_extension>.[\w]+)$', export_configuration,
         name='export_configuration'),
     url(r'^configuration/(?P<pk>\d+)/$', show_experiment_configuration, name='show_experiment_configuration'),
@@ -71,6 +75,7 @@ urlpatterns = [
     url(r'^api/experiment/update', update_experiment, name='update_experiment'),
     url(r'^api/experimenter/save-notes', save_experimenter_notes, name='save_experimenter_notes'),
     url(r'^api/experimenter/round-data', get_round_data, name='get_round_data'),
+    url(r'^api/experimenter/experiment-model', get_experiment_model, name='experiment_model'),
     url(r'^api/dashboard', get_dashboard_view_model, name='dashboard_view_model'),
     url(r'bug-report', RedirectView.as_view(url='https://github.com/virtualcommons/vcweb/issues/new'),
         name='report_issues'),
@@ -0,0 +1,347 @@
+"""
+Shared group sections of participant view models.
+
+Most of a participant's view model in the bound and forestry experiments describes their group (resource levels,
+group member data, chat messages) and used to be recomputed by every group member on every poll. A GroupViewModel
+subclass computes that shared section once per group and round state, caches it and publishes it over the group's
+redis channel as a group_view_model event. Participant view model requests only add their own slice and the
+experiment level fields on top of the cached section.
+
+Sections are refreshed after round transitions and whenever an experiment signals a change to group state via
+`refresh_group_view_models`, and invalidated by `invalidate_group_view_models` for changes that are already pushed to
+clients some other way (e.g., chat messages).
+
+StateVersion keeps monotonically increasing versions of experiment and group state in redis. They are bumped by data
+value writes, round transitions and chat messages and used as ETags on view model endpoints so that polling clients
+that are already up to date get a 304 Not Modified for the price of a redis round trip.
+"""
+import logging
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+from . import signals
+from .http import dumps
+from .models import (ChatMessage, Comment, Experiment, ExperimentActivityLog, ExperimentGroup, GroupCluster,
+                     GroupClusterDataValue, GroupRelationship, GroupRoundDataValue, Like,
+                     ParticipantExperimentRelationship, ParticipantGroupRelationship, ParticipantRoundDataValue,
+                     RoundData)
+from ..redis_pubsub import RedisPubSub
+
+logger = logging.getLogger(__name__)
+
+_group_view_models = {}
+
+
+def register_group_view_model(namespace):
+    """ class decorator registering a GroupViewModel subclass for the experiment metadata with the given namespace """
+    def register(cls):
+        _group_view_models[namespace] = cls
+        return cls
+    return register
+
+
+def get_group_view_model(experiment):
+    cls = _group_view_models.get(experiment.experiment_metadata.namespace)
+    return None if cls is None else cls(experiment)
+
+
+class GroupViewModel(object):
+
+    event_type = 'group_view_model'
+
+    def __init__(self, experiment):
+        self.experiment = experiment
+
+    @property
+    def round_data(self):
+        return self.experiment.current_round_data
+
+    def compute(self, group):
+        """
+        returns a dict with the group level view model data for the given group, keys starting with _ are private.
+        Sections are only refreshed on group and round state changes, so experiment level fields (e.g., status)
+        don't belong here.
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def get_cache_key(round_data_pk, group_pk):
+        return 'group_view_model.{0}.{1}'.format(round_data_pk, group_pk)
+
+    def get(self, group):
+        """ returns the cached section for the group, computing and caching it if necessary """
+        key = self.get_cache_key(self.round_data.pk, group.pk)
+        section = cache.get(key)
+        if section is None:
+            section = self.compute(group)
+            cache.set(key, section, settings.GROUP_VIEW_MODEL_CACHE_TIMEOUT)
+        return section
+
+    def refresh(self, groups=None, publish=True):
+        """ recomputes, caches and by default publishes the section for the given groups, all groups by default """
+        if groups is None:
+            groups = self.experiment.groups
+        round_data_pk = self.round_data.pk
+        for group in groups:
+            section = self.compute(group)
+            cache.set(self.get_cache_key(round_data_pk, group.pk), section, settings.GROUP_VIEW_MODEL_CACHE_TIMEOUT)
+            if publish:
+                self.experiment.notify_participants(dumps({
+                    'event_type': self.event_type,
+                    'groupViewModel': self.to_public_dict(section),
+                }), group=group)
+
+    def invalidate(self, groups):
+        round_data_pk = self.round_data.pk
+        cache.delete_many([self.get_cache_key(round_data_pk, group.pk) for group in groups])
+
+    @staticmethod
+    def to_public_dict(section):
+        return {k: v for k, v in section.items() if not k.startswith('_')}
+
+
+def refresh_group_view_models(experiment, groups=None):
+    """
+    Refreshes and publishes the group view model sections of the given groups (all groups by default) once the
+    current transaction commits. Repeated requests for all groups within one transaction are only run once.
+    """
+    group_view_model = get_group_view_model(experiment)
+    if group_view_model is None:
+        return
+    if groups is None:
+        if getattr(experiment, '_group_view_model_refresh_scheduled', False):
+            return
+        experiment._group_view_model_refresh_scheduled = True
+
+    def refresh():
+        experiment._group_view_model_refresh_scheduled = False
+        try:
+            group_view_model.refresh(groups)
+        except Exception:
+            logger.exception("unable to refresh group view models for %s", experiment)
+    transaction.on_commit(refresh)
+
+
+def invalidate_group_view_models(experiment, groups):
+    group_view_model = get_group_view_model(experiment)
+    if group_view_model is not None:
+        group_view_model.invalidate(groups)
+
+
+class StateVersion(object):
+
+    """
+    Redis state versions for an experiment. The experiment hash holds the `version` of experiment wide state that
+    participants see, an `all` version that also changes with every group and experimenter-only change (activity log,
+    experimenter notes), and whether a round is `in_progress`. Group versions are kept in separate keys.
+
+    Missing keys are initialized to the current time in milliseconds before they are incremented so that a version is
+    never reused after a key expires or redis is flushed.
+    """
+
+    BUMP_SCRIPT = """
+redis.call('HSETNX', KEYS[1], 'version', ARGV[1])
+redis.call('HSETNX', KEYS[1], 'all', ARGV[1])
+redis.call('HINCRBY', KEYS[1], 'all', 1)
+if ARGV[3] == '1' then
+    redis.call('HINCRBY', KEYS[1], 'version', 1)
+end
+if ARGV[4] ~= '' then
+    redis.call('HSET', KEYS[1], 'in_progress', ARGV[4])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+for i = 2, #KEYS do
+    redis.call('SETNX', KEYS[i], ARGV[1])
+    redis.call('INCR', KEYS[i])
+    redis.call('EXPIRE', KEYS[i], ARGV[2])
+end
+"""
+
+    def __init__(self, experiment_pk):
+        self.experiment_pk = experiment_pk
+
+    @staticmethod
+    def redis():
+        return RedisPubSub.get_redis_instance()
+
+    @property
+    def key(self):
+        return 'state_version.experiment.{0}'.format(self.experiment_pk)
+
+    @staticmethod
+    def get_group_key(group_pk):
+        return 'state_version.group.{0}'.format(group_pk)
+
+    def bump(self, group_pks=(), experiment=False, round_in_progress=None):
+        """
+        increments the versions of the given groups and, if experiment is True, the experiment wide version. The all
+        version is always incremented.
+        """
+        keys = [self.key] + [self.get_group_key(group_pk) for group_pk in group_pks]
+        in_progress = '' if round_in_progress is None else int(round_in_progress)
+        self.redis().eval(StateVersion.BUMP_SCRIPT, len(keys), *(keys + [int(time.time() * 1000),
+                                                                         settings.STATE_VERSION_TTL,
+                                                                         int(experiment), in_progress]))
+
+    def bump_on_commit(self, **kwargs):
+        transaction.on_commit(lambda: self.bump(**kwargs))
+
+    def get(self, group_pks=()):
+        """ returns an (experiment version, all version, round in progress, [group versions]) tuple """
+        pipe = self.redis().pipeline()
+        pipe.hmget(self.key, 'version', 'all', 'in_progress')
+        if group_pks:
+            pipe.mget([self.get_group_key(group_pk) for group_pk in group_pks])
+        results = pipe.execute()
+        version, all_version, in_progress = results[0]
+        group_versions = results[1] if group_pks else []
+        if version is None or all_version is None or None in group_versions:
+            self.bump(group_pks, experiment=True)
+            return self.get(group_pks)
+        # unknown round status counts as in progress
+        return int(version), int(all_version), in_progress != b'0', [int(v) for v in group_versions]
+
+    def get_etag(self, group_pks=(), all_groups=False, extra=(), time_resolution=1):
+        """
+        returns an ETag for a view model that depends on the given groups, or on all groups in the experiment if
+        all_groups is True. view models include the time remaining, so while a round is in progress the ETag also
+        changes every time_resolution seconds.
+        """
+        version, all_version, in_progress, group_versions = self.get(group_pks)
+        parts = [all_version if all_groups else version] + group_versions + list(extra)
+        if in_progress:
+            parts.append(int(time.time() // time_resolution))
+        return '-'.join(map(str, parts))
+
+
+def get_participant_etag(request, experiment_pk, **kwargs):
+    """ returns an ETag for the authenticated participant's view model in the given experiment """
+    pgrs = list(ParticipantGroupRelationship.objects.filter(
+        group__experiment__pk=experiment_pk,
+        participant__user=request.user).order_by('pk').values_list('pk', 'group'))
+    if not pgrs:
+        return None
+    pgr_pks, group_pks = zip(*pgrs)
+    return StateVersion(experiment_pk).get_etag(group_pks, extra=pgr_pks, **kwargs)
+
+
+def round_state_changed(sender, experiment=None, **kwargs):
+    if experiment is not None:
+        StateVersion(experiment.pk).bump_on_commit(experiment=True,
+                                                   round_in_progress=experiment.is_round_in_progress)
+        refresh_group_view_models(experiment)
+
+
+def experiment_saved(sender, instance=None, raw=False, **kwargs):
+    if not raw:
+        StateVersion(instance.pk).bump_on_commit(experiment=True, round_in_progress=instance.is_round_in_progress)
+
+
+def participant_data_value_saved(sender, instance=None, raw=False, **kwargs):
+    if not raw:
+        pgr = instance.participant_group_relationship
+        StateVersion(instance.round_data.experiment_id).bump_on_commit(group_pks=[pgr.group_id])
+
+
+def participant_group_relationship_saved(sender, instance=None, raw=False, **kwargs):
+    if not raw:
+        StateVersion(instance.group.experiment_id).bump_on_commit(group_pks=[instance.group_id])
+
+
+def group_data_value_saved(sender, instance=None, raw=False, **kwargs):
+    if not raw:
+        StateVersion(instance.round_data.experiment_id).bump_on_commit(group_pks=[instance.group_id])
+
+
+def group_cluster_data_value_saved(sender, instance=None, raw=False, **kwargs):
+    if not raw:
+        StateVersion(instance.round_data.experiment_id).bump_on_commit(experiment=True)
+
+
+def data_values_flushed(sender, data_values=(), **kwargs):
+    """ data values written in bulk by a DataValueUnitOfWork don't send post_save """
+    experiment_pks = dict(RoundData.objects.filter(pk__in=set(dv.round_data_id for dv in data_values)).values_list(
+        'pk', 'experiment'))
+    pgr_group_pks = dict(ParticipantGroupRelationship.objects.filter(
+        pk__in=set(dv.participant_group_relationship_id for dv in data_values
+                   if isinstance(dv, ParticipantRoundDataValue))).values_list('pk', 'group'))
+    group_pks = defaultdict(set)
+    cluster_experiment_pks = set()
+    for dv in data_values:
+        experiment_pk = experiment_pks[dv.round_data_id]
+        if isinstance(dv, ParticipantRoundDataValue):
+            group_pks[experiment_pk].add(pgr_group_pks[dv.participant_group_relationship_id])
+        elif isinstance(dv, GroupRoundDataValue):
+            group_pks[experiment_pk].add(dv.group_id)
+        else:
+            cluster_experiment_pks.add(experiment_pk)
+    for experiment_pk in set(group_pks).union(cluster_experiment_pks):
+        StateVersion(experiment_pk).bump_on_commit(group_pks=sorted(group_pks[experiment_pk]),
+                                                   experiment=experiment_pk in cluster_experiment_pks)
+
+
+def data_values_updated(experiment_pk):
+    """
+    data values changed with QuerySet.update() send no post_save and don't touch last_modified, call this after such
+    updates so that view model ETags and export artifact keys (see vcweb.core.export.get_data_version) change
+    """
+    StateVersion(experiment_pk).bump_on_commit(experiment=True)
+
+
+def experiment_data_changed(sender, instance=None, raw=False, **kwargs):
+    """
+    registration, group structure and deleted rows aren't reflected in any data value modification time. Not
+    connected to post_delete of data values or group memberships, which would disable fast cascading deletes: those
+    are only deleted along with their round data or groups, or when the experiment itself is cleared and saved.
+    """
+    if raw:
+        return
+    if isinstance(instance, GroupRelationship):
+        experiment_pk = GroupCluster.objects.filter(pk=instance.cluster_id).values_list('experiment',
+                                                                                       flat=True).first()
+    else:
+        experiment_pk = instance.experiment_id
+    if experiment_pk is not None:
+        data_values_updated(experiment_pk)
+
+
+def experimenter_data_saved(sender, instance=None, raw=False, **kwargs):
+    """ activity log messages and experimenter notes are only shown on the experimenter monitor """
+    if not raw:
+        StateVersion(instance.experiment_id).bump_on_commit()
+
+
+def connect_signals():
+    """
+    connected once all apps are loaded so that round transitions are handled after the experiment specific round
+    signal handlers have updated the group data (end_round does not run in a transaction, so on_commit callbacks
+    may run immediately)
+    """
+    signals.round_started.connect(round_state_changed, dispatch_uid='refresh-group-view-models-on-round-started')
+    signals.round_ended.connect(round_state_changed, dispatch_uid='refresh-group-view-models-on-round-ended')
+    post_save.connect(experiment_saved, sender=Experiment, dispatch_uid='bump-state-version-experiment')
+    # post_save is only sent for the concrete model class, not its parents
+    for model in (ParticipantRoundDataValue, ChatMessage, Comment, Like):
+        post_save.connect(participant_data_value_saved, sender=model,
+                          dispatch_uid='bump-state-version-{0}'.format(model._meta.model_name))
+    post_save.connect(participant_group_relationship_saved, sender=ParticipantGroupRelationship,
+                      dispatch_uid='bump-state-version-participant-group-relationship')
+    post_save.connect(group_data_value_saved, sender=GroupRoundDataValue,
+                      dispatch_uid='bump-state-version-group-round-data-value')
+    post_save.connect(group_cluster_data_value_saved, sender=GroupClusterDataValue,
+                      dispatch_uid='bump-state-version-group-cluster-data-value')
+    signals.data_values_flushed.connect(data_values_flushed, dispatch_uid='bump-state-version-data-values-flushed')
+    post_save.connect(experimenter_data_saved, sender=ExperimentActivityLog,
+                      dispatch_uid='bump-state-version-experiment-activity-log')
+    post_save.connect(experimenter_data_saved, sender=RoundData, dispatch_uid='bump-state-version-round-data')
+    for model in (ParticipantExperimentRelationship, ExperimentGroup, GroupCluster, GroupRelationship):
+        post_save.connect(experiment_data_changed, sender=model,
+                          dispatch_uid='bump-state-version-{0}'.format(model._meta.model_name))
+    for model in (RoundData, ParticipantExperimentRelationship, ExperimentGroup, GroupCluster):
+        post_delete.connect(experiment_data_changed, sender=model,
+                            dispatch_uid='bump-state-version-{0}-deleted'.format(model._meta.model_name))
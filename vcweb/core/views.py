@@ -1,10 +1,8 @@
-import itertools
 import logging
 import mimetypes
 import uuid
 from collections import defaultdict
 
-import unicodecsv
 from contact_form.views import ContactFormView
 from dal import autocomplete
 from django.conf import settings
@@ -16,7 +14,7 @@ from django.core.exceptions import PermissionDenied
 from django.core.urlresolvers import reverse
 from django.db import models
 from django.db import transaction
-from django.http import HttpResponse
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect, get_object_or_404
 from django.utils.decorators import method_decorator
 from django.utils.translation import ugettext_lazy as _
@@ -29,15 +27,17 @@ from rest_framework.response import Response
 
 from .api import SUCCESS_DICT, FAILURE_DICT, create_message_event
 from .decorators import (anonymous_required, is_participant, is_experimenter, ownership_required, group_required)
+from .export import (DATA_EXPORTER, PARQUET_EXPORTER, PARTICIPANTS_EXPORTER, SUMMARY_EXPORTER, ExportJob,
+                     get_exporter)
 from .forms import (ParticipantAccountForm, ExperimenterAccountForm, UpdateExperimentForm,
                     AsuRegistrationForm, RegisterEmailListParticipantsForm, RegisterTestParticipantsForm,
                     BookmarkExperimentMetadataForm, ExperimentConfigurationForm, ExperimentParameterValueForm,
                     RoundConfigurationForm, RoundParameterValueForm, AntiSpamContactForm, PortOfMarsSignupForm)
 from .http import JsonResponse, dumps
-from .models import (User, ChatMessage, Participant, ParticipantExperimentRelationship, ParticipantGroupRelationship,
+from .models import (User, Participant, ParticipantExperimentRelationship, ParticipantGroupRelationship,
                      ExperimentConfiguration, Experiment, Institution, BookmarkedExperimentMetadata, OstromlabFaqEntry,
                      ExperimentParameterValue, RoundConfiguration, RoundParameterValue, ParticipantSignup,
-                     get_model_fields, PermissionGroup, get_audit_data, )
+                     PermissionGroup, get_audit_data, )
 from .permissions import CanEditExperiment
 from .serializers import ExperimentSerializer, ExperimentRegistrationSerializer
 from ..redis_pubsub import RedisPubSub
@@ -468,49 +468,15 @@ class RegisterTestParticipantsView(BaseExperimentRegistrationView):
 
 
 class DataExportMixin(ExperimenterSingleExperimentMixin):
-    file_extension = '.csv'
+    exporter = None
 
     def render_to_response(self, context, **response_kwargs):
         experiment = self.get_object()
-        file_ext = self.file_extension
-        if file_ext in mimetypes.types_map:
-            content_type = mimetypes.types_map[file_ext]
-        else:
-            content_type = 'application/octet-stream'
-        response = HttpResponse(content_type=content_type)
-        response[
-            'Content-Disposition'] = 'attachment; filename=%s' % experiment.data_file_name(file_ext=file_ext)
-        self.export_data(response, experiment)
-        return response
+        return export_response(self.exporter, experiment)
 
 
 class CsvDataExporter(DataExportMixin):
-
-    def export_data(self, response, experiment):
-        writer = unicodecsv.writer(response, encoding='utf-8')
-        writer.writerow(['Group', 'Members'])
-        for group in experiment.group_set.all():
-            writer.writerow(
-                itertools.chain.from_iterable([[group], group.participant_set.all()]))
-        for round_data in experiment.round_data_set.all():
-            round_configuration = round_data.round_configuration
-            # write out group-wide and participant data values
-            writer.writerow(['Owner', 'Round', 'Data Parameter',
-                             'Data Parameter Value', 'Created On', 'Last Modified'])
-            for data_value in itertools.chain(round_data.group_data_value_set.all(),
-                                              round_data.participant_data_value_set.all()):
-                writer.writerow([data_value.owner, round_configuration, data_value.parameter.label,
-                                 data_value.value, data_value.date_created, data_value.last_modified])
-                # write out all chat messages as a side bar
-            chat_messages = ChatMessage.objects.filter(round_data=round_data)
-            if chat_messages.count() > 0:
-                # sort by group first, then time
-                writer.writerow(['Chat Messages'])
-                writer.writerow(
-                    ['Group', 'Participant', 'Message', 'Time', 'Round'])
-                for chat_message in chat_messages.order_by('participant_group_relationship__group', 'date_created'):
-                    writer.writerow([chat_message.group, chat_message.participant, chat_message.message,
-                                     chat_message.date_created, round_configuration])
+    exporter = SUMMARY_EXPORTER
 
 
 @group_required(PermissionGroup.experimenter)
@@ -531,91 +497,95 @@ def export_configuration(request, pk=None, file_extension='.xml'):
 @require_GET
 def download_participants(request, pk=None):
     experiment = get_object_or_404(Experiment, pk=pk)
-    response = HttpResponse(content_type=mimetypes.types_map['.csv'])
-    response['Content-Disposition'] = 'attachment; filename=participants.csv'
-    writer = unicodecsv.writer(response, encoding='utf-8')
-    writer.writerow(['Email', 'Password', 'URL'])
-    full_participant_url = experiment.full_participant_url
-    authentication_code = experiment.authentication_code
-    for participant in experiment.participant_set.all():
-        writer.writerow(
-            [participant.email, authentication_code, full_participant_url])
+    return export_response(PARTICIPANTS_EXPORTER, experiment)
+
+
+def export_response(exporter, experiment):
+    """
+    Serves the given export from its cached artifact when one exists for the current state of the experiment's data,
+    otherwise streams it directly to the client.
+    """
+    job = ExportJob.create(exporter, experiment)
+    artifact = job.open_artifact()
+    if artifact is not None:
+        logger.debug("serving cached export %s", job.artifact_path)
+        response = FileResponse(artifact, content_type=exporter.content_type)
+    else:
+        response = StreamingHttpResponse(exporter.stream(experiment), content_type=exporter.content_type)
+    response['Content-Disposition'] = 'attachment; filename=%s' % exporter.get_file_name(experiment)
     return response
 
 
+def get_export_job_dict(job):
+    data = job.to_dict()
+    data.update(
+        statusUrl=reverse('core:export_status', kwargs={'pk': job.experiment_pk, 'key': job.key}),
+        downloadUrl=reverse('core:download_export', kwargs={'pk': job.experiment_pk, 'key': job.key}),
+    )
+    return data
+
+
+@group_required(PermissionGroup.experimenter, PermissionGroup.demo_experimenter)
+@require_POST
+@ownership_required(Experiment)
+def start_export(request, pk=None, exporter_name=None):
+    """ queues a background export job for the given experiment unless a cached artifact is already available """
+    experiment = get_object_or_404(Experiment, pk=pk)
+    try:
+        exporter = get_exporter(exporter_name)
+    except KeyError:
+        raise Http404("No exporter named %s" % exporter_name)
+    job = ExportJob.create(exporter, experiment)
+    job.enqueue()
+    return JsonResponse({'success': True, 'job': get_export_job_dict(job)})
+
+
+def get_export_job(pk, key):
+    job = ExportJob(key)
+    if not job.exists or job.experiment_pk != int(pk):
+        raise Http404("No export %s for experiment %s" % (key, pk))
+    return job
+
+
+@group_required(PermissionGroup.experimenter, PermissionGroup.demo_experimenter)
+@require_GET
+@ownership_required(Experiment)
+def export_status(request, pk=None, key=None):
+    job = get_export_job(pk, key)
+    return JsonResponse({'success': True, 'job': get_export_job_dict(job)})
+
+
+@group_required(PermissionGroup.experimenter, PermissionGroup.demo_experimenter)
+@require_GET
+@ownership_required(Experiment)
+def download_export(request, pk=None, key=None):
+    job = get_export_job(pk, key)
+    experiment = get_object_or_404(Experiment, pk=pk)
+    artifact = job.open_artifact()
+    if artifact is None:
+        raise Http404("Export %s is not available: %s" % (key, job.status))
+    exporter = job.exporter
+    response = FileResponse(artifact, content_type=exporter.content_type)
+    response['Content-Disposition'] = 'attachment; filename=%s' % exporter.get_file_name(experiment)
+    return response
+
+
+DOWNLOAD_DATA_EXPORTERS = {
+    'csv': DATA_EXPORTER,
+    'parquet': PARQUET_EXPORTER,
+}
+
+
 # FIXME: add data converter objects to write to csv, excel, etc.
 @group_required(PermissionGroup.experimenter, PermissionGroup.demo_experimenter)
 @require_GET
 @ownership_required(Experiment)
 def download_data(request, pk=None, file_type='csv'):
-    experiment = get_object_or_404(Experiment.objects.select_related('experimenter'), pk=pk)
-    content_type = mimetypes.types_map['.%s' % file_type]
-    logger.debug("Downloading data as %s", content_type)
-    response = HttpResponse(content_type=content_type)
-    response['Content-Disposition'] = 'attachment; filename=%s' % experiment.data_file_name()
-    writer = unicodecsv.writer(response, encoding='utf-8')
-    """ header for group membership, session id, and base participant data """
-    writer.writerow(['Group ID', 'Group Number', 'Group Cluster ID', 'Session ID', 'Participant ID', 'Participant Email'])
-    group_to_cluster_dict = defaultdict(str)
-    for group_cluster in experiment.group_cluster_set.all():
-        for g in group_cluster.group_relationship_set.select_related('group').values_list('group', flat=True):
-            group_to_cluster_dict[g] = group_cluster.pk
-
-    for group in experiment.group_set.order_by('pk').all():
-        for pgr in group.participant_group_relationship_set.select_related('participant__user').all():
-            writer.writerow([group.pk, group.number, group_to_cluster_dict[group.pk], group.session_id, pgr.pk,
-                             pgr.participant.email])
-    """ header for participant data values, chat messages, and per-group data ordered per-round"""
-    writer.writerow(
-        ['Round', 'Participant ID', 'Participant Number', 'Group ID', 'Parameter', 'Value',
-         'Creation Date', 'Creation Time', 'Last Modified Date', 'Last Modified Time'])
-    lookup_table_parameters = set()
-    for round_data in experiment.round_data_set.select_related('round_configuration').all():
-        round_number = round_data.round_number
-        # emit experimenter notes
-        if round_data.experimenter_notes:
-            writer.writerow(
-                [round_number, experiment.experimenter.email, '', '', 'Experimenter Notes',
-                 round_data.experimenter_notes, '', '', '', ''])
-        # emit all participant data values
-        for data_value in round_data.participant_data_value_set.select_related('participant_group_relationship__group',
-                                                                               'parameter').all():
-            pgr = data_value.participant_group_relationship
-            if data_value.parameter.is_foreign_key:
-                lookup_table_parameters.add(data_value.parameter)
-            dc = data_value.date_created
-            lm = data_value.last_modified
-            writer.writerow(
-                [round_number, pgr.pk, pgr.participant_number, pgr.group.pk, data_value.parameter.label,
-                 data_value.value, dc.date(), dc.time(), lm.date(), lm.time()])
-            # emit all chat messages
-        chat_messages = ChatMessage.objects.filter(round_data=round_data)
-        if chat_messages.count() > 0:
-            for chat_message in chat_messages.order_by('participant_group_relationship__group', 'date_created'):
-                pgr = chat_message.participant_group_relationship
-                dc = chat_message.date_created
-                lm = chat_message.last_modified
-                writer.writerow([round_number, pgr.pk, pgr.participant_number, pgr.group.pk, "Chat Message",
-                                 chat_message.string_value, dc.date(), dc.time(), lm.date(), lm.time()])
-        # emit group round data values
-        for data_value in round_data.group_data_value_set.select_related('group').all():
-            dc = data_value.date_created
-            lm = data_value.last_modified
-            writer.writerow([round_number, '', '', data_value.group.pk, data_value.parameter.label,
-                             data_value.value, dc.date(), dc.time(), lm.date(), lm.time()])
-    if lookup_table_parameters:
-        writer.writerow(['Lookup Tables'])
-        for ltp in lookup_table_parameters:
-            model = ltp.get_model_class()
-            # introspect on the model and emit all of its relevant fields
-            data_fields = get_model_fields(model)
-            data_field_names = itertools.chain(
-                ['Type', 'ID'], [f.verbose_name for f in data_fields])
-            writer.writerow(data_field_names)
-            for obj in model.objects.order_by('pk').all():
-                writer.writerow(itertools.chain(
-                    [model.__name__, obj.pk], [getattr(obj, f.name) for f in data_fields]))
-    return response
+    experiment = get_object_or_404(Experiment.objects.select_related('experimenter__user'), pk=pk)
+    logger.debug("Downloading data as %s", file_type)
+    if file_type not in DOWNLOAD_DATA_EXPORTERS:
+        raise Http404("Unsupported data file type %s" % file_type)
+    return export_response(DOWNLOAD_DATA_EXPORTERS[file_type], experiment)
 
 
 @group_required(PermissionGroup.experimenter)
@@ -1,14 +1,20 @@
 import logging
 import sys
-from collections import defaultdict
+from collections import Counter, defaultdict, OrderedDict
 
 from django.db import models, transaction
 from django.dispatch import receiver
+from django.utils import timezone
 
 from vcweb.core import signals, simplecache
-from vcweb.core.models import (DefaultValue, ExperimentMetadata, Parameter, ParticipantRoundDataValue,
-                               GroupRelationship, RoundConfiguration, get_participant_ready_parameter)
+from vcweb.core.models import (ChatMessage, DefaultValue, ExperimentMetadata, Parameter, ParticipantRoundDataValue,
+                               GroupRelationship, RoundConfiguration, get_participant_ready_parameter,
+                               GroupClusterDataValue, GroupRoundDataValue, ParticipantGroupRelationship,
+                               ReadyParticipantsCounter, DataValueUnitOfWork, bulk_copy_to_next_round,
+                               bulk_log_group_activity, bulk_update_data_values, get_or_create_data_values)
+from vcweb.core.view_models import GroupViewModel, data_values_updated, register_group_view_model
 from vcweb.experiment.forestry.models import (
+    MAX_RESOURCE_LEVEL as UNSHARED_MAX_RESOURCE_LEVEL,
     get_harvest_decision_parameter, get_harvest_decision, get_group_harvest_parameter,
     get_reset_resource_level_parameter, get_regrowth_parameter, get_initial_resource_level_parameter,
     set_resource_level as forestry_set_resource_level,
@@ -40,37 +46,30 @@ def get_experiment_metadata():
     return ExperimentMetadata.objects.get(namespace=EXPERIMENT_METADATA_NAME)
 
 
-@simplecache
 def get_player_status_parameter():
     return Parameter.objects.for_participant(name='player_status')
 
 
-@simplecache
 def get_storage_parameter():
     return Parameter.objects.for_participant(name='storage')
 
 
-@simplecache
 def get_max_harvest_decision_parameter():
     return Parameter.objects.for_experiment(name='max_harvest_decision')
 
 
-@simplecache
 def get_cost_of_living_parameter():
     return Parameter.objects.for_round(name='cost_of_living')
 
 
-@simplecache
 def get_observe_other_group_parameter():
     return Parameter.objects.for_round(name='observe_other_group')
 
 
-@simplecache
 def get_shared_resource_enabled_parameter():
     return Parameter.objects.for_round(name='shared_resource')
 
 
-@simplecache
 def get_empty_resource_death_parameter():
     return Parameter.objects.for_round(name='empty_resource_death_enabled')
 
@@ -81,7 +80,7 @@ def get_empty_resource_death_parameter():
 
 
 def get_regrowth_rate(round_configuration):
-    return round_configuration.get_parameter_value(name='regrowth_rate', default=0.40).float_value
+    return round_configuration.read_parameter_value(name='regrowth_rate', default=0.40).float_value
 
 
 # def is_empty_resource_death_enabled(round_configuration):
@@ -89,13 +88,13 @@ def get_regrowth_rate(round_configuration):
 #            default=False).boolean_value
 
 def can_observe_other_group(round_configuration):
-    return round_configuration.get_parameter_value(parameter=get_observe_other_group_parameter(),
-                                                   default=False).boolean_value
+    return round_configuration.read_parameter_value(parameter=get_observe_other_group_parameter(),
+                                                    default=False).boolean_value
 
 
 def is_shared_resource_enabled(round_configuration):
-    return round_configuration.get_parameter_value(parameter=get_shared_resource_enabled_parameter(),
-                                                   default=False).boolean_value
+    return round_configuration.read_parameter_value(parameter=get_shared_resource_enabled_parameter(),
+                                                    default=False).boolean_value
 
 
 def get_max_resource_level(round_configuration):
@@ -111,24 +110,24 @@ def get_max_resource_level(round_configuration):
 
 
 def get_initial_resource_level(round_configuration, default=None):
-    return round_configuration.get_parameter_value(parameter=get_initial_resource_level_parameter(),
-                                                   default=default).int_value
+    return round_configuration.read_parameter_value(parameter=get_initial_resource_level_parameter(),
+                                                    default=default).int_value
 
 
 def should_reset_resource_level(round_configuration, experiment):
     if round_configuration.is_repeating_round and experiment.current_repeated_round_sequence_number > 0:
         return False
-    return round_configuration.get_parameter_value(parameter=get_reset_resource_level_parameter(),
-                                                   default=False).boolean_value
+    return round_configuration.read_parameter_value(parameter=get_reset_resource_level_parameter(),
+                                                    default=False).boolean_value
 
 
 def get_cost_of_living(round_configuration):
-    return round_configuration.get_parameter_value(get_cost_of_living_parameter(), default=5).int_value
+    return round_configuration.read_parameter_value(parameter=get_cost_of_living_parameter(), default=5).int_value
 
 
 def get_max_harvest_decision(experiment_configuration):
-    return experiment_configuration.get_parameter_value(parameter=get_max_harvest_decision_parameter(),
-                                                        default=10).int_value
+    return experiment_configuration.read_parameter_value(parameter=get_max_harvest_decision_parameter(),
+                                                         default=10).int_value
 
 
 def get_resource_level(group, round_data=None, round_configuration=None, cluster=None):
@@ -267,11 +266,8 @@ def get_number_alive(group, round_data):
                                                        boolean_value=True).count()
 
 
-def get_player_data(group, previous_round_data, current_round_data, self_pgr):
-    """ Returns a tuple ([list of player data dictionaries], { dictionary of this player's data })
-
-     FIXME: refactor this into its own class as opposed to an arcane data structure
-    """
+def get_group_player_data(group, previous_round_data, current_round_data):
+    """ Returns a list of player data dictionaries for every participant in the given group """
     prdvs = ParticipantRoundDataValue.objects.for_group(group=group,
                                                         round_data__in=[
                                                             previous_round_data, current_round_data],
@@ -300,12 +296,77 @@ def get_player_data(group, previous_round_data, current_round_data, self_pgr):
             'alive': pgrdv_dict[get_player_status_parameter()].boolean_value,
             'storage': pgrdv_dict[get_storage_parameter()].int_value
         })
-    own_player = player_dict[self_pgr]
-    return (player_data, {
-        'lastHarvestDecision': own_player[get_harvest_decision_parameter()].int_value,
-        'alive': own_player[get_player_status_parameter()].boolean_value,
-        'storage': own_player[get_storage_parameter()].int_value
-    })
+    return player_data
+
+
+def get_own_player_data(player_data, self_pgr):
+    """ Returns the given participant's data from a list of player data dictionaries """
+    own_data = {'lastHarvestDecision': 0, 'alive': True, 'storage': 0}
+    for pd in player_data:
+        if pd['id'] == self_pgr.pk:
+            own_data.update((k, pd[k]) for k in own_data)
+            break
+    return own_data
+
+
+def get_player_data(group, previous_round_data, current_round_data, self_pgr):
+    """ Returns a tuple ([list of player data dictionaries], { dictionary of this player's data })
+
+     FIXME: refactor this into its own class as opposed to an arcane data structure
+    """
+    player_data = get_group_player_data(group, previous_round_data, current_round_data)
+    return (player_data, get_own_player_data(player_data, self_pgr))
+
+
+def get_group_summary(group, previous_round_data, current_round_data, number_alive=None):
+    """ Returns the resource summary shown for a group, i.e., the myGroup and otherGroup view model data """
+    resource_level = get_resource_level(group, current_round_data)
+    regrowth = get_regrowth_dv(group, current_round_data).value
+    if number_alive is None:
+        number_alive = "%s out of %s" % (get_number_alive(group, current_round_data), group.size)
+    return {
+        'resourceLevel': resource_level,
+        'regrowth': regrowth,
+        'originalResourceLevel': resource_level - regrowth,
+        'averageHarvest': get_average_harvest(group, previous_round_data),
+        'averageStorage': get_average_storage(group, current_round_data),
+        'numberAlive': number_alive,
+        'isResourceEmpty': resource_level == 0,
+    }
+
+
+@register_group_view_model(EXPERIMENT_METADATA_NAME)
+class BoundGroupViewModel(GroupViewModel):
+
+    """ group level data of the bound participant view model, shared by every member of a group """
+
+    def compute(self, group):
+        experiment = self.experiment
+        current_round = experiment.current_round
+        current_round_data = experiment.current_round_data
+        previous_round = experiment.previous_round
+        previous_round_data = experiment.get_round_data(round_configuration=previous_round, previous_round=True)
+        section = {'resourceLevel': get_resource_level(group, current_round_data)}
+        if current_round.is_playable_round or current_round.is_debriefing_round:
+            player_data = get_group_player_data(group, previous_round_data, current_round_data)
+            c = Counter(pd['alive'] for pd in player_data)
+            my_group = get_group_summary(group, previous_round_data, current_round_data,
+                                         number_alive="%s out of %s" % (c[True], sum(c.values())))
+            section.update(
+                playerData=player_data,
+                averageHarvest=my_group['averageHarvest'],
+                averageStorage=my_group['averageStorage'],
+                regrowth=my_group['regrowth'],
+                numberAlive=my_group['numberAlive'],
+                myGroup=my_group,
+            )
+        if previous_round.is_playable_round or current_round.is_playable_round:
+            section['chatMessages'] = [cm.to_dict() for cm in ChatMessage.objects.for_group(group)]
+            if can_observe_other_group(current_round):
+                section['canObserveOtherGroup'] = True
+                section['otherGroup'] = get_group_summary(group.get_related_group(), previous_round_data,
+                                                          current_round_data)
+        return section
 
 
 @receiver(signals.round_started, sender=EXPERIMENT_METADATA_NAME)
@@ -333,20 +394,23 @@ def round_started_handler(sender, experiment=None, **kwargs):
         initial_resource_level = get_max_resource_level(round_configuration)
         logger.debug("Resetting resource level for all groups in %s to %d",
                      round_configuration, initial_resource_level)
-        for group in experiment.groups:
-            # set resource level to initial default
-            existing_resource_level = get_resource_level_dv(group, round_data, round_configuration,
-                                                            shared_resource_enabled=shared_resource_enabled)
-            group.log("Resetting resource level (%s) to initial value [%s]" %
-                      (existing_resource_level, initial_resource_level))
-            existing_resource_level.update_int(initial_resource_level)
-            # zero out all participant storages when the resource level is
-            # reset
-            ParticipantRoundDataValue.objects.for_group(group, parameter=get_storage_parameter(),
-                                                        round_data=round_data).update(int_value=0)
-            # set all player statuses to alive when the resource level is reset
-            ParticipantRoundDataValue.objects.for_group(group, parameter=get_player_status_parameter(),
-                                                        round_data=round_data).update(boolean_value=True)
+        # resource levels are written with a single UPDATE
+        with DataValueUnitOfWork():
+            for group in experiment.groups:
+                # set resource level to initial default
+                existing_resource_level = get_resource_level_dv(group, round_data, round_configuration,
+                                                                shared_resource_enabled=shared_resource_enabled)
+                group.log("Resetting resource level (%s) to initial value [%s]" %
+                          (existing_resource_level, initial_resource_level))
+                existing_resource_level.update_int(initial_resource_level)
+                # zero out all participant storages when the resource level is
+                # reset
+                ParticipantRoundDataValue.objects.for_group(group, parameter=get_storage_parameter(),
+                                                            round_data=round_data).update(int_value=0)
+                # set all player statuses to alive when the resource level is reset
+                ParticipantRoundDataValue.objects.for_group(group, parameter=get_player_status_parameter(),
+                                                            round_data=round_data).update(boolean_value=True)
+        data_values_updated(experiment.pk)
     elif round_configuration.is_playable_round:
         # first check for a depleted resource
         # FIXME: currently disabled again as per Tim's instructions
@@ -375,6 +439,7 @@ def round_started_handler(sender, experiment=None, **kwargs):
 
 
 def _zero_harvest_decisions(participant_group_relationship_ids, round_data):
+    participant_group_relationship_ids = list(participant_group_relationship_ids)
     data_values = ParticipantRoundDataValue.objects.with_parameter(
         get_harvest_decision_parameter(), round_data=round_data,
         participant_group_relationship__pk__in=participant_group_relationship_ids)
@@ -383,6 +448,8 @@ def _zero_harvest_decisions(participant_group_relationship_ids, round_data):
         get_participant_ready_parameter(), round_data=round_data,
         participant_group_relationship__pk__in=participant_group_relationship_ids)
     data_values.update(boolean_value=True)
+    data_values_updated(round_data.experiment_id)
+    ReadyParticipantsCounter(round_data).add(*participant_group_relationship_ids)
     '''
     for dv in data_values:
         if dv.parameter == get_harvest_decision_parameter():
@@ -470,6 +537,7 @@ def update_resource_level(experiment, group, round_data, regrowth_rate, max_reso
         group_harvest_dv.update_int(0)
         ParticipantRoundDataValue.objects.for_group(group, parameter=get_harvest_decision_parameter(),
                                                     round_data=round_data).update(is_active=False)
+        data_values_updated(round_data.experiment_id)
         for pgr in group.participant_group_relationship_set.all():
             # Create adjusted data values
             ParticipantRoundDataValue.objects.create(participant_group_relationship=pgr,
@@ -530,28 +598,287 @@ def update_shared_resource_level(experiment, group_cluster, round_data, regrowth
         group_cluster.copy_to_next_round(shared_resource_level_dv, shared_regrowth_dv)
 
 
-@transaction.atomic
 def update_participants(experiment, round_data, round_configuration):
     logger.debug("updating participants")
     cost_of_living = get_cost_of_living(round_configuration)
-    next_round_data, created = experiment.get_or_create_round_data(round_configuration=experiment.next_round,
-                                                                   increment_repeated_round_sequence_number=True)
-    for group in experiment.groups:
-        for pgr in group.participant_group_relationship_set.all():
-            player_status_dv = get_player_status_dv(pgr, round_data)
-            storage_dv = get_storage_dv(pgr, round_data)
-            player_alive = player_status_dv.boolean_value
-            if player_alive:
-                harvest_decision = get_harvest_decision(pgr, round_data)
-                logger.error("storage dv %s harvest decision %s cost of living %s", storage_dv.int_value, harvest_decision,
-                             cost_of_living)
+    # buffers all storage and player status writes and next round copies into a few bulk statements
+    with DataValueUnitOfWork():
+        next_round_data, created = experiment.get_or_create_round_data(round_configuration=experiment.next_round,
+                                                                       increment_repeated_round_sequence_number=True)
+        for group in experiment.groups:
+            for pgr in group.participant_group_relationship_set.all():
+                player_status_dv = get_player_status_dv(pgr, round_data)
+                storage_dv = get_storage_dv(pgr, round_data)
+                player_alive = player_status_dv.boolean_value
+                if player_alive:
+                    harvest_decision = get_harvest_decision(pgr, round_data)
+                    logger.error("storage dv %s harvest decision %s cost of living %s", storage_dv.int_value,
+                                 harvest_decision, cost_of_living)
+                    updated_storage = storage_dv.int_value + harvest_decision - cost_of_living
+                    if updated_storage < 0:
+                        # player has "died"
+                        player_status_dv.update_boolean(False)
+                    # clamp storage to 0 to avoid negative earnings
+                    storage_dv.update_int(max(0, updated_storage))
+                pgr.copy_to_next_round(player_status_dv, storage_dv, next_round_data=next_round_data)
+
+
+class RoundEndedEngine(object):
+    """
+    Set-based round ended processing for a bound experiment round. Loads the round's harvest decisions, storages,
+    player statuses and resource data values in a fixed number of queries, computes harvest adjustments, regrowth,
+    deaths and storages for every group or group cluster in memory, and writes the results back in bulk.
+
+    The arithmetic mirrors adjust_harvest_decisions, update_resource_level, update_shared_resource_level and
+    update_participants, including the int truncation applied when data values are saved, so the resulting data values
+    are identical to the per-group and per-participant code. Group activity log messages are buffered in the order the
+    per-group code writes them and inserted in bulk when the results are saved.
+    """
+
+    def __init__(self, experiment, round_data=None):
+        self.experiment = experiment
+        self.round_configuration = experiment.current_round
+        if round_data is None:
+            round_data = experiment.get_round_data(self.round_configuration)
+        self.round_data = round_data
+        self.harvest_decision_parameter = get_harvest_decision_parameter()
+        self.deactivated_harvest_decisions = []
+        self.new_harvest_decisions = []
+        # (data value model, field name) -> {data value pk: updated value}
+        self.updated_values = defaultdict(dict)
+        self.next_round_data_values = []
+        # (group, round configuration, log message) tuples
+        self.group_activity_logs = []
+
+    @transaction.atomic
+    def run(self):
+        if not self.round_configuration.is_playable_round:
+            return
+        rc = self.round_configuration
+        self.regrowth_rate = get_regrowth_rate(rc)
+        self.max_resource_level = get_max_resource_level(rc)
+        self.shared_resource_enabled = is_shared_resource_enabled(rc)
+        self.load()
+        self.clean_harvest_decisions()
+        if self.shared_resource_enabled:
+            self.update_shared_resource_levels()
+        else:
+            self.update_resource_levels()
+        self.update_participants()
+        self.save()
+
+    def load(self):
+        e = self.experiment
+        self.groups = list(e.groups)
+        self.group_clusters = []
+        # group cluster pk -> list of groups, one per group relationship
+        self.cluster_groups = defaultdict(list)
+        group_ids = set(g.pk for g in self.groups)
+        if self.shared_resource_enabled:
+            self.group_clusters = list(e.active_group_clusters)
+            for gr in GroupRelationship.objects.select_related('group').filter(cluster__in=self.group_clusters):
+                self.cluster_groups[gr.cluster_id].append(gr.group)
+                group_ids.add(gr.group_id)
+        self.members = defaultdict(list)
+        for pgr in ParticipantGroupRelationship.objects.filter(group__pk__in=group_ids):
+            self.members[pgr.group_id].append(pgr)
+        self.participant_group_relationships = [pgr for g in self.groups for pgr in self.members[g.pk]]
+        # all active harvest decisions per participant, latest first
+        self.harvest_decisions = defaultdict(list)
+        for hd in ParticipantRoundDataValue.objects.filter(
+                round_data=self.round_data,
+                parameter=self.harvest_decision_parameter,
+                participant_group_relationship__group__pk__in=group_ids,
+                is_active=True).order_by('-date_created', '-pk'):
+            self.harvest_decisions[hd.participant_group_relationship_id].append(hd)
+        self.participant_data_values = get_or_create_data_values(
+            ParticipantRoundDataValue, 'participant_group_relationship',
+            [pgr.pk for pgr in self.participant_group_relationships], self.round_data,
+            {get_player_status_parameter(): True, get_storage_parameter(): None})
+        if self.shared_resource_enabled:
+            self.group_cluster_data_values = get_or_create_data_values(
+                GroupClusterDataValue, 'group_cluster', [gc.pk for gc in self.group_clusters], self.round_data,
+                {get_resource_level_parameter(): None, get_regrowth_parameter(): None})
+        else:
+            self.group_data_values = get_or_create_data_values(
+                GroupRoundDataValue, 'group', [g.pk for g in self.groups], self.round_data,
+                {get_resource_level_parameter(): UNSHARED_MAX_RESOURCE_LEVEL, get_group_harvest_parameter(): None,
+                 get_regrowth_parameter(): 0})
+
+    def clean_harvest_decisions(self):
+        """
+        creates zero harvest decisions for participants that didn't submit one and deactivates all but the latest
+        harvest decision for participants with several active harvest decisions
+        """
+        missing_harvest_decisions = []
+        for pgr in self.participant_group_relationships:
+            harvest_decisions = self.harvest_decisions[pgr.pk]
+            if not harvest_decisions:
+                logger.debug("autozero harvest decision for participant %s", pgr)
+                missing_harvest_decisions.append(ParticipantRoundDataValue(
+                    round_data=self.round_data, participant_group_relationship=pgr,
+                    parameter=self.harvest_decision_parameter, is_active=True, int_value=0))
+            elif len(harvest_decisions) > 1:
+                logger.debug("multiple harvest decisions found for %s, deactivating all but the latest", pgr)
+                self.deactivated_harvest_decisions.extend(harvest_decisions[1:])
+                del harvest_decisions[1:]
+        for hd in ParticipantRoundDataValue.objects.bulk_create(missing_harvest_decisions):
+            self.harvest_decisions[hd.participant_group_relationship_id].append(hd)
+
+    def create_harvest_decision(self, participant_group_relationship_id, value, submitted=False):
+        hd = ParticipantRoundDataValue(round_data=self.round_data,
+                                       participant_group_relationship_id=participant_group_relationship_id,
+                                       parameter=self.harvest_decision_parameter,
+                                       int_value=int(value),
+                                       submitted=submitted)
+        self.new_harvest_decisions.append(hd)
+        self.harvest_decisions[participant_group_relationship_id].insert(0, hd)
+        return hd
+
+    def log(self, group, log_message):
+        # empty group clusters have no group to log against
+        if group is not None:
+            self.group_activity_logs.append((group, self.round_configuration, log_message))
+
+    def set_value(self, data_value, field_name, value):
+        # IntegerField.get_prep_value truncates floats when data values are saved
+        if value is not None and field_name == 'int_value':
+            value = int(value)
+        setattr(data_value, field_name, value)
+        self.updated_values[(type(data_value), field_name)][data_value.pk] = value
+
+    def get_total_group_harvest(self, group):
+        return sum(hd.int_value for pgr in self.members[group.pk]
+                   for hd in self.harvest_decisions[pgr.pk] if hd.int_value is not None)
+
+    def adjust_harvest_decisions(self, current_resource_level, group, total_harvest, group_size=0):
+        """ in memory version of adjust_harvest_decisions """
+        if group_size == 0:
+            group_size = len(self.members[group.pk])
+        average_harvest = current_resource_level / group_size
+        self.log(group, "GROUP HARVEST ADJUSTMENT - original total harvest: %s, resource level: %s, "
+                        "average harvest: %s" % (total_harvest, current_resource_level, average_harvest))
+        hds = sorted([hd for pgr in self.members[group.pk] for hd in self.harvest_decisions[pgr.pk]
+                      if hd.int_value is not None and hd.int_value > 0],
+                     key=lambda hd: hd.int_value)
+        total_adjusted_harvest = 0
+        total_number_of_decisions = len(hds)
+        for decisions_allocated, hd in enumerate(hds):
+            if hd.int_value <= average_harvest:
+                self.log(group, "preserving %s < average harvest" % hd)
+                total_adjusted_harvest += hd.int_value
+            else:
+                remaining_resource_level = current_resource_level - total_adjusted_harvest
+                remaining_decisions = total_number_of_decisions - decisions_allocated
+                average_harvest = remaining_resource_level / remaining_decisions
+                logger.debug("Assigning %s to hd %s", average_harvest, hd)
+                self.deactivated_harvest_decisions.append(hd)
+                self.harvest_decisions[hd.participant_group_relationship_id].remove(hd)
+                self.create_harvest_decision(hd.participant_group_relationship_id, average_harvest, submitted=True)
+                total_adjusted_harvest += average_harvest
+        logger.debug("harvested total %s", total_adjusted_harvest)
+        return total_adjusted_harvest
+
+    def update_resource_levels(self):
+        resource_level_parameter = get_resource_level_parameter()
+        group_harvest_parameter = get_group_harvest_parameter()
+        regrowth_parameter = get_regrowth_parameter()
+        for group in self.groups:
+            resource_level_dv = self.group_data_values[(group.pk, resource_level_parameter.pk)]
+            group_harvest_dv = self.group_data_values[(group.pk, group_harvest_parameter.pk)]
+            regrowth_dv = self.group_data_values[(group.pk, regrowth_parameter.pk)]
+            current_resource_level = resource_level_dv.int_value
+            total_harvest = self.get_total_group_harvest(group)
+            if current_resource_level > 0:
+                if total_harvest > current_resource_level:
+                    total_harvest = self.adjust_harvest_decisions(current_resource_level, group, total_harvest)
+                self.log(group, "Harvest: removing %s from current resource level %s" %
+                         (total_harvest, current_resource_level))
+                self.set_value(group_harvest_dv, 'int_value', total_harvest)
+                current_resource_level = current_resource_level - total_harvest
+                resource_regrowth = calculate_regrowth(current_resource_level, self.regrowth_rate,
+                                                       self.max_resource_level)
+                self.log(group, "Regrowth: adding %s to current resource level %s" %
+                         (resource_regrowth, current_resource_level))
+                self.set_value(regrowth_dv, 'int_value', resource_regrowth)
+                # the per-group code logs the transferred resource level before it is truncated on save
+                current_resource_level = min(current_resource_level + resource_regrowth, self.max_resource_level)
+                self.set_value(resource_level_dv, 'int_value', current_resource_level)
+            else:
+                self.log(group, "current resource level is 0, no one can harvest")
+                self.set_value(group_harvest_dv, 'int_value', 0)
+                for pgr in self.members[group.pk]:
+                    self.deactivated_harvest_decisions.extend(self.harvest_decisions.pop(pgr.pk, []))
+                    self.create_harvest_decision(pgr.pk, 0)
+            if self.experiment.has_next_round:
+                self.log(group, "Transferring resource level %s to next round" % current_resource_level)
+                self.next_round_data_values.extend((resource_level_dv, group_harvest_dv, regrowth_dv))
+
+    def update_shared_resource_levels(self):
+        resource_level_parameter = get_resource_level_parameter()
+        regrowth_parameter = get_regrowth_parameter()
+        for group_cluster in self.group_clusters:
+            groups = self.cluster_groups[group_cluster.pk]
+            max_resource_level = self.max_resource_level * len(groups)
+            shared_resource_level_dv = self.group_cluster_data_values[(group_cluster.pk, resource_level_parameter.pk)]
+            shared_regrowth_dv = self.group_cluster_data_values[(group_cluster.pk, regrowth_parameter.pk)]
+            shared_resource_level = shared_resource_level_dv.int_value
+            shared_group_harvest = 0
+            group_cluster_size = 0
+            group_harvest_dict = OrderedDict()
+            for group in groups:
+                group_cluster_size += len(self.members[group.pk])
+                group_harvest = self.get_total_group_harvest(group)
+                group_harvest_dict[group] = group_harvest
+                shared_group_harvest += group_harvest
+                self.log(group, "total group harvest: %s" % group_harvest)
+            for group, group_harvest in group_harvest_dict.items():
+                if shared_group_harvest > shared_resource_level:
+                    group_harvest = self.adjust_harvest_decisions(shared_resource_level, group, group_harvest,
+                                                                  group_size=group_cluster_size)
+                shared_resource_level = shared_resource_level - group_harvest
+            # the per-group code logs the cluster's regrowth and transfer against the last group in the cluster
+            last_group = next(reversed(group_harvest_dict), None)
+            resource_regrowth = calculate_regrowth(shared_resource_level, self.regrowth_rate, max_resource_level)
+            self.log(last_group, "Regrowth: adding %s to shared resource level %s" %
+                     (resource_regrowth, shared_resource_level))
+            self.set_value(shared_regrowth_dv, 'int_value', resource_regrowth)
+            shared_resource_level = min(shared_resource_level + resource_regrowth, max_resource_level)
+            self.set_value(shared_resource_level_dv, 'int_value', shared_resource_level)
+            if self.experiment.has_next_round:
+                self.log(last_group, "Transferring shared resource level %s to next round" % shared_resource_level)
+                self.next_round_data_values.extend((shared_resource_level_dv, shared_regrowth_dv))
+
+    def update_participants(self):
+        cost_of_living = get_cost_of_living(self.round_configuration)
+        player_status_parameter = get_player_status_parameter()
+        storage_parameter = get_storage_parameter()
+        for pgr in self.participant_group_relationships:
+            player_status_dv = self.participant_data_values[(pgr.pk, player_status_parameter.pk)]
+            storage_dv = self.participant_data_values[(pgr.pk, storage_parameter.pk)]
+            if player_status_dv.boolean_value:
+                harvest_decisions = self.harvest_decisions[pgr.pk]
+                harvest_decision = harvest_decisions[0].int_value if harvest_decisions else 0
                 updated_storage = storage_dv.int_value + harvest_decision - cost_of_living
                 if updated_storage < 0:
                     # player has "died"
-                    player_status_dv.update_boolean(False)
+                    self.set_value(player_status_dv, 'boolean_value', False)
                 # clamp storage to 0 to avoid negative earnings
-                storage_dv.update_int(max(0, updated_storage))
-            pgr.copy_to_next_round(player_status_dv, storage_dv, next_round_data=next_round_data)
+                self.set_value(storage_dv, 'int_value', max(0, updated_storage))
+            self.next_round_data_values.extend((player_status_dv, storage_dv))
+
+    def save(self):
+        e = self.experiment
+        next_round_data, created = e.get_or_create_round_data(round_configuration=e.next_round,
+                                                              increment_repeated_round_sequence_number=True)
+        ParticipantRoundDataValue.objects.filter(
+            pk__in=[hd.pk for hd in self.deactivated_harvest_decisions]
+        ).update(is_active=False, last_modified=timezone.now())
+        ParticipantRoundDataValue.objects.bulk_create(self.new_harvest_decisions)
+        for (model, field_name), values in self.updated_values.items():
+            bulk_update_data_values(model, field_name, values)
+        bulk_copy_to_next_round(e, self.next_round_data_values, next_round_data=next_round_data)
+        bulk_log_group_activity(self.group_activity_logs)
 
 
 @receiver(signals.round_ended, sender=EXPERIMENT_METADATA_NAME)
@@ -565,42 +892,7 @@ def round_ended_handler(sender, experiment=None, **kwargs):
     round_data = experiment.get_round_data(round_configuration)
     logger.debug("ending boundary effects round: %s", round_configuration)
     try:
-        if round_configuration.is_playable_round:
-            regrowth_rate = get_regrowth_rate(round_configuration)
-            harvest_decision_parameter = get_harvest_decision_parameter()
-            for pgr in experiment.participant_group_relationships:
-                # FIXME: not thread-safe but this *should* only be invoked once per experiment. If we start getting
-                # spurious data values, revisit this section
-                prdvs = ParticipantRoundDataValue.objects.filter(
-                    round_data=round_data,
-                    participant_group_relationship=pgr,
-                    parameter=harvest_decision_parameter,
-                    is_active=True)
-                number_of_harvest_decisions = prdvs.count()
-                if number_of_harvest_decisions == 0:
-                    # create zero harvest decisions for any unsubmitted harvest decisions
-                    ParticipantRoundDataValue.objects.create(round_data=round_data,
-                                                             participant_group_relationship=pgr,
-                                                             parameter=harvest_decision_parameter,
-                                                             is_active=True,
-                                                             int_value=0)
-                    logger.debug("autozero harvest decision for participant %s", pgr)
-                elif number_of_harvest_decisions > 1:
-                    # deactivate all prior harvest decisions
-                    logger.debug("multiple harvest decisions found for %s, deactivating all but the latest", pgr)
-                    final_harvest_decision = prdvs.latest('date_created')
-                    prdvs.exclude(pk=final_harvest_decision.pk).update(is_active=False)
-
-            # FIXME: generify and merge update_shared_resource_level and
-            # update_resource_level to operate on "group-like" objects if
-            # possible
-            if is_shared_resource_enabled(round_configuration):
-                for group_cluster in experiment.active_group_clusters:
-                    update_shared_resource_level(experiment, group_cluster, round_data, regrowth_rate)
-            else:
-                for group in experiment.groups:
-                    update_resource_level(experiment, group, round_data, regrowth_rate)
-            update_participants(experiment, round_data, round_configuration)
+        RoundEndedEngine(experiment, round_data).run()
     except:
         logger.exception('Failed to end round cleanly')
 
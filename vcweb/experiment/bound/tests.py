@@ -5,12 +5,16 @@ boundary effects experiment unit tests
 import logging
 import random
 
-from vcweb.core.models import (GroupCluster, Experiment, ParticipantRoundDataValue)
+from vcweb.core.models import (GroupCluster, Experiment, ParticipantRoundDataValue, GroupRoundDataValue,
+                               GroupClusterDataValue)
 from vcweb.core.tests import BaseVcwebTest
 from .models import (get_experiment_metadata, set_harvest_decision, GroupRelationship, get_resource_level_dv,
                      get_regrowth_rate, calculate_regrowth, set_resource_level, get_resource_level,
                      get_harvest_decision_parameter, get_max_resource_level, get_harvest_decision,
-                     get_max_harvest_decision)
+                     get_max_harvest_decision, get_storage_parameter, get_player_status_parameter,
+                     is_shared_resource_enabled, update_resource_level, update_shared_resource_level,
+                     update_participants, RoundEndedEngine, BoundGroupViewModel)
+from .views import get_view_model_dict
 
 logger = logging.getLogger(__name__)
 
@@ -116,6 +120,67 @@ class AdjustHarvestDecisionsTest(BaseTest):
             self.assertTrue(get_harvest_decision(pgr) <= 8)
 
 
+class RoundEndedEngineTest(BaseTest):
+
+    def end_round_per_row(self, e, round_data):
+        round_configuration = e.current_round
+        regrowth_rate = get_regrowth_rate(round_configuration)
+        for pgr in e.participant_group_relationships:
+            if not ParticipantRoundDataValue.objects.filter(round_data=round_data, participant_group_relationship=pgr,
+                                                            parameter=get_harvest_decision_parameter(),
+                                                            is_active=True).exists():
+                ParticipantRoundDataValue.objects.create(round_data=round_data, participant_group_relationship=pgr,
+                                                         parameter=get_harvest_decision_parameter(), int_value=0)
+        if is_shared_resource_enabled(round_configuration):
+            for group_cluster in e.active_group_clusters:
+                update_shared_resource_level(e, group_cluster, round_data, regrowth_rate)
+        else:
+            for group in e.groups:
+                update_resource_level(e, group, round_data, regrowth_rate)
+        update_participants(e, round_data, round_configuration)
+
+    def end_round(self, e, round_data, per_row=False):
+        """ ends the round and returns all resulting data values and group activity logs, rolling back any changes """
+        def run():
+            if per_row:
+                self.end_round_per_row(e, round_data)
+            else:
+                RoundEndedEngine(e, round_data).run()
+
+        results, number_of_queries = self.run_and_rollback(
+            run, lambda: (self.get_data_values(e), self.get_group_activity_logs(e)))
+        return results
+
+    def get_data_values(self, e):
+        participant_data_values = ParticipantRoundDataValue.objects.filter(
+            round_data__experiment=e, is_active=True,
+            parameter__in=(get_harvest_decision_parameter(), get_storage_parameter(), get_player_status_parameter()))
+        group_data_values = GroupRoundDataValue.objects.filter(round_data__experiment=e, is_active=True)
+        group_cluster_data_values = GroupClusterDataValue.objects.filter(round_data__experiment=e, is_active=True)
+        return sorted(
+            list(participant_data_values.values_list('round_data', 'participant_group_relationship', 'parameter',
+                                                     'int_value', 'boolean_value', 'submitted')) +
+            list(group_data_values.values_list('round_data', 'group', 'parameter', 'int_value', 'boolean_value')) +
+            list(group_cluster_data_values.values_list('round_data', 'group_cluster', 'parameter', 'int_value',
+                                                       'boolean_value')),
+            key=str)
+
+    def test_matches_per_row_round_ended(self):
+        e = self.experiment
+        self.advance_to_data_round()
+        round_data = e.current_round_data
+        max_harvest_decision = get_max_harvest_decision(e.experiment_configuration)
+        # leave the first participant without a harvest decision
+        for pgr in list(e.participant_group_relationships)[1:]:
+            set_harvest_decision(pgr, random.randint(0, max_harvest_decision), submitted=True)
+        for resource_level in (None, 0, 7, 13):
+            with self.subTest(resource_level=resource_level):
+                if resource_level is not None:
+                    for g in e.groups:
+                        set_resource_level(g, resource_level, round_data=round_data)
+                self.assertEqual(self.end_round(e, round_data, per_row=True), self.end_round(e, round_data))
+
+
 class ParticipantTest(BaseTest):
 
     def test_harvest_decision(self):
@@ -155,3 +220,28 @@ class MaxResourceLevelTest(BaseTest):
         self.advance_to_data_round()
         e = self.experiment
         self.assertEqual(get_max_resource_level(e.current_round), 120)
+
+
+class GroupViewModelTest(BaseTest):
+
+    def test_group_view_model(self):
+        self.advance_to_data_round()
+        e = self.experiment
+        self.create_harvest_decisions(5)
+        group_view_model = BoundGroupViewModel(e)
+        group_view_model.invalidate(e.groups)
+        for group in e.groups:
+            section = group_view_model.get(group)
+            self.assertEqual(section, group_view_model.compute(group))
+            # cached per group and round state
+            with self.assertNumQueries(0):
+                self.assertEqual(section, group_view_model.get(group))
+            for pgr in group.participant_group_relationship_set.all():
+                view_model = get_view_model_dict(e, pgr)
+                for key in ('playerData', 'myGroup', 'resourceLevel', 'chatMessages', 'numberAlive'):
+                    self.assertEqual(view_model[key], section[key])
+                own_data = [pd for pd in section['playerData'] if pd['id'] == pgr.pk]
+                for pd in own_data:
+                    self.assertEqual(view_model['storage'], pd['storage'])
+                    self.assertEqual(view_model['alive'], pd['alive'])
+                self.assertEqual(view_model['participantGroupId'], pgr.pk)
@@ -1,20 +1,20 @@
 import logging
-from collections import Counter
-from operator import itemgetter
 
 from django.contrib import messages
 from django.db import transaction
 from django.shortcuts import render, get_object_or_404, redirect
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
 
 from vcweb.core.decorators import group_required
 from vcweb.core.forms import SingleIntegerDecisionForm
 from vcweb.core.http import JsonResponse, dumps
-from vcweb.core.models import (Experiment, ParticipantGroupRelationship, ChatMessage, PermissionGroup)
-from vcweb.experiment.forestry.models import (set_harvest_decision, get_harvest_decision_dv, get_regrowth_dv)
+from vcweb.core.models import (Experiment, ParticipantGroupRelationship, PermissionGroup)
+from vcweb.core.view_models import get_participant_etag, refresh_group_view_models
+from vcweb.experiment.forestry.models import (set_harvest_decision, get_harvest_decision_dv)
 from .models import (get_experiment_metadata, get_regrowth_rate, get_max_harvest_decision, get_cost_of_living,
-                     get_resource_level, get_initial_resource_level, get_final_session_storage_queryset,
-                     can_observe_other_group, get_average_harvest, get_average_storage, get_total_harvest,
-                     get_number_alive, get_player_data)
+                     get_initial_resource_level, get_final_session_storage_queryset, get_total_harvest,
+                     get_own_player_data, BoundGroupViewModel)
 
 logger = logging.getLogger(__name__)
 
@@ -54,6 +54,7 @@ def submit_harvest_decision(request, experiment_id=None):
         with transaction.atomic():
             round_data = experiment.current_round_data
             set_harvest_decision(pgr, harvest_decision, round_data, submitted=submitted)
+            refresh_group_view_models(experiment, [pgr.group])
             message = "%s harvested %s trees"
             experiment.log(message % (pgr.participant, harvest_decision))
             response_dict = {
@@ -69,7 +70,13 @@ def submit_harvest_decision(request, experiment_id=None):
     return JsonResponse({'success': False})
 
 
+def view_model_etag(request, experiment_id=None):
+    return get_participant_etag(request, experiment_id)
+
+
 @group_required(PermissionGroup.participant, PermissionGroup.demo_participant)
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=view_model_etag)
 def get_view_model(request, experiment_id=None):
     experiment = get_object_or_404(Experiment.objects.select_related('experiment_metadata', 'experiment_configuration'),
                                    pk=experiment_id)
@@ -129,7 +136,6 @@ def get_view_model_dict(experiment, participant_group_relationship, **kwargs):
     current_round = experiment.current_round
     current_round_data = experiment.current_round_data
     previous_round = experiment.previous_round
-    previous_round_data = experiment.get_round_data(round_configuration=previous_round, previous_round=True)
     experiment_model_dict = experiment.to_dict(
         include_round_data=False, default_value_dict=experiment_model_defaults)
 
@@ -177,30 +183,12 @@ def get_view_model_dict(experiment, participant_group_relationship, **kwargs):
     experiment_model_dict['participantGroupId'] = participant_group_relationship.pk
     # FIXME: these should only need to be added for playable rounds but KO gets unhappy when we switch templates from
     # instructions rounds to practice rounds.
-    own_group = participant_group_relationship.group
-    own_resource_level = get_resource_level(own_group)
+    # group level data is computed once per group and round state and shared by all group members
+    group_view_model = BoundGroupViewModel(experiment).get(participant_group_relationship.group)
+    experiment_model_dict.update(group_view_model)
     if current_round.is_playable_round or current_round.is_debriefing_round:
-        player_data, own_data = get_player_data(own_group, previous_round_data, current_round_data,
-                                                participant_group_relationship)
-        experiment_model_dict.update(own_data)
-        experiment_model_dict['playerData'] = player_data
-        experiment_model_dict['averageHarvest'] = get_average_harvest(own_group, previous_round_data)
-        experiment_model_dict['averageStorage'] = get_average_storage(own_group, current_round_data)
-        regrowth = experiment_model_dict['regrowth'] = get_regrowth_dv(own_group, current_round_data).value
-        c = Counter(list(map(itemgetter('alive'), experiment_model_dict['playerData'])))
-        experiment_model_dict['numberAlive'] = "%s out of %s" % (c[True], sum(c.values()))
-        # FIXME: refactor duplication between myGroup and otherGroup data loading
-        experiment_model_dict['myGroup'] = {
-            'resourceLevel': own_resource_level,
-            'regrowth': regrowth,
-            'originalResourceLevel': own_resource_level - regrowth,
-            'averageHarvest': experiment_model_dict['averageHarvest'],
-            'averageStorage': experiment_model_dict['averageStorage'],
-            'numberAlive': experiment_model_dict['numberAlive'],
-            'isResourceEmpty': own_resource_level == 0,
-        }
-
-    experiment_model_dict['resourceLevel'] = own_resource_level
+        experiment_model_dict.update(get_own_player_data(group_view_model['playerData'],
+                                                         participant_group_relationship))
 
     # participant group data parameters are only needed if this round is a
     # data round or the previous round was a data round
@@ -212,21 +200,4 @@ def get_view_model_dict(experiment, participant_group_relationship, **kwargs):
             experiment_model_dict['harvestDecision'] = harvest_decision.int_value
             logger.debug("already submitted, setting harvest decision to %s",
                          experiment_model_dict['harvestDecision'])
-
-        experiment_model_dict['chatMessages'] = [cm.to_dict() for cm in ChatMessage.objects.for_group(own_group)]
-        if can_observe_other_group(current_round):
-            experiment_model_dict['canObserveOtherGroup'] = True
-            other_group = own_group.get_related_group()
-            number_alive = get_number_alive(other_group, current_round_data)
-            resource_level = get_resource_level(other_group, current_round_data)
-            regrowth = get_regrowth_dv(other_group, current_round_data).value
-            experiment_model_dict['otherGroup'] = {
-                'regrowth': regrowth,
-                'resourceLevel': resource_level,
-                'originalResourceLevel': resource_level - regrowth,
-                'averageHarvest': get_average_harvest(other_group, previous_round_data),
-                'averageStorage': get_average_storage(other_group, current_round_data),
-                'numberAlive': "%s out of %s" % (number_alive, other_group.size),
-                'isResourceEmpty': resource_level == 0,
-            }
     return experiment_model_dict
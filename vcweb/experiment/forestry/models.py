@@ -4,9 +4,13 @@ from collections import defaultdict
 
 from django.db import models, transaction
 from django.dispatch import receiver
+from django.utils import timezone
 
 from vcweb.core import signals, simplecache
-from vcweb.core.models import (ExperimentMetadata, Parameter, ParticipantRoundDataValue, RoundConfiguration, )
+from vcweb.core.models import (ChatMessage, ExperimentMetadata, Parameter, ParticipantRoundDataValue,
+                               RoundConfiguration, GroupRoundDataValue, DataValueUnitOfWork, bulk_copy_to_next_round,
+                               bulk_log_group_activity, bulk_update_data_values, get_or_create_data_values, )
+from vcweb.core.view_models import GroupViewModel, data_values_updated, register_group_view_model
 
 logger = logging.getLogger(__name__)
 
@@ -54,7 +58,7 @@ def get_regrowth(group, round_data=None):
 
 
 def get_regrowth_rate(current_round, default=0.1):
-    return current_round.get_parameter_value(get_regrowth_rate_parameter(), default=default).float_value
+    return current_round.read_parameter_value(parameter=get_regrowth_rate_parameter(), default=default).float_value
 
 
 def has_resource_level(group=None):
@@ -81,20 +85,20 @@ def set_group_harvest(group, value, round_data=None):
 
 
 def can_view_group_results(round_configuration, default=True):
-    return round_configuration.get_parameter_value(name='view_group_results', default=default, inheritable=True)
+    return round_configuration.read_parameter_value(name='view_group_results', default=default, inheritable=True)
 
 
 # FIXME: duplicate version in Boundary Effects bound/models.py, see if we can refactor
 def should_reset_resource_level(round_configuration, experiment):
     if round_configuration.is_repeating_round and experiment.current_repeated_round_sequence_number > 0:
         return False
-    return round_configuration.get_parameter_value(parameter=get_reset_resource_level_parameter(),
-                                                   default=False).boolean_value
+    return round_configuration.read_parameter_value(parameter=get_reset_resource_level_parameter(),
+                                                    default=False).boolean_value
 
 
 def get_initial_resource_level(round_configuration, default=MAX_RESOURCE_LEVEL):
-    return round_configuration.get_parameter_value(parameter=get_initial_resource_level_parameter(),
-                                                   default=default).int_value
+    return round_configuration.read_parameter_value(parameter=get_initial_resource_level_parameter(),
+                                                    default=default).int_value
 
 
 def get_average_harvest(group, round_data):
@@ -177,11 +181,23 @@ def get_total_group_harvest(group, round_data):
     return _zero_if_none(q['total_harvest'])
 
 
+def get_total_group_harvests(groups, round_data):
+    """ returns a dict mapping group pk -> total group harvest for all of the given groups in a single query """
+    total_harvests = dict.fromkeys([group.pk for group in groups], 0)
+    q = ParticipantRoundDataValue.objects.filter(
+        participant_group_relationship__group__in=groups, parameter=get_harvest_decision_parameter(),
+        round_data=round_data, is_active=True
+    ).order_by().values_list('participant_group_relationship__group').annotate(total_harvest=models.Sum('int_value'))
+    for group_id, total_harvest in q:
+        total_harvests[group_id] = _zero_if_none(total_harvest)
+    return total_harvests
+
+
 class GroupData(object):
 
-    def __init__(self, self_pgr, previous_round_data, current_round_data):
+    def __init__(self, group, previous_round_data, current_round_data, self_pgr=None):
         self.pgr = self_pgr
-        self.group = self_pgr.group
+        self.group = group
         self.player_dict = defaultdict(lambda: defaultdict(lambda: None))
         self.exchange_rate = current_round_data.round_configuration.experiment_configuration.exchange_rate
 
@@ -253,6 +269,61 @@ class GroupData(object):
     def get_own_earnings(self, round_list, exchange_rate):
         return get_total_experiment_harvest(self.pgr, round_list) * exchange_rate
 
+    def get_all_earnings(self, round_list, exchange_rate):
+        return [{
+            'id': pgr.pk,
+            'number': pgr.participant_number,
+            'totalEarnings': get_total_experiment_harvest(pgr, round_list) * exchange_rate
+        } for pgr in self.group.participant_group_relationship_set.all()]
+
+
+@register_group_view_model(EXPERIMENT_METADATA_NAME)
+class ForestryGroupViewModel(GroupViewModel):
+
+    """
+    group level data of the forestry participant view model, shared by every member of a group. _earnings holds the
+    total earnings of every group member, participants only see their own total and the totals of the others.
+    """
+
+    def compute(self, group):
+        experiment = self.experiment
+        ec = experiment.experiment_configuration
+        current_round = experiment.current_round
+        current_round_data = experiment.current_round_data
+        previous_round = experiment.previous_round
+        previous_round_data = experiment.get_round_data(round_configuration=previous_round, previous_round=True)
+        section = {'maxHarvestDecision': get_max_harvest_decision(group, current_round_data, ec)}
+        if current_round.is_playable_round or current_round.is_debriefing_round:
+            resource_level = get_resource_level(group)
+            gd = GroupData(group, previous_round_data, current_round_data)
+            regrowth = get_regrowth_dv(group, current_round_data).int_value
+            # debriefing rounds show earnings for the type of round the participants just completed
+            if previous_round.is_practice_round:
+                rounds = experiment.round_data_set.filter(
+                    round_configuration__round_type__in=(RoundConfiguration.RoundType.PRACTICE,
+                                                         RoundConfiguration.RoundType.PRIVATE_PRACTICE))
+            else:
+                rounds = experiment.round_data_set.filter(
+                    round_configuration__round_type=RoundConfiguration.RoundType.REGULAR)
+            section.update(
+                isPlayableRound=True,
+                resourceLevel=resource_level,
+                groupData=gd.get_group_data(),
+                regrowth=regrowth,
+                myGroup={
+                    'resourceLevel': resource_level,
+                    'regrowth': regrowth,
+                    'originalResourceLevel': resource_level - regrowth,
+                    'averageHarvest': get_average_harvest(group, previous_round_data),
+                    'isResourceEmpty': resource_level == 0,
+                },
+                _earnings=gd.get_all_earnings(rounds, ec.exchange_rate),
+            )
+        if current_round.chat_enabled:
+            section['chatEnabled'] = True
+            section['chatMessages'] = [cm.to_dict() for cm in ChatMessage.objects.for_group(group)]
+        return section
+
 
 @transaction.atomic
 def set_harvest_decision(participant_group_relationship=None, value=None, round_data=None, submitted=False):
@@ -262,6 +333,7 @@ def set_harvest_decision(participant_group_relationship=None, value=None, round_
     ParticipantRoundDataValue.objects.for_participant(participant_group_relationship,
                                                       parameter=get_harvest_decision_parameter(),
                                                       round_data=round_data).update(is_active=False)
+    data_values_updated(round_data.experiment_id)
     prdv = ParticipantRoundDataValue.objects.create(participant_group_relationship=participant_group_relationship,
                                                     parameter=get_harvest_decision_parameter(), round_data=round_data,
                                                     int_value=value,
@@ -273,17 +345,14 @@ def set_resource_level(group, value, round_data=None):
     return group.set_data_value(parameter=get_resource_level_parameter(), round_data=round_data, value=value)
 
 
-@simplecache
 def get_storage_parameter():
     return Parameter.objects.for_participant(name='storage')
 
 
-@simplecache
 def get_cost_of_living_parameter():
     return Parameter.objects.for_round(name='cost_of_living')
 
 
-@simplecache
 def get_shared_resource_enabled_parameter():
     return Parameter.objects.for_round(name='shared_resource')
 
@@ -293,39 +362,32 @@ def get_experiment_metadata():
     return ExperimentMetadata.objects.get(namespace=EXPERIMENT_METADATA_NAME)
 
 
-@simplecache
 def get_resource_level_parameter():
     return Parameter.objects.for_group(name='resource_level')
 
 
-@simplecache
 def get_regrowth_rate_parameter():
     return Parameter.objects.for_round(name='regrowth_rate')
 
 
 # parameter for the amount of resources that were regrown at the end of
 # the given round for the given group
-@simplecache
 def get_regrowth_parameter():
     return Parameter.objects.for_group(name='regrowth')
 
 
-@simplecache
 def get_group_harvest_parameter():
     return Parameter.objects.for_group(name='group_harvest')
 
 
-@simplecache
 def get_harvest_decision_parameter():
     return Parameter.objects.for_participant(name='harvest_decision')
 
 
-@simplecache
 def get_reset_resource_level_parameter():
     return Parameter.objects.for_round(name='reset_resource_level')
 
 
-@simplecache
 def get_initial_resource_level_parameter():
     return Parameter.objects.for_round(name='initial_resource_level')
 
@@ -356,12 +418,14 @@ def round_started_handler(sender, experiment=None, **kwargs):
         initial_resource_level = get_max_resource_level(round_configuration)
         logger.debug("Resetting resource level for all groups in %s to %d",
                      round_configuration, initial_resource_level)
-        for group in experiment.groups:
-            # set resource level to initial default values
-            existing_resource_level = get_resource_level_dv(group, round_data)
-            group.log("Resetting resource level (%s) to initial value [%s]" % (
-                existing_resource_level, initial_resource_level))
-            existing_resource_level.update_int(initial_resource_level)
+        # resource levels are written with a single UPDATE
+        with DataValueUnitOfWork():
+            for group in experiment.groups:
+                # set resource level to initial default values
+                existing_resource_level = get_resource_level_dv(group, round_data)
+                group.log("Resetting resource level (%s) to initial value [%s]" % (
+                    existing_resource_level, initial_resource_level))
+                existing_resource_level.update_int(initial_resource_level)
 
 
 @transaction.atomic
@@ -392,6 +456,114 @@ def update_resource_level(experiment, group, round_data, regrowth_rate, max_reso
         group.copy_to_next_round(current_resource_level_dv, group_harvest_dv, regrowth_dv)
 
 
+def calculate_resource_levels(resource_levels, total_harvests, regrowth_rate, max_resource_level,
+                              regrowth_function=None):
+    """
+    Computes harvest and regrowth for every group in a single pass over parallel sequences of current resource levels
+    and total group harvests. Returns a list with a (group harvest, regrowth, new resource level) tuple per group, or
+    None for groups whose resource is already depleted and should be left as is.
+    """
+    if regrowth_function is None:
+        regrowth_function = calculate_regrowth
+    results = []
+    for resource_level, total_harvest in zip(resource_levels, total_harvests):
+        if resource_level > 0:
+            resource_level = resource_level - total_harvest
+            regrowth = regrowth_function(resource_level, regrowth_rate, max_resource_level)
+            # clamp resource
+            results.append((total_harvest, regrowth, min(resource_level + regrowth, max_resource_level)))
+        else:
+            results.append(None)
+    return results
+
+
+@transaction.atomic
+def update_resource_levels(experiment, round_data, regrowth_rate, max_resource_level=None, groups=None):
+    """
+    Set-based version of update_resource_level for all groups in the experiment. Loads resource levels, group harvests
+    and regrowth data values in a fixed number of queries regardless of the number of groups, computes the new values
+    via calculate_resource_levels and persists them and the same group activity logs with bulk writes.
+    """
+    if max_resource_level is None:
+        max_resource_level = get_max_resource_level(round_data.round_configuration)
+    if groups is None:
+        groups = list(experiment.groups)
+    resource_level_parameter = get_resource_level_parameter()
+    group_harvest_parameter = get_group_harvest_parameter()
+    regrowth_parameter = get_regrowth_parameter()
+    data_values = get_or_create_data_values(GroupRoundDataValue, 'group', [group.pk for group in groups], round_data,
+                                            {resource_level_parameter: MAX_RESOURCE_LEVEL,
+                                             group_harvest_parameter: None,
+                                             regrowth_parameter: 0})
+    total_harvests = get_total_group_harvests(groups, round_data)
+    results = calculate_resource_levels(
+        [data_values[(group.pk, resource_level_parameter.pk)].int_value for group in groups],
+        [total_harvests[group.pk] for group in groups],
+        regrowth_rate, max_resource_level)
+    round_configuration = round_data.round_configuration
+    has_next_round = experiment.has_next_round
+    updated_values = {}
+    next_round_data_values = []
+    group_activity_logs = []
+    for group, result in zip(groups, results):
+        group_data_values = [data_values[(group.pk, parameter.pk)]
+                             for parameter in (resource_level_parameter, group_harvest_parameter, regrowth_parameter)]
+        current_resource_level = resource_level = group_data_values[0].int_value
+        if result is not None:
+            group_harvest, regrowth, resource_level = result
+            group_activity_logs.extend([
+                (group, round_configuration, "Harvest: removing %s from current resource level %s" %
+                 (group_harvest, current_resource_level)),
+                (group, round_configuration, "Regrowth: adding %s to current resource level %s" %
+                 (regrowth, current_resource_level - group_harvest)),
+            ])
+            for dv, value in zip(group_data_values, (resource_level, group_harvest, regrowth)):
+                # IntegerField.get_prep_value truncates floats when data values are saved
+                dv.int_value = int(value)
+                updated_values[dv.pk] = dv.int_value
+        if has_next_round:
+            # update_resource_level logs the transferred resource level before it is truncated on save
+            group_activity_logs.append((group, round_configuration,
+                                        "Transferring resource level %s to next round" % resource_level))
+        next_round_data_values.extend(group_data_values)
+    bulk_update_data_values(GroupRoundDataValue, 'int_value', updated_values)
+    # XXX: transfer resource levels across chat and quiz rounds if they exist
+    if has_next_round:
+        bulk_copy_to_next_round(experiment, next_round_data_values)
+    bulk_log_group_activity(group_activity_logs)
+
+
+@transaction.atomic
+def clean_harvest_decisions(experiment, round_data):
+    """
+    Creates zero harvest decisions for participants that didn't submit one and deactivates all but the latest active
+    harvest decision for everyone else, in a fixed number of queries.
+    """
+    harvest_decision_parameter = get_harvest_decision_parameter()
+    participant_group_relationships = list(experiment.participant_group_relationships)
+    latest_harvest_decisions = {}
+    stale_harvest_decision_pks = []
+    for pk, pgr_id in ParticipantRoundDataValue.objects.filter(
+            round_data=round_data, parameter=harvest_decision_parameter, is_active=True,
+            participant_group_relationship__pk__in=[pgr.pk for pgr in participant_group_relationships]
+    ).order_by('-date_created', '-pk').values_list('pk', 'participant_group_relationship'):
+        if pgr_id in latest_harvest_decisions:
+            stale_harvest_decision_pks.append(pk)
+        else:
+            latest_harvest_decisions[pgr_id] = pk
+    # multiple active harvest decisions, only allow the latest one to be active
+    if stale_harvest_decision_pks:
+        ParticipantRoundDataValue.objects.filter(pk__in=stale_harvest_decision_pks).update(
+            is_active=False, last_modified=timezone.now())
+        data_values_updated(experiment.pk)
+    # If no harvest decision was submitted by the participant then create one with default value
+    ParticipantRoundDataValue.objects.bulk_create([
+        ParticipantRoundDataValue(round_data=round_data, participant_group_relationship=pgr,
+                                  parameter=harvest_decision_parameter, is_active=True, int_value=0)
+        for pgr in participant_group_relationships if pgr.pk not in latest_harvest_decisions
+    ])
+
+
 @receiver(signals.round_ended, sender=EXPERIMENT_METADATA_NAME)
 @transaction.atomic
 def round_ended_handler(sender, experiment=None, **kwargs):
@@ -405,30 +577,8 @@ def round_ended_handler(sender, experiment=None, **kwargs):
 
     if round_configuration.is_playable_round:
         regrowth_rate = get_regrowth_rate(round_configuration)
-        harvest_decision_parameter = get_harvest_decision_parameter()
-        # zero out not submitted harvest decisions
-        for pgr in experiment.participant_group_relationships:
-            prdvs = ParticipantRoundDataValue.objects.filter(
-                round_data=round_data, participant_group_relationship=pgr,
-                parameter=harvest_decision_parameter, is_active=True
-            )
-            # If no harvest decision was submitted by the participant then
-            # create one with default value
-            if prdvs.count() == 0:
-                prdv = ParticipantRoundDataValue.objects.create(
-                    round_data=round_data, participant_group_relationship=pgr,
-                    parameter=harvest_decision_parameter, is_active=True, int_value=0
-                )
-                logger.debug("created new harvest decision prdv %s for participant %s", prdv, pgr)
-            elif prdvs.count() > 1:
-                # multiple active harvest decisions, only allow the latest one
-                # to be active
-                latest_prdv = prdvs.latest('date_created')
-                prdvs.exclude(pk=latest_prdv.pk).update(is_active=False)
-
-        for group in experiment.groups:
-            logger.debug("group %s has resource level", group)
-            update_resource_level(experiment, group, round_data, regrowth_rate)
+        clean_harvest_decisions(experiment, round_data)
+        update_resource_levels(experiment, round_data, regrowth_rate)
 
 
 def calculate_regrowth(resource_level, regrowth_rate, max_resource_level):
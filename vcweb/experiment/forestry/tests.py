@@ -3,13 +3,14 @@ import random
 
 from vcweb.core.models import (Experiment, GroupRoundDataValue, ParticipantExperimentRelationship,
                                ParticipantGroupRelationship, Parameter, ParticipantRoundDataValue,
-                               ExperimentConfiguration, )
+                               ExperimentConfiguration, parameter_registry, )
 from vcweb.core.tests import BaseVcwebTest
 from .models import (get_experiment_metadata, EXPERIMENT_METADATA_NAME, round_started_handler, round_ended_handler,
                      get_harvest_decision_parameter, should_reset_resource_level, get_initial_resource_level,
                      get_max_harvest_decision, set_harvest_decision, get_regrowth_parameter,
                      get_group_harvest_parameter, get_resource_level_parameter, set_resource_level, get_resource_level,
-                     calculate_regrowth,
+                     calculate_regrowth, calculate_resource_levels, update_resource_level, update_resource_levels,
+                     get_regrowth_rate,
                      )
 
 logger = logging.getLogger(__name__)
@@ -115,6 +116,52 @@ class ResourceLevelTest(BaseVcwebTest):
             e.advance_to_next_round()
 
 
+class ResourceLevelEngineTest(BaseVcwebTest):
+
+    def update_resource_levels(self, e, round_data, per_group=False, groups=None):
+        """
+        updates resource levels and returns the resulting group data values, group activity logs and number of
+        queries, rolling back all changes
+        """
+        regrowth_rate = get_regrowth_rate(round_data.round_configuration)
+
+        def update():
+            if per_group:
+                for group in e.groups:
+                    update_resource_level(e, group, round_data, regrowth_rate)
+            else:
+                update_resource_levels(e, round_data, regrowth_rate, groups=groups)
+
+        def results():
+            group_data_values = GroupRoundDataValue.objects.filter(round_data__experiment=e, is_active=True)
+            return (sorted(group_data_values.values_list('round_data', 'group', 'parameter', 'int_value')),
+                    self.get_group_activity_logs(e))
+
+        (group_data_values, group_activity_logs), number_of_queries = self.run_and_rollback(update, results)
+        return group_data_values, group_activity_logs, number_of_queries
+
+    def test_calculate_resource_levels(self):
+        results = calculate_resource_levels([100, 50, 0, 7], [20, 10, 5, 10], 0.1, 100)
+        self.assertEqual(results, [(20, 8.0, 88.0), (10, 4.0, 44.0), None, (10, -0.30000000000000004, -3.3)])
+
+    def test_matches_per_group_update(self):
+        e = self.advance_to_data_round()
+        round_data = e.current_round_data
+        for pgr in e.participant_group_relationships:
+            set_harvest_decision(pgr, random.randint(0, 5))
+        groups = list(e.groups)
+        depleted_group = groups[0]
+        set_resource_level(depleted_group, 0, round_data=round_data)
+        data_values, group_activity_logs, number_of_queries = self.update_resource_levels(e, round_data, groups=groups)
+        expected_data_values, expected_group_activity_logs, ignored = self.update_resource_levels(e, round_data,
+                                                                                                  per_group=True)
+        self.assertEqual(data_values, expected_data_values)
+        self.assertEqual(group_activity_logs, expected_group_activity_logs)
+        # number of queries should not depend on the number of groups
+        ignored, ignored, single_group_queries = self.update_resource_levels(e, round_data, groups=groups[-1:])
+        self.assertEqual(number_of_queries, single_group_queries)
+
+
 class DDCTreatmentTest(ResourceLevelTest):
     """
     Tests max harvest decision tables and updated regrowth dynamics for Daniel DeCaro's group experiments Fall 2015
@@ -212,18 +259,23 @@ class ForestryParametersTest(BaseVcwebTest):
                 verify_cached_data(func)
 
     def test_simple_cache_parameter_refresh(self):
-        def verify_refreshed_data(func):
+        def verify_refreshed_data(func, refresh):
             self.assertEqual(func(), func())
             a = func()
-            b = func(refresh=True)
+            b = refresh(func)
             self.assertNotEqual(id(a), id(b))
             self.assertEqual(a, b)
 
-        caching_funcs = (get_harvest_decision_parameter, get_group_harvest_parameter, get_regrowth_parameter,
-                         get_resource_level_parameter, get_experiment_metadata)
+        def refresh_registry(func):
+            parameter_registry.invalidate()
+            return func()
+
+        parameter_funcs = (get_harvest_decision_parameter, get_group_harvest_parameter, get_regrowth_parameter,
+                           get_resource_level_parameter)
         for _ in range(0, 25):
-            for func in caching_funcs:
-                verify_refreshed_data(func)
+            for func in parameter_funcs:
+                verify_refreshed_data(func, refresh_registry)
+            verify_refreshed_data(get_experiment_metadata, lambda func: func(refresh=True))
 
     def test_get_set_resource_level(self):
         e = self.advance_to_data_round()
@@ -2,15 +2,16 @@ import logging
 
 from django.db import transaction
 from django.shortcuts import render, get_object_or_404
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
 
 from vcweb.core.decorators import group_required
 from vcweb.core.forms import SingleIntegerDecisionForm
 from vcweb.core.http import JsonResponse, dumps
-from vcweb.core.models import (Experiment, ChatMessage, ParticipantGroupRelationship, RoundConfiguration,
-                               PermissionGroup)
-from .models import (get_experiment_metadata, get_max_harvest_decision, get_resource_level,
-                     get_initial_resource_level, get_harvest_decision_dv, get_regrowth_dv, set_harvest_decision,
-                     get_average_harvest, GroupData, )
+from vcweb.core.models import (Experiment, ParticipantGroupRelationship, PermissionGroup)
+from vcweb.core.view_models import get_participant_etag, refresh_group_view_models
+from .models import (get_experiment_metadata, get_initial_resource_level, get_harvest_decision_dv,
+                     set_harvest_decision, ForestryGroupViewModel, )
 
 logger = logging.getLogger(__name__)
 
@@ -44,6 +45,7 @@ def submit_decision(request, experiment_id=None):
         with transaction.atomic():
             round_data = experiment.current_round_data
             set_harvest_decision(pgr, harvest_decision, round_data, submitted=submitted)
+            refresh_group_view_models(experiment, [pgr.group])
             message = "%s harvested %s trees"
             experiment.log(message % (pgr.participant, harvest_decision))
             response_dict = {
@@ -59,7 +61,13 @@ def submit_decision(request, experiment_id=None):
     return JsonResponse({'success': False})
 
 
+def view_model_etag(request, experiment_id=None):
+    return get_participant_etag(request, experiment_id)
+
+
 @group_required(PermissionGroup.participant, PermissionGroup.demo_participant)
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=view_model_etag)
 def get_view_model(request, experiment_id=None):
     experiment = get_object_or_404(Experiment.objects.select_related('experiment_metadata', 'experiment_configuration'),
                                    pk=experiment_id)
@@ -108,14 +116,10 @@ def get_view_model_dict(experiment, participant_group_relationship, **kwargs):
     current_round = experiment.current_round
     current_round_data = experiment.current_round_data
     previous_round = experiment.previous_round
-    previous_round_data = experiment.get_round_data(round_configuration=previous_round, previous_round=True)
-    own_group = participant_group_relationship.group
 
 # FIXME: replace this spaghetti with DRF serializers
     experiment_model_dict = experiment.to_dict(include_round_data=False, default_value_dict=experiment_model_defaults)
     experiment_model_dict['sessionId'] = current_round.session_id
-    experiment_model_dict['maxHarvestDecision'] = get_max_harvest_decision(participant_group_relationship.group,
-                                                                           current_round_data, ec)
     experiment_model_dict['templateName'] = current_round.template_name
     experiment_model_dict['isPracticeRound'] = current_round.is_practice_round
     experiment_model_dict['showTour'] = current_round.is_practice_round and not previous_round.is_practice_round
@@ -136,39 +140,22 @@ def get_view_model_dict(experiment, participant_group_relationship, **kwargs):
         experiment_model_dict['surveyUrl'] = current_round.build_survey_url(pid=participant_group_relationship.pk)
         logger.debug("setting survey to %s", experiment_model_dict['surveyUrl'])
 
+    # group level data is computed once per group and round state and shared by all group members
+    group_view_model = ForestryGroupViewModel(experiment).get(participant_group_relationship.group)
+    experiment_model_dict.update(ForestryGroupViewModel.to_public_dict(group_view_model))
     if current_round.is_playable_round or current_round.is_debriefing_round:
-        own_resource_level = get_resource_level(own_group)
-        experiment_model_dict['isPlayableRound'] = True
-        experiment_model_dict['resourceLevel'] = own_resource_level
-
-        # Create GroupData object to access group members data
-        gd = GroupData(participant_group_relationship, previous_round_data, current_round_data)
-
         # add own data directly to the experiment model
-        experiment_model_dict.update(gd.get_own_data())
-        # Data of all the players in the same group of current logged in
-        # participant
-        experiment_model_dict['groupData'] = gd.get_group_data()
-        regrowth = experiment_model_dict['regrowth'] = get_regrowth_dv(own_group, current_round_data).int_value
-
-        experiment_model_dict['myGroup'] = {
-            'resourceLevel': own_resource_level,
-            'regrowth': regrowth,
-            'originalResourceLevel': own_resource_level - regrowth,
-            'averageHarvest': get_average_harvest(own_group, previous_round_data),
-            'isResourceEmpty': own_resource_level == 0,
-        }
-        # If current round is debriefing round get the earnings of the participant depending upon the
-        # type of round user completed
-        if previous_round.is_practice_round:
-            rounds = experiment.round_data_set.filter(
-                round_configuration__round_type__in=(RoundConfiguration.RoundType.PRACTICE,
-                                                     RoundConfiguration.RoundType.PRIVATE_PRACTICE))
-        else:
-            rounds = experiment.round_data_set.filter(
-                round_configuration__round_type=RoundConfiguration.RoundType.REGULAR)
-        experiment_model_dict['totalEarnings'] = gd.get_own_earnings(rounds, ec.exchange_rate)
-        experiment_model_dict['groupEarnings'] = gd.get_group_earnings(rounds, ec.exchange_rate)
+        pgr_id = participant_group_relationship.pk
+        for player_data in group_view_model['groupData']:
+            if player_data['id'] == pgr_id:
+                experiment_model_dict.update(player_data)
+        experiment_model_dict['groupEarnings'] = []
+        for earnings in group_view_model['_earnings']:
+            if earnings['id'] == pgr_id:
+                experiment_model_dict['totalEarnings'] = earnings['totalEarnings']
+            else:
+                experiment_model_dict['groupEarnings'].append({'number': earnings['number'],
+                                                               'totalEarnings': earnings['totalEarnings']})
 
     # Participant group data parameters are only needed if this round is a data round
     # or the previous round was a data round
@@ -183,8 +170,4 @@ def get_view_model_dict(experiment, participant_group_relationship, **kwargs):
             logger.debug("Already submitted, setting harvest decision to %s",
                          harvest_decision.int_value)
 
-    if current_round.chat_enabled:
-        experiment_model_dict['chatEnabled'] = True
-        experiment_model_dict['chatMessages'] = [cm.to_dict() for cm in ChatMessage.objects.for_group(own_group)]
-
     return experiment_model_dict
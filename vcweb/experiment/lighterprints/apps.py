@@ -11,4 +11,7 @@ class LighterprintsConfig(AppConfig):
 
     def ready(self):
         from .signals import round_started_handler, round_ended_handler
+        from .services import PAYMENT_EXPORTER
+        from vcweb.core.export import register_exporter
+        register_exporter(PAYMENT_EXPORTER)
         logger.debug("lighterprints app ready")
@@ -0,0 +1,48 @@
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+
+from vcweb.core.models import Experiment
+from ...models import get_lighterprints_experiment_metadata
+from ...services import GroupScoreSnapshot
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = ('Verifies the incrementally maintained lighterprints group score snapshots against a full recompute and '
+            'rebuilds them. Defaults to all active lighterprints experiments.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('experiment_ids', nargs='*', type=int, help='Lighterprints experiment pks to rebuild')
+        parser.add_argument('--verify-only', dest='verify_only', action='store_true', default=False,
+                            help='Only report mismatches between the snapshots and a full recompute')
+
+    def handle(self, *args, **options):
+        experiments = Experiment.objects.filter(experiment_metadata=get_lighterprints_experiment_metadata())
+        experiment_ids = options['experiment_ids']
+        if experiment_ids:
+            experiments = experiments.filter(pk__in=experiment_ids)
+            if experiments.count() != len(set(experiment_ids)):
+                raise CommandError("No lighterprints experiments with ids %s" % (
+                    set(experiment_ids) - set(experiments.values_list('pk', flat=True))))
+        else:
+            experiments = experiments.active()
+        number_of_mismatches = 0
+        for experiment in experiments:
+            snapshot = GroupScoreSnapshot(experiment.pk)
+            mismatches = snapshot.verify(experiment)
+            if mismatches is None:
+                self.stdout.write("%s: no snapshot" % experiment.pk)
+            else:
+                number_of_mismatches += len(mismatches)
+                for round_data_pk, group_pk, snapshot_points, expected_points in mismatches:
+                    self.stdout.write("%s: round data %s group %s has %s points in snapshot, expected %s" % (
+                        experiment.pk, 'total' if round_data_pk is None else round_data_pk, group_pk,
+                        snapshot_points, expected_points))
+            if not options['verify_only']:
+                max_pk, total_points, daily_points = snapshot.rebuild(experiment)
+                self.stdout.write("%s: rebuilt snapshot for %s groups up to data value %s" % (
+                    experiment.pk, len(total_points), max_pk))
+        if options['verify_only'] and number_of_mismatches:
+            raise CommandError("%s snapshot mismatches found" % number_of_mismatches)
@@ -10,7 +10,7 @@ from django.utils.translation import ugettext_lazy as _
 from mptt.models import (MPTTModel, TreeForeignKey, TreeManager)
 
 from vcweb.core import simplecache
-from vcweb.core.models import (ExperimentMetadata, GroupRoundDataValue, Parameter, User)
+from vcweb.core.models import (ExperimentMetadata, GroupRoundDataValue, Parameter, User, parameter_registry)
 
 logger = logging.getLogger(__name__)
 
@@ -244,17 +244,14 @@ class ActivityAvailability(models.Model):
         ordering = ['activity', 'start_time']
 
 
-@simplecache
 def get_linear_public_good_parameter():
     return Parameter.objects.for_experiment(name='lfp_linear_public_good')
 
 
-@simplecache
 def get_leaderboard_parameter():
     return Parameter.objects.for_experiment(name='leaderboard')
 
 
-@simplecache
 def get_available_activity_parameter():
     return Parameter.objects.for_round(name='available_activity')
 
@@ -264,37 +261,33 @@ def get_lighterprints_experiment_metadata():
     return ExperimentMetadata.objects.get(namespace=EXPERIMENT_METADATA_NAME)
 
 
-@simplecache
 def get_activity_performed_parameter():
     return Parameter.objects.for_participant(name='activity_performed')
 
 
-@simplecache
 def get_footprint_level_parameter():
     return Parameter.objects.for_group(name='footprint_level')
 
 
-@simplecache
 def get_experiment_completed_parameter():
     return Parameter.objects.for_group(name='experiment_completed')
 
 
-@simplecache
 def get_treatment_type_parameter():
-    return Parameter.objects.get(name='lfp_treatment_type')
+    return parameter_registry.get(name='lfp_treatment_type')
 
 
 def is_linear_public_good_experiment(experiment_configuration, default=False):
     """
     linear public good experiment: earnings depend on group average points, e.g., group average points * $.02
     """
-    return experiment_configuration.get_parameter_value(parameter=get_linear_public_good_parameter(),
-                                                        default=default).boolean_value
+    return experiment_configuration.read_parameter_value(parameter=get_linear_public_good_parameter(),
+                                                         default=default).boolean_value
 
 
 def has_leaderboard(experiment_configuration, default=False):
-    return experiment_configuration.get_parameter_value(parameter=get_leaderboard_parameter(),
-                                                        default=default).boolean_value
+    return experiment_configuration.read_parameter_value(parameter=get_leaderboard_parameter(),
+                                                         default=default).boolean_value
 
 
 def get_group_threshold(experiment_configuration, default=125):
@@ -327,6 +320,6 @@ def get_treatment_type(experiment=None, experiment_configuration=None, default_t
     """
     if experiment_configuration is None:
         experiment_configuration = experiment.experiment_configuration
-    treatment_type = experiment_configuration.get_parameter_value(parameter=get_treatment_type_parameter(),
-                                                                  default=default_treatment_type)
+    treatment_type = experiment_configuration.read_parameter_value(parameter=get_treatment_type_parameter(),
+                                                                   default=default_treatment_type)
     return treatment_type
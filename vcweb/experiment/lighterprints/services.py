@@ -8,13 +8,15 @@ from operator import itemgetter
 
 import markdown
 from django.conf import settings
-from django.core import mail
 from django.core.mail import EmailMultiAlternatives
 from django.db import transaction
 from django.template.loader import select_template
 from django.utils.timesince import timesince
 
-from vcweb.core.models import (ParticipantRoundDataValue, ChatMessage, Like, Comment)
+from vcweb.core.export import Exporter
+from vcweb.core.mailer import queue_messages
+from vcweb.core.models import (ParticipantRoundDataValue, ChatMessage, Like, Comment, resolve_foreign_key_values)
+from vcweb.redis_pubsub import RedisPubSub
 from .models import (Activity, is_scheduled_activity_experiment, get_activity_availability_cache, has_leaderboard,
                      get_activity_performed_parameter, ActivityAvailability, is_linear_public_good_experiment,
                      get_activity_points_cache, get_footprint_level, get_group_threshold, get_experiment_completed_dv,
@@ -119,6 +121,7 @@ class EmailGenerator(object):
         self.treatment_type = group_scores.treatment_type
         self.has_leaderboard = group_scores.has_leaderboard
         self.group_scores = group_scores
+        self.plaintext_template = None
 
     def __getattr__(self, attr):
         return getattr(self.group_scores, attr, None)
@@ -149,17 +152,23 @@ class EmailGenerator(object):
         if not self.should_generate_emails(group):
             logger.debug("no need to generate emails for group %s", group)
             return []
-        plaintext_template = select_template([self.email_template])
+        if self.plaintext_template is None:
+            self.plaintext_template = select_template([self.email_template])
         # experimenter_email = experiment.experimenter.email
         round_data = self.round_data
         experimenter_email = self.experimenter_email
         context = self.get_context(group)
+        subject = 'Lighter Footprints Summary for %s' % self.yesterday.strftime('%b. %d %Y')
+        # group members only differ by their individual points, render each distinct summary once
+        rendered_content = {}
         messages = []
-        for pgr in group.participant_group_relationship_set.all():
-            context['individual_points'] = get_individual_points(pgr, round_data)
-            plaintext_content = plaintext_template.render(context)
-            html_content = markdown.markdown(plaintext_content)
-            subject = 'Lighter Footprints Summary for %s' % self.yesterday.strftime('%b. %d %Y')
+        for pgr in group.participant_group_relationship_set.select_related('participant__user'):
+            individual_points = get_individual_points(pgr, round_data)
+            if individual_points not in rendered_content:
+                context['individual_points'] = individual_points
+                plaintext_content = self.plaintext_template.render(context)
+                rendered_content[individual_points] = (plaintext_content, markdown.markdown(plaintext_content))
+            plaintext_content, html_content = rendered_content[individual_points]
             to_address = [experimenter_email, pgr.participant.email]
             msg = EmailMultiAlternatives(subject, plaintext_content, experimenter_email, to_address)
             msg.attach_alternative(html_content, 'text/html')
@@ -233,6 +242,184 @@ class CommunityEmailGenerator(EmailGenerator):
         return context
 
 
+class GroupScoreSnapshot(object):
+
+    """
+    Incrementally maintained activity points per group for a lighterprints experiment, kept in redis so GroupScores
+    doesn't have to rescan every activity performed data value in the experiment on each request.
+
+    The totals hash (lighterprints.scores.<experiment pk>) maps group pk -> total points across the experiment, and
+    each daily hash (lighterprints.scores.<experiment pk>.<round data pk>) maps group pk -> points for that round.
+    The totals hash also carries the max_pk of the last full recompute and a snapshot exists iff it does. The counted
+    set (lighterprints.scores.<experiment pk>.counted) holds the pk of every activity performed data value included
+    in the snapshot, so that committed activities are recorded (via HINCRBY, O(1)) exactly once regardless of the
+    order in which their transactions commit. All keys expire GROUP_SCORE_SNAPSHOT_TTL seconds after the last write.
+    """
+
+    WATERMARK = 'max_pk'
+    # upper bound on the duration of transactions that create activity performed data values
+    CATCH_UP_WINDOW = timedelta(minutes=1)
+
+    # KEYS: totals hash, daily hash, counted set. ARGV: data value pk, group pk, points, watermark field, ttl
+    RECORD_SCRIPT = """
+    if redis.call('HEXISTS', KEYS[1], ARGV[4]) == 0 or redis.call('SADD', KEYS[3], ARGV[1]) == 0 then
+        return 0
+    end
+    redis.call('HINCRBY', KEYS[1], ARGV[2], ARGV[3])
+    redis.call('HINCRBY', KEYS[2], ARGV[2], ARGV[3])
+    for index = 1, 3 do
+        redis.call('EXPIRE', KEYS[index], ARGV[5])
+    end
+    return 1
+    """
+
+    def __init__(self, experiment_pk):
+        self.experiment_pk = experiment_pk
+
+    @staticmethod
+    def redis():
+        return RedisPubSub.get_redis_instance()
+
+    @property
+    def totals_key(self):
+        return 'lighterprints.scores.{0}'.format(self.experiment_pk)
+
+    def get_daily_key(self, round_data_pk):
+        return 'lighterprints.scores.{0}.{1}'.format(self.experiment_pk, round_data_pk)
+
+    @property
+    def counted_key(self):
+        return 'lighterprints.scores.{0}.counted'.format(self.experiment_pk)
+
+    def record(self, data_value_pk, round_data_pk, group_pk, points):
+        """ adds points for a newly committed activity to the group's total and daily points """
+        return self.redis().eval(GroupScoreSnapshot.RECORD_SCRIPT, 3, self.totals_key,
+                                 self.get_daily_key(round_data_pk), self.counted_key, data_value_pk, group_pk, points,
+                                 GroupScoreSnapshot.WATERMARK, settings.GROUP_SCORE_SNAPSHOT_TTL)
+
+    def invalidate(self, round_data_pk=None):
+        """ drops the snapshot so that it is recomputed on next access """
+        keys = [self.totals_key, self.counted_key]
+        if round_data_pk is not None:
+            keys.append(self.get_daily_key(round_data_pk))
+        self.redis().delete(*keys)
+
+    @staticmethod
+    def _to_points(redis_hash):
+        return dict((int(k), int(v)) for k, v in redis_hash.items()
+                    if k.decode() != GroupScoreSnapshot.WATERMARK)
+
+    def load(self, round_data_pk):
+        """
+        Returns a (total points, daily points) tuple of dicts mapping group pk -> points for the given round, or None if
+        no snapshot exists
+        """
+        pipe = self.redis().pipeline()
+        pipe.hgetall(self.totals_key)
+        pipe.hgetall(self.get_daily_key(round_data_pk))
+        totals, daily = pipe.execute()
+        if GroupScoreSnapshot.WATERMARK.encode() not in totals:
+            return None
+        return self._to_points(totals), self._to_points(daily)
+
+    @staticmethod
+    def compute(experiment, activities_performed=None):
+        """
+        Full recompute of all activity points in the experiment. Returns a (max data value pk, total points, daily
+        points) tuple where total points maps group pk -> points and daily points maps round data pk -> group pk ->
+        points.
+        """
+        if activities_performed is None:
+            activities_performed = GroupScoreSnapshot.get_activities_performed(experiment)
+        activity_points_cache = get_activity_points_cache()
+        max_pk = 0
+        total_points = defaultdict(lambda: 0)
+        daily_points = defaultdict(lambda: defaultdict(lambda: 0))
+        for pk, activity_pk, round_data_pk, group_pk in activities_performed:
+            activity_points = activity_points_cache[activity_pk]
+            max_pk = max(max_pk, pk)
+            total_points[group_pk] += activity_points
+            daily_points[round_data_pk][group_pk] += activity_points
+        return max_pk, total_points, daily_points
+
+    @staticmethod
+    def get_activities_performed(experiment):
+        return ParticipantRoundDataValue.objects.for_experiment(
+            experiment=experiment,
+            parameter=get_activity_performed_parameter()
+        ).order_by().values_list('pk', 'int_value', 'round_data', 'participant_group_relationship__group')
+
+    def rebuild(self, experiment):
+        """ recomputes and atomically replaces the snapshot, returns the recomputed scores """
+        started = datetime.now()
+        activities_performed = list(self.get_activities_performed(experiment))
+        max_pk, total_points, daily_points = self.compute(experiment, activities_performed)
+        round_data_pks = set(experiment.round_data_set.values_list('pk', flat=True)) | set(daily_points)
+        ttl = settings.GROUP_SCORE_SNAPSHOT_TTL
+        pipe = self.redis().pipeline()
+        pipe.delete(self.totals_key, self.counted_key, *[self.get_daily_key(pk) for pk in round_data_pks])
+        pipe.hset(self.totals_key, GroupScoreSnapshot.WATERMARK, max_pk)
+        pipe.expire(self.totals_key, ttl)
+        for group_pk, points in total_points.items():
+            pipe.hset(self.totals_key, group_pk, points)
+        for round_data_pk, group_points in daily_points.items():
+            daily_key = self.get_daily_key(round_data_pk)
+            for group_pk, points in group_points.items():
+                pipe.hset(daily_key, group_pk, points)
+            pipe.expire(daily_key, ttl)
+        if activities_performed:
+            pipe.sadd(self.counted_key, *[pk for pk, activity_pk, round_data_pk, group_pk in activities_performed])
+            pipe.expire(self.counted_key, ttl)
+        pipe.execute()
+        # activities committed while recomputing may have been recorded in the replaced snapshot, count them again
+        activity_points_cache = get_activity_points_cache()
+        for pk, activity_pk, round_data_pk, group_pk in self.get_activities_performed(experiment).filter(
+                date_created__gte=started - GroupScoreSnapshot.CATCH_UP_WINDOW):
+            points = activity_points_cache[activity_pk]
+            if self.record(pk, round_data_pk, group_pk, points):
+                max_pk = max(max_pk, pk)
+                total_points[group_pk] += points
+                daily_points[round_data_pk][group_pk] += points
+        logger.debug("rebuilt group score snapshot for experiment %s up to data value %s", experiment, max_pk)
+        return max_pk, total_points, daily_points
+
+    def get_scores(self, experiment, round_data):
+        """
+        Returns a (total points, daily points) tuple of dicts mapping group pk -> points for the given round, rebuilding
+        the snapshot if it doesn't exist yet
+        """
+        scores = self.load(round_data.pk)
+        if scores is None:
+            max_pk, total_points, daily_points = self.rebuild(experiment)
+            scores = (total_points, daily_points[round_data.pk])
+        return scores
+
+    def verify(self, experiment):
+        """
+        Compares the snapshot against a full recompute. Returns None if no snapshot exists, otherwise a list of (round
+        data pk or None for experiment totals, group pk, snapshot points, recomputed points) tuples for every mismatch.
+        """
+        max_pk, total_points, daily_points = self.compute(experiment)
+        round_data_pks = sorted(set(experiment.round_data_set.values_list('pk', flat=True)) | set(daily_points))
+        pipe = self.redis().pipeline()
+        pipe.hgetall(self.totals_key)
+        for round_data_pk in round_data_pks:
+            pipe.hgetall(self.get_daily_key(round_data_pk))
+        totals, *dailies = pipe.execute()
+        if GroupScoreSnapshot.WATERMARK.encode() not in totals:
+            return None
+        mismatches = self._compare(None, self._to_points(totals), total_points)
+        for round_data_pk, daily in zip(round_data_pks, dailies):
+            mismatches.extend(self._compare(round_data_pk, self._to_points(daily), daily_points[round_data_pk]))
+        return mismatches
+
+    @staticmethod
+    def _compare(round_data_pk, snapshot_points, expected_points):
+        return [(round_data_pk, group_pk, snapshot_points.get(group_pk, 0), expected_points.get(group_pk, 0))
+                for group_pk in sorted(set(snapshot_points) | set(expected_points))
+                if snapshot_points.get(group_pk, 0) != expected_points.get(group_pk, 0)]
+
+
 class GroupScores(object):
 
     """ Data model encapsulating group scores across all treatments. Used by view models that are
@@ -338,30 +525,16 @@ class GroupScores(object):
 
     def initialize_scores(self):
         self.scores_dict = defaultdict(lambda: defaultdict(lambda: 0))
-        self.participant_dict = defaultdict(lambda: defaultdict(lambda: 0))
-        activity_points_cache = get_activity_points_cache()
+        # read incrementally maintained scores instead of rescanning every activity performed data value
+        total_points, daily_points = GroupScoreSnapshot(self.experiment.pk).get_scores(self.experiment,
+                                                                                      self.round_data)
         if self.is_linear_public_good_experiment:
             # tally all green points earned across the entire experiment
-            all_activities_performed_qs = ParticipantRoundDataValue.objects.for_experiment(
-                experiment=self.experiment,
-                parameter=get_activity_performed_parameter())
-            for dv in all_activities_performed_qs:
-                activity_points = activity_points_cache[dv.int_value]
-                pgr = dv.participant_group_relationship
-                self.scores_dict[pgr.group.pk]['total_points'] += activity_points
-                self.participant_dict[pgr]['total_points'] += activity_points
-                if dv.round_data == self.round_data:
-                    self.scores_dict[pgr.group.pk]['total_daily_points'] += activity_points
-                    self.participant_dict[pgr]['total_daily_points'] += activity_points
-        else:
-            # only tally daily points for the group and for each individual participant
-            activities_performed_qs = ParticipantRoundDataValue.objects.for_round(
-                parameter=get_activity_performed_parameter(), round_data=self.round_data)
-            for dv in activities_performed_qs:
-                activity_points = activity_points_cache[dv.int_value]
-                pgr = dv.participant_group_relationship
-                self.scores_dict[pgr.group.pk]['total_daily_points'] += activity_points
-                self.participant_dict[pgr]['total_daily_points'] += activity_points
+            for group_pk, points in total_points.items():
+                self.scores_dict[group_pk]['total_points'] = points
+        # daily points are tallied in every treatment
+        for group_pk, points in daily_points.items():
+            self.scores_dict[group_pk]['total_daily_points'] = points
 
         # FIXME: assumes all groups are equally sized
         self.group_size = self.experiment_configuration.max_group_size
@@ -516,6 +689,20 @@ class GroupScores(object):
         return str(self.scores_dict)
 
 
+def payment_data_rows(experiment):
+    """ Generates CSV rows with the total earnings for every participant in the given experiment """
+    group_scores = GroupScores(experiment)
+    yield ['Group', 'Participant', 'Username', 'Total Earnings']
+    for pgr in experiment.participant_group_relationships.select_related('participant__user', 'group'):
+        participant = pgr.participant
+        group = pgr.group
+        yield [group, participant.email, participant.username, group_scores.total_earnings(group)]
+
+
+PAYMENT_EXPORTER = Exporter('lighterprints-payment', payment_data_rows,
+                            file_name=lambda experiment: 'payment-%s' % experiment.data_file_name())
+
+
 class GroupActivity(object):
 
     """ Models group activity anchored from the POV of a given ParticipantGroupRelationship """
@@ -536,7 +723,8 @@ class GroupActivity(object):
         comment_target_ids = Comment.objects.target_ids(participant_group_relationship)
         if self.limit is not None:
             data_values = data_values[:self.limit]
-        for prdv in data_values:
+        # resolve all performed activities with a single cache / in_bulk round trip
+        for prdv in resolve_foreign_key_values(data_values):
             parameter_name = prdv.parameter.name
             if parameter_name == 'chat_message':
                 data = prdv.chatmessage.to_dict()
@@ -626,8 +814,8 @@ def daily_update(experiment, debug=False, round_data=None, **kwargs):
         group_scores = GroupScores(experiment, round_data=round_data, groups=list(experiment.groups))
         all_messages = list(group_scores.generate_daily_update_messages())
     if not debug and all_messages:
-        logger.debug("sending %s generated emails for lighter footprints", len(all_messages))
-        mail.get_connection().send_messages(all_messages)
+        logger.debug("queueing %s generated emails for lighter footprints", len(all_messages))
+        queue_messages(all_messages)
 
 
 def abbreviated_timesince(dt):
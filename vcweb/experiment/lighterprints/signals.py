@@ -1,12 +1,14 @@
 import logging
 
 from django.db import transaction
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 
 from vcweb.core import signals
-from .models import (EXPERIMENT_METADATA_NAME, get_experiment_completed_parameter,
-                     get_footprint_level_parameter, is_level_based_experiment)
-from .services import daily_update
+from vcweb.core.models import ParticipantRoundDataValue, RoundData
+from .models import (EXPERIMENT_METADATA_NAME, get_experiment_completed_parameter, get_activity_performed_parameter,
+                     get_activity_points_cache, get_footprint_level_parameter, is_level_based_experiment)
+from .services import daily_update, GroupScoreSnapshot
 
 logger = logging.getLogger(__name__)
 
@@ -37,3 +39,36 @@ def round_started_handler(sender, experiment=None, **kwargs):
         round_data=round_data,
         defaults=initial_parameter_defaults,
     )
+
+
+@receiver(post_save, sender=ParticipantRoundDataValue, dispatch_uid='lighterprints-record-activity-performed')
+def record_activity_performed(sender, instance=None, created=False, raw=False, **kwargs):
+    """
+    Keeps the GroupScoreSnapshot current. Newly performed activities (e.g., via do_activity) are added in O(1) once
+    their transaction commits, so rolled back activities never earn points. Any other modification of an activity
+    performed data value drops the snapshot, now and again on commit, so it gets recomputed.
+    """
+    if raw or instance.parameter_id != get_activity_performed_parameter().pk:
+        return
+    if not created:
+        GroupScoreSnapshot(instance.round_data.experiment_id).invalidate()
+    transaction.on_commit(lambda: update_group_score_snapshot(instance, created))
+
+
+def update_group_score_snapshot(activity_performed, created):
+    round_data = activity_performed.round_data
+    snapshot = GroupScoreSnapshot(round_data.experiment_id)
+    if created:
+        points = get_activity_points_cache().get(activity_performed.int_value)
+        if activity_performed.is_active and points is not None:
+            snapshot.record(activity_performed.pk, round_data.pk,
+                            activity_performed.participant_group_relationship.group_id, points)
+        elif activity_performed.is_active:
+            snapshot.invalidate()
+    else:
+        snapshot.invalidate()
+
+
+@receiver(post_delete, sender=RoundData, dispatch_uid='lighterprints-invalidate-group-scores')
+def invalidate_group_scores(sender, instance=None, **kwargs):
+    GroupScoreSnapshot(instance.experiment_id).invalidate(round_data_pk=instance.pk)
@@ -4,6 +4,8 @@ from datetime import date, timedelta
 
 from django.conf import settings
 from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
 
 from vcweb.core.models import ParticipantRoundDataValue, ChatMessage, Like, Comment
 from vcweb.core.tests import BaseVcwebTest
@@ -11,7 +13,8 @@ from .models import (Activity, get_lighterprints_experiment_metadata, get_activi
                      get_footprint_level, get_treatment_type_parameter, get_leaderboard_parameter,
                      get_linear_public_good_parameter, is_scheduled_activity_experiment, is_level_based_experiment,
                      is_high_school_treatment, is_community_treatment, get_available_activity_parameter)
-from .services import (GroupScores, get_individual_points, GroupActivity, CommunityEmailGenerator)
+from .services import (GroupScores, get_individual_points, GroupActivity, CommunityEmailGenerator,
+                       GroupScoreSnapshot)
 from .views import (LighterprintsViewModel, LevelBasedViewModel, CommunityViewModel, HighSchoolViewModel)
 
 logger = logging.getLogger(__name__)
@@ -27,6 +30,7 @@ class BaseTest(BaseVcwebTest):
                                     **kwargs)
         cache.clear()
         e = self.experiment
+        GroupScoreSnapshot(e.pk).invalidate()
         e.start_date = date.today()
         e.save()
         ec = self.experiment_configuration
@@ -81,6 +85,8 @@ class BaseTest(BaseVcwebTest):
                         round_data=round_data,
                         int_value=activity.pk
                     )
+                # each request commits in production
+                self.run_on_commit_callbacks()
 
         return performed_activities
 
@@ -461,6 +467,46 @@ class LevelBasedGroupScoreTest(LevelBasedTest):
             self.assertEqual(group_scores.total_daily_points(group), 0)
 
 
+class GroupScoreSnapshotTest(LevelBasedTest):
+
+    def test_snapshot(self):
+        e = self.experiment
+        e.activate()
+        round_data = e.current_round_data
+        snapshot = GroupScoreSnapshot(e.pk)
+        self.assertIsNone(snapshot.load(round_data.pk))
+        performed_activities = self.perform_activities()
+        self.assertEqual([], snapshot.verify(e))
+        # activities performed outside of do_activity are recorded as well
+        activity = list(performed_activities)[0]
+        pgr = e.participant_group_relationships.first()
+        activity_performed = ParticipantRoundDataValue.objects.create(
+            parameter=get_activity_performed_parameter(), participant_group_relationship=pgr, round_data=round_data,
+            int_value=activity.pk)
+        # recorded once the transaction commits
+        self.assertEqual(2, len(snapshot.verify(e)))
+        self.run_on_commit_callbacks()
+        self.assertEqual([], snapshot.verify(e))
+        total_points, daily_points = snapshot.load(round_data.pk)
+        expected_points = snapshot.compute(e)[2][round_data.pk][pgr.group.pk]
+        self.assertEqual(expected_points, daily_points[pgr.group.pk])
+        self.assertEqual(expected_points, GroupScores(e).total_daily_points(pgr.group))
+        # modifications drop the snapshot
+        activity_performed.update_int(list(performed_activities)[-1].pk)
+        self.assertIsNone(snapshot.load(round_data.pk))
+        GroupScores(e)
+        self.assertEqual([], snapshot.verify(e))
+        # already included data values are never recorded twice
+        self.assertEqual(0, snapshot.record(activity_performed.pk, round_data.pk, pgr.group.pk, activity.points))
+        # drift is detected and repaired by the rebuild command
+        snapshot.record(activity_performed.pk + 1000, round_data.pk, pgr.group.pk, 1000)
+        self.assertEqual(2, len(snapshot.verify(e)))
+        with self.assertRaises(CommandError):
+            call_command('rebuild_group_scores', e.pk, verify_only=True)
+        call_command('rebuild_group_scores', e.pk)
+        self.assertEqual([], snapshot.verify(e))
+
+
 class TestRoundEndedSignal(BaseTest):
 
     def test_system_daily_tick(self):
@@ -1,22 +1,24 @@
 import logging
 from datetime import datetime
 
-import unicodecsv
 from django.contrib.auth.decorators import login_required
 from django.core.exceptions import PermissionDenied
-from django.http import HttpResponse
 from django.shortcuts import get_object_or_404, render
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
 
 from vcweb.core.decorators import group_required, ownership_required
 from vcweb.core.forms import (ChatForm, CommentForm, LikeForm)
 from vcweb.core.http import JsonResponse
 from vcweb.core.models import (ChatMessage, Comment, Experiment, ParticipantGroupRelationship,
                                ParticipantRoundDataValue, Like, PermissionGroup)
-from vcweb.core.views import (dumps, get_active_experiment, mimetypes)
+from vcweb.core.view_models import StateVersion
+from vcweb.core.views import (dumps, export_response, get_active_experiment)
 from .forms import ActivityForm
 from .models import (Activity, get_lighterprints_experiment_metadata, is_high_school_treatment, get_treatment_type,
                      get_activity_performed_parameter, is_community_treatment, is_level_based_experiment)
-from .services import (ActivityStatusList, GroupScores, do_activity, get_time_remaining, GroupActivity)
+from .services import (ActivityStatusList, GroupScores, do_activity, get_time_remaining, GroupActivity,
+                       PAYMENT_EXPORTER)
 
 logger = logging.getLogger(__name__)
 
@@ -283,20 +285,25 @@ def post_comment(request):
 @ownership_required(Experiment)
 def download_payment_data(request, pk=None):
     experiment = get_object_or_404(Experiment, pk=pk)
-    response = HttpResponse(content_type=mimetypes.types_map['.csv'])
-    response[
-        'Content-Disposition'] = 'attachment; filename=payment-%s' % experiment.data_file_name()
-    writer = unicodecsv.writer(response, encoding='utf-8')
-    group_scores = GroupScores(experiment)
-    writer.writerow(['Group', 'Participant', 'Username', 'Total Earnings'])
-    for pgr in experiment.participant_group_relationships:
-        participant = pgr.participant
-        group = pgr.group
-        writer.writerow([group, participant.email, participant.username, group_scores.total_earnings(group)])
-    return response
+    return export_response(PAYMENT_EXPORTER, experiment)
+
+
+def view_model_etag(request, participant_group_id=None):
+    if participant_group_id is None:
+        participant_group_id = request.GET.get('participant_group_id')
+    pgr = ParticipantGroupRelationship.objects.filter(pk=participant_group_id, participant__user=request.user).values(
+        'group', 'group__experiment').first()
+    if pgr is None:
+        # let the view handle invalid requests
+        return None
+    # group data includes the scores of every group and the time left today is shown in minutes
+    return StateVersion(pgr['group__experiment']).get_etag([pgr['group']], all_groups=True,
+                                                           extra=[participant_group_id], time_resolution=60)
 
 
 @group_required(PermissionGroup.participant, PermissionGroup.demo_participant)
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=view_model_etag)
 def get_view_model(request, participant_group_id=None):
     if participant_group_id is None:
         # check in the request query parameters as well
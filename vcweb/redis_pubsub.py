@@ -1,12 +1,49 @@
+import logging
+import os
+import socket
+import threading
+import time
+
 import redis
 
 from django.conf import settings
 
+logger = logging.getLogger(__name__)
+
+# appends a message to its channel's capped replay stream and publishes it prefixed with its stream id in a single
+# round trip. Also records the channel's last published stream id and the newest stream id that is no longer in the
+# replay stream, either trimmed or lost when the stream expired, so that reconnecting clients can tell whether they
+# missed events that cannot be replayed.
+# KEYS[1]: replay stream, KEYS[2]: replay sequence hash, ARGV: message, maximum stream length, stream ttl in seconds,
+# channel, sequence hash ttl in seconds
+PUBLISH_SCRIPT = """
+local lost = false
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    lost = redis.call('HGET', KEYS[2], 'published')
+end
+local sequence = redis.call('XADD', KEYS[1], '*', 'data', ARGV[1])
+local excess = redis.call('XLEN', KEYS[1]) - tonumber(ARGV[2])
+if excess > 0 then
+    local trimmed = redis.call('XRANGE', KEYS[1], '-', '+', 'COUNT', excess)
+    lost = trimmed[#trimmed][1]
+    redis.call('XTRIM', KEYS[1], 'MAXLEN', ARGV[2])
+end
+if lost then
+    redis.call('HSET', KEYS[2], 'trimmed', lost)
+end
+redis.call('HSET', KEYS[2], 'published', sequence)
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+redis.call('EXPIRE', KEYS[2], ARGV[5])
+redis.call('PUBLISH', ARGV[4], sequence .. ' ' .. ARGV[1])
+return sequence
+"""
+
 
 class RedisPubSub(object):
     """ Singleton class for Redis Client """
 
     __instance = None
+    __publish_script = None
 
     @classmethod
     def get_redis_instance(cls):
@@ -25,3 +62,134 @@ class RedisPubSub(object):
     @staticmethod
     def get_experimenter_channel(experiment_pk):
         return 'experimenter_channel.{}'.format(experiment_pk)
+
+    @staticmethod
+    def get_channel_patterns():
+        """ redis PSUBSCRIBE patterns matching every participant and experimenter channel """
+        return ('experiment_channel.*', 'group_channel.*', 'experimenter_channel.*')
+
+    @classmethod
+    def publish(cls, channel, message):
+        """
+        Publishes a message to the given channel and keeps it in the channel's replay buffer so that reconnecting
+        sockjs clients can catch up on the events they missed. Returns the message's sequence id.
+        """
+        if cls.__publish_script is None:
+            cls.__publish_script = cls.get_redis_instance().register_script(PUBLISH_SCRIPT)
+        sequence = cls.__publish_script(keys=[cls.get_replay_key(channel), cls.get_replay_sequence_key(channel)],
+                                        args=[message, settings.REDIS_REPLAY_BUFFER_LENGTH,
+                                              settings.REDIS_REPLAY_BUFFER_TTL, channel,
+                                              settings.REDIS_REPLAY_SEQUENCE_TTL])
+        return sequence.decode('utf-8') if isinstance(sequence, bytes) else sequence
+
+    @staticmethod
+    def get_replay_key(channel):
+        return 'replay.{}'.format(channel)
+
+    @staticmethod
+    def get_replay_sequence_key(channel):
+        """ redis hash of a channel's last published and last trimmed replay stream ids """
+        return 'replay.{}.sequence'.format(channel)
+
+    @staticmethod
+    def is_replay_incomplete(last_sequence, published_sequence, trimmed_sequence, replay_buffer_exists):
+        """
+        returns True if events published after last_sequence, the last event a client saw on a channel, are no longer
+        in the channel's replay buffer. published_sequence and trimmed_sequence are the values kept in the channel's
+        replay sequence hash, None if missing.
+        """
+        if published_sequence is None:
+            # nothing was published within REDIS_REPLAY_SEQUENCE_TTL, so there is no telling what the client missed
+            return True
+        last_sequence = RedisPubSub.parse_sequence(last_sequence)
+        if RedisPubSub.parse_sequence(published_sequence) <= last_sequence:
+            return False
+        # an expired replay buffer lost every event up to the last published one
+        lost_sequence = trimmed_sequence if replay_buffer_exists else published_sequence
+        return lost_sequence is not None and RedisPubSub.parse_sequence(lost_sequence) > last_sequence
+
+    @staticmethod
+    def parse_message(data):
+        """ returns a (sequence id, message) tuple for a published message, sequence id is None if it has none """
+        if isinstance(data, bytes):
+            data = data.decode('utf-8')
+        sequence, separator, message = data.partition(' ')
+        if separator and sequence[:1].isdigit():
+            return sequence, message
+        return None, data
+
+    @staticmethod
+    def parse_sequence(sequence):
+        """ converts a redis stream id like 1526919030474-55 into a comparable (milliseconds, sequence) tuple """
+        milliseconds, separator, number = sequence.partition('-')
+        return int(milliseconds), int(number or 0)
+
+    @staticmethod
+    def get_next_sequence(sequence):
+        milliseconds, number = RedisPubSub.parse_sequence(sequence)
+        return '{0}-{1}'.format(milliseconds, number + 1)
+
+
+class LiveEventBuffer(object):
+    """
+    Holds back the live events of a reconnecting sockjs connection while its missed events are replayed from the
+    replay buffers, so that clients receive every missed event before any newer live event. Live events that were
+    also part of the replay are dropped when the held events are released.
+    """
+
+    def __init__(self):
+        self.held_events = []
+        self.replayed_sequences = {}
+
+    def hold(self, channel, sequence, message):
+        self.held_events.append((channel, sequence, message))
+
+    def replayed(self, channel, sequence):
+        """ records the sequence id of an event replayed on the given channel """
+        self.replayed_sequences[channel] = RedisPubSub.parse_sequence(sequence)
+
+    def release(self):
+        """ returns the held (channel, sequence, message) tuples that were not replayed, in the order received """
+        events = []
+        for channel, sequence, message in self.held_events:
+            last_replayed = self.replayed_sequences.get(channel)
+            if sequence is not None and last_replayed is not None:
+                if RedisPubSub.parse_sequence(sequence) <= last_replayed:
+                    # already sent by the replay
+                    continue
+            events.append((channel, sequence, message))
+        self.held_events = []
+        return events
+
+
+def get_worker_id():
+    """ identifies a worker process by its host name and pid """
+    return '{0}.{1}'.format(socket.gethostname(), os.getpid())
+
+
+class WorkerHeartbeat(threading.Thread):
+    """
+    Holds a worker's lease, a Redis key that expires after ttl seconds, for as long as the worker process is alive,
+    including while it is busy with a long running task. Work claimed by a worker whose lease has expired is
+    considered orphaned.
+    """
+
+    def __init__(self, key, ttl, name='worker-heartbeat'):
+        super(WorkerHeartbeat, self).__init__(name=name, daemon=True)
+        self.key = key
+        self.ttl = ttl
+        self.stopped = threading.Event()
+
+    def beat(self):
+        RedisPubSub.get_redis_instance().set(self.key, time.time(), ex=self.ttl)
+
+    def run(self):
+        while not self.stopped.wait(self.ttl / 3):
+            try:
+                self.beat()
+            except Exception:
+                logger.exception("unable to renew worker lease %s", self.key)
+
+    def stop(self):
+        self.stopped.set()
+        RedisPubSub.get_redis_instance().delete(self.key)
@@ -66,11 +66,30 @@ SUBJECT_POOL_WAITLIST_SIZE = 10
 # how long to wait (in days) before allowing a potential participant to receive an invitation email for an experiment
 # for which they have already been invited
 SUBJECT_POOL_INVITATION_DELAY = 5
+# seconds to keep an idle experiment session's redis seat reservations before they are rebuilt from its signups, see
+# vcweb.core.models.SessionSeatReservations
+SUBJECT_POOL_SEAT_RESERVATION_TTL = 60 * 60 * 24
+# seconds that a seat reserved in redis counts as in flight, i.e., has a ParticipantSignup that may not be written
+# yet, and is carried over when the reservations are rebuilt
+SUBJECT_POOL_SEAT_PENDING_TTL = 60
 
 DEMO_EXPERIMENTER_EMAIL = 'vcweb@mailinator.com'
 DEFAULT_EMAIL = DEFAULT_FROM_EMAIL = 'vcweb@asu.edu'
 EMAIL_HOST = 'smtp.asu.edu'
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+# outbound email is queued in redis and sent by the mail_worker management command, see vcweb.core.mailer
+MAIL_QUEUE_ENABLED = True
+MAIL_QUEUE_NAME = 'mail'
+# number of queued messages sent per batch over a single connection
+MAIL_BATCH_SIZE = 50
+# maximum messages sent per second, 0 to disable rate limiting
+MAIL_RATE_LIMIT = 5
+# failed messages are retried after MAIL_RETRY_DELAY * 2 ** (attempts - 1) seconds
+MAIL_MAX_ATTEMPTS = 5
+MAIL_RETRY_DELAY = 60
+# seconds a mail worker's lease lasts without renewal before the messages it claimed are requeued, see
+# vcweb.core.mailer.MailQueue.requeue_orphaned
+MAIL_WORKER_HEARTBEAT_TTL = 60
 ALLOWED_HOSTS = ('.asu.edu', 'localhost',)
 ADMINS = (
     ('Allen Lee', 'allen.lee@asu.edu'),
@@ -200,6 +219,21 @@ CACHES = {
         }
     }
 }
+# seconds to cache RoundData lookups in Experiment.get_round_data
+ROUND_DATA_CACHE_TIMEOUT = 60 * 60
+# seconds to cache model instances referenced by foreign key parameter values, see
+# vcweb.core.models.ForeignKeyValueResolver
+FOREIGN_KEY_VALUE_CACHE_TIMEOUT = 60 * 60
+# seconds to cache the parameter value snapshots of experiment configurations, see
+# vcweb.core.models.ConfigurationSnapshot
+CONFIGURATION_SNAPSHOT_CACHE_TIMEOUT = 60 * 60 * 24
+# seconds to keep idle lighterprints group score snapshots in redis, see
+# vcweb.experiment.lighterprints.services.GroupScoreSnapshot
+GROUP_SCORE_SNAPSHOT_TTL = 60 * 60 * 24 * 30
+# participant passwords are hashed in a pool of threads (defaults to one per CPU) when registering at least
+# PASSWORD_HASHING_POOL_THRESHOLD participants at once, see vcweb.core.models.make_passwords
+PASSWORD_HASHING_THREADS = None
+PASSWORD_HASHING_POOL_THRESHOLD = 20
 
 
 DJANGO_APPS = (
@@ -244,6 +278,35 @@ LOGOUT_REDIRECT_URL = '/'
 WEBSOCKET_SSL = False
 WEBSOCKET_PORT = 8882
 WEBSOCKET_URI = '/websocket'
+# number of sockjs-redis.py worker processes sharing WEBSOCKET_PORT, 0 to fork one per cpu. Multiple workers use
+# pattern subscriptions so that each holds a fixed number of redis subscriptions regardless of connected clients
+WEBSOCKET_WORKERS = 1
+# seconds between sockjs worker metrics updates in redis
+WEBSOCKET_METRICS_INTERVAL = 5
+# port of the sockjs worker metrics endpoint, only bound on localhost and never on WEBSOCKET_PORT, 0 to disable
+WEBSOCKET_METRICS_PORT = 8883
+# number of recent events kept per redis pub/sub channel for reconnecting sockjs clients and seconds to keep a
+# channel's replay buffer after its last event
+REDIS_REPLAY_BUFFER_LENGTH = 200
+REDIS_REPLAY_BUFFER_TTL = 60 * 60 * 6
+# seconds to keep a channel's last published and trimmed sequence ids after its last event, outliving the replay
+# buffer so that reconnecting clients are only sent an update when they actually missed events, see
+# vcweb.redis_pubsub.RedisPubSub.is_replay_incomplete
+REDIS_REPLAY_SEQUENCE_TTL = 60 * 60 * 24 * 7
+# seconds to keep the redis set of ready participants for a round
+READY_PARTICIPANTS_TTL = 60 * 60 * 24
+# participant ready broadcasts are coalesced into at most one ready status event per experiment every
+# READY_STATUS_INTERVAL seconds, 0 to send one for every ready participant
+READY_STATUS_INTERVAL = 1.0
+# seconds to cache the shared group sections of participant view models, see vcweb.core.view_models
+GROUP_VIEW_MODEL_CACHE_TIMEOUT = 60 * 60
+# seconds to keep idle experiment and group state versions used as view model ETags, see vcweb.core.view_models
+STATE_VERSION_TTL = 60 * 60 * 24 * 7
+# subscribe to redis pub/sub invalidations of the process-wide parameter registry, see
+# vcweb.core.models.ParameterRegistry
+PARAMETER_REGISTRY_LISTEN = True
+# minimum seconds between registry reloads caused by lookups of unknown parameters
+PARAMETER_REGISTRY_MISS_INTERVAL = 10
 
 # activation window
 ACCOUNT_ACTIVATION_DAYS = 30
@@ -286,7 +349,20 @@ def is_accessible(directory_path):
 
 LOG_DIRECTORY = config.get('logging', 'LOG_DIRECTORY', fallback=os.path.join(BASE_DIR, 'logs'))
 
-for directory in (STATIC_ROOT, MEDIA_ROOT, LOG_DIRECTORY):
+# cached experiment data export artifacts, see vcweb.core.export
+EXPORT_DIRECTORY = config.get('exports', 'EXPORT_DIRECTORY', fallback='/shared/srv/exports')
+# seconds to retain export job status in redis
+EXPORT_JOB_TTL = 60 * 60 * 24 * 7
+# seconds before an export artifact is removed from EXPORT_DIRECTORY, see
+# vcweb.core.export.remove_expired_artifacts
+EXPORT_ARTIFACT_MAX_AGE = EXPORT_JOB_TTL
+# seconds an export worker's lease lasts without renewal before its claimed jobs are requeued, see
+# vcweb.redis_pubsub.WorkerHeartbeat
+EXPORT_WORKER_HEARTBEAT_TTL = 60
+# number of records per batch written to columnar (parquet) exports
+EXPORT_BATCH_SIZE = 10000
+
+for directory in (STATIC_ROOT, MEDIA_ROOT, LOG_DIRECTORY, EXPORT_DIRECTORY):
     if not is_accessible(directory):
         try:
             os.makedirs(directory)
@@ -3,6 +3,8 @@ from .base import *
 DEBUG = not ENVIRONMENT.is_production
 
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+# send email synchronously to the console instead of requiring a running mail_worker
+MAIL_QUEUE_ENABLED = False
 
 MIDDLEWARE = [
     'debug_toolbar.middleware.DebugToolbarMiddleware',
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+"""
+Load benchmark for the sockjs-redis push server.
+
+Opens a number of concurrent participant connections over the raw sockjs websocket transport, authenticates each of
+them with a throwaway token stored in redis and reports connect latency (websocket open until the "Real-time
+connection enabled" reply) and fan-out latency (redis PUBLISH on the experiment broadcast channel until receipt by
+every connected client).
+
+Run against a local sockjs-redis.py and redis, e.g.
+
+    python vcweb/sockjs-redis.py 8882 &
+    python vcweb/sockjs-redis-benchmark.py --connections 2000 --messages 50
+
+Raise the open file limit (ulimit -n) of both processes for more than ~1000 connections. The reference run for
+changes to the push server is 1000 and 2000 connections against a single worker and against --workers 4:
+
+    ulimit -n 8192
+    python vcweb/sockjs-redis.py 8882 --workers 4 &
+    python vcweb/sockjs-redis-benchmark.py --connections 1000 --messages 50
+    python vcweb/sockjs-redis-benchmark.py --connections 2000 --messages 50
+
+Record the connect and fan-out p50/p95 lines of each run, together with the redis version and host, below.
+
+Results
+-------
+
+None recorded yet: the benchmark needs a running redis and a Django environment able to start sockjs-redis.py.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import uuid
+
+from redis import asyncio as aioredis
+from tornado import websocket
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from vcweb.redis_pubsub import RedisPubSub
+
+
+def percentile(values, p):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(p / 100.0 * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def summarize(name, latencies):
+    milliseconds = [latency * 1000 for latency in latencies]
+    print("%-10s n=%-6d p50=%8.2fms p95=%8.2fms p99=%8.2fms max=%8.2fms" % (
+        name, len(milliseconds), percentile(milliseconds, 50), percentile(milliseconds, 95),
+        percentile(milliseconds, 99), max(milliseconds) if milliseconds else float('nan')))
+
+
+class BenchmarkClient(object):
+
+    def __init__(self, index, experiment_id, group_id, run_id):
+        self.email = 'sockjs-benchmark-{0}-{1}@mailinator.com'.format(run_id, index)
+        self.user_id = index
+        self.experiment_id = experiment_id
+        self.group_id = group_id
+        self.auth_token = uuid.uuid4().hex
+        self.connection = None
+        self.connect_latency = None
+        self.fanout_latencies = []
+
+    @property
+    def auth_key(self):
+        return "%s_%s" % (self.email, self.user_id)
+
+    async def connect(self, url):
+        start = time.perf_counter()
+        self.connection = await websocket.websocket_connect(url)
+        self.connection.write_message(json.dumps({
+            'event_type': 'connect',
+            'email': self.email,
+            'user_id': self.user_id,
+            'auth_token': self.auth_token,
+            'experiment_id': self.experiment_id,
+            'group_id': self.group_id,
+        }))
+        reply = json.loads(await self.connection.read_message())
+        if reply['message'] != 'Real-time connection enabled':
+            raise RuntimeError("%s failed to connect: %s" % (self.email, reply))
+        self.connect_latency = time.perf_counter() - start
+
+    async def receive(self, number_of_messages):
+        while len(self.fanout_latencies) < number_of_messages:
+            message = await self.connection.read_message()
+            if message is None:
+                return
+            received = time.time()
+            self.fanout_latencies.append(received - json.loads(message)['sent'])
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+
+
+async def run(options):
+    redis_client = aioredis.Redis(host=options.redis_host, port=options.redis_port, decode_responses=True)
+    run_id = uuid.uuid4().hex[:8]
+    clients = [BenchmarkClient(index, options.experiment_id, options.first_group_id + index // options.group_size,
+                               run_id)
+               for index in range(options.connections)]
+    pipe = redis_client.pipeline()
+    for client in clients:
+        pipe.set(client.auth_key, client.auth_token, ex=3600)
+    await pipe.execute()
+    url = 'ws://{0}:{1}{2}/participant/websocket'.format(options.host, options.port, options.uri)
+    semaphore = asyncio.Semaphore(options.concurrency)
+
+    async def connect(client):
+        async with semaphore:
+            await client.connect(url)
+
+    try:
+        start = time.perf_counter()
+        await asyncio.gather(*[connect(client) for client in clients])
+        print("connected %s clients in %.2fs" % (len(clients), time.perf_counter() - start))
+        summarize('connect', [client.connect_latency for client in clients])
+
+        receivers = asyncio.gather(*[client.receive(options.messages) for client in clients])
+        channel = RedisPubSub.get_participant_broadcast_channel(options.experiment_id)
+        for sequence_number in range(options.messages):
+            await redis_client.publish(channel, json.dumps({
+                'event_type': 'benchmark',
+                'sequence_number': sequence_number,
+                'sent': time.time(),
+            }))
+            await asyncio.sleep(options.interval)
+        try:
+            await asyncio.wait_for(receivers, timeout=options.timeout)
+        except asyncio.TimeoutError:
+            print("timed out waiting for fan-out messages")
+        latencies = [latency for client in clients for latency in client.fanout_latencies]
+        expected = len(clients) * options.messages
+        print("delivered %s/%s fan-out messages" % (len(latencies), expected))
+        summarize('fan-out', latencies)
+    finally:
+        for client in clients:
+            client.close()
+        await redis_client.delete(*[client.auth_key for client in clients])
+        await redis_client.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Connect and fan-out latency benchmark for sockjs-redis.py')
+    parser.add_argument('--host', default='localhost', help='sockjs server host')
+    parser.add_argument('--port', type=int, default=8882, help='sockjs server port')
+    parser.add_argument('--uri', default='/websocket', help='settings.WEBSOCKET_URI of the sockjs server')
+    parser.add_argument('--redis-host', default='localhost')
+    parser.add_argument('--redis-port', type=int, default=6379)
+    parser.add_argument('--connections', type=int, default=1000, help='number of concurrent participant connections')
+    parser.add_argument('--concurrency', type=int, default=200, help='maximum number of connections opened at once')
+    parser.add_argument('--group-size', type=int, default=5, help='participants per group')
+    parser.add_argument('--experiment-id', type=int, default=999999, help='experiment id to broadcast on')
+    parser.add_argument('--first-group-id', type=int, default=999999)
+    parser.add_argument('--messages', type=int, default=20, help='number of broadcast messages to publish')
+    parser.add_argument('--interval', type=float, default=0.1, help='seconds between published messages')
+    parser.add_argument('--timeout', type=float, default=30, help='seconds to wait for all fan-out messages')
+    options = parser.parse_args(argv)
+    asyncio.get_event_loop().run_until_complete(run(options))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,30 +1,48 @@
 #!/usr/bin/env python
+"""
+SockJS push server for participant and experimenter pages.
+
+Runs sockjs-tornado on top of the asyncio event loop (tornado >= 5) and never blocks it: authentication tokens are
+looked up with an asyncio redis client and every client connected to this process shares a single multiplexed redis
+pub/sub connection, see RedisChannelMultiplexer.
+
+With --workers N (or settings.WEBSOCKET_WORKERS) the server forks N worker processes that accept connections on the
+same port. Each worker holds a fixed set of pattern subscriptions and routes messages to its own connections, see
+PatternChannelMultiplexer. Per-worker connection and dispatch metrics are kept in redis and served as JSON from
+<WEBSOCKET_URI>/metrics on a separate port (settings.WEBSOCKET_METRICS_PORT) that only listens on localhost.
+"""
+import argparse
+import asyncio
 import json
 import logging
 import os
+import socket
 import sys
+import time
+from collections import defaultdict
 from itertools import chain
 from logging.config import dictConfig
 from os import path
 from sockjs.tornado import SockJSRouter, SockJSConnection
 
-from tornado import web, ioloop
-from tornadoredis import pubsub
+from redis import asyncio as aioredis
+from tornado import web, ioloop, httpserver, netutil, process
 from sentry_sdk.integrations.tornado import TornadoIntegration
 
 import django
 import sentry_sdk
-import tornadoredis
 
 # assumes containerized execution
 sys.path.append('/code')
-from vcweb.redis_pubsub import RedisPubSub
+from vcweb.redis_pubsub import LiveEventBuffer, RedisPubSub
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'vcweb.settings.prod')
 from django.conf import settings
 
 django.setup()
 
+from vcweb.core.models import ReadyStatusPublisher
+
 LOG_FILENAME = "sockjs-redis.log"
 TORNADO_LOG = path.join(settings.LOG_DIRECTORY, LOG_FILENAME)
 
@@ -68,8 +86,201 @@ dictConfig({
 
 logger = logging.getLogger('sockjs.vcweb')
 
-# Create the tornadoredis.Client instance and use it for redis channel subscriptions
-subscriber = pubsub.SockJSSubscriber(tornadoredis.Client())
+
+def add_sequence(message, channel, sequence):
+    """
+    adds the channel and replay buffer sequence id to a json event so that clients can ask for the events they missed
+    when they reconnect
+    """
+    if sequence is None:
+        return message
+    try:
+        event = json.loads(message)
+    except ValueError:
+        return message
+    if not isinstance(event, dict):
+        return message
+    event['channel'] = channel
+    event['sequence'] = sequence
+    return json.dumps(event)
+
+
+class RedisChannelMultiplexer(object):
+
+    """
+    Fans out messages published on redis channels to the sockjs connections subscribed to them over a single redis
+    pub/sub connection per process. Redis subscriptions are reference counted: a channel is subscribed when its
+    first local connection subscribes and unsubscribed when its last one closes.
+    """
+
+    CONTROL_CHANNEL = 'sockjs.control'
+    """ always subscribed so that the pub/sub connection is established before any client connects """
+
+    def __init__(self, redis_client, metrics):
+        self.redis_client = redis_client
+        self.metrics = metrics
+        self.pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+        self.subscribers = defaultdict(set)
+
+    async def start(self):
+        await self.pubsub.subscribe(self.CONTROL_CHANNEL)
+        ioloop.IOLoop.current().spawn_callback(self.listen)
+
+    async def listen(self):
+        while True:
+            try:
+                message = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # redis-py reconnects and resubscribes to all channels on the next read
+                logger.exception("error reading from redis pub/sub connection, retrying")
+                await asyncio.sleep(1)
+                continue
+            if message is not None:
+                self.dispatch(message['channel'], message['data'])
+
+    def dispatch(self, channel, data):
+        start = time.perf_counter()
+        connections = self.subscribers.get(channel)
+        if connections:
+            sequence, message = RedisPubSub.parse_message(data)
+            message = add_sequence(message, channel, sequence)
+            # connections still replaying missed events receive live events after the replay
+            live_connections = [c for c in connections if not c.hold_live_event(channel, sequence, message)]
+            if live_connections:
+                # sockjs-tornado serializes the message once for every connection
+                live_connections[0].broadcast(live_connections, message)
+            self.metrics.record_dispatch(len(connections), time.perf_counter() - start)
+        else:
+            self.metrics.record_dispatch(0, 0)
+
+    async def subscribe(self, channels, connection):
+        new_channels = []
+        for channel in channels:
+            if not self.subscribers[channel]:
+                new_channels.append(channel)
+            self.subscribers[channel].add(connection)
+        if new_channels:
+            await self.pubsub.subscribe(*new_channels)
+
+    async def unsubscribe(self, channels, connection):
+        stale_channels = []
+        for channel in channels:
+            connections = self.subscribers.get(channel)
+            if connections is None:
+                continue
+            connections.discard(connection)
+            if not connections:
+                del self.subscribers[channel]
+                stale_channels.append(channel)
+        if stale_channels:
+            await self.pubsub.unsubscribe(*stale_channels)
+
+
+class PatternChannelMultiplexer(RedisChannelMultiplexer):
+
+    """
+    Holds one pattern subscription per channel type instead of one subscription per channel, so the number of redis
+    subscriptions stays constant as clients connect. Every worker receives every message and drops the ones without
+    local subscribers.
+    """
+
+    async def start(self):
+        await self.pubsub.psubscribe(*RedisPubSub.get_channel_patterns())
+        ioloop.IOLoop.current().spawn_callback(self.listen)
+
+    async def subscribe(self, channels, connection):
+        for channel in channels:
+            self.subscribers[channel].add(connection)
+
+    async def unsubscribe(self, channels, connection):
+        for channel in channels:
+            connections = self.subscribers.get(channel)
+            if connections is not None:
+                connections.discard(connection)
+                if not connections:
+                    del self.subscribers[channel]
+
+
+class WorkerMetrics(object):
+
+    """
+    Connection and dispatch counters for this worker process, periodically written to a field of the
+    sockjs.metrics redis hash.
+    """
+
+    REDIS_KEY = 'sockjs.metrics'
+
+    def __init__(self, worker_id):
+        self.worker_id = '{0}:{1}:{2}'.format(socket.gethostname(), os.getpid(), worker_id)
+        self.started = time.time()
+        self.connections = 0
+        self.authenticated_connections = 0
+        self.messages = 0
+        self.undelivered_messages = 0
+        self.deliveries = 0
+        self.dispatch_seconds = 0.0
+
+    def record_dispatch(self, number_of_connections, elapsed_time):
+        self.messages += 1
+        if number_of_connections:
+            self.deliveries += number_of_connections
+            self.dispatch_seconds += elapsed_time
+        else:
+            self.undelivered_messages += 1
+
+    def to_dict(self, multiplexer):
+        return {
+            'worker': self.worker_id,
+            'started': self.started,
+            'updated': time.time(),
+            'connections': self.connections,
+            'authenticatedConnections': self.authenticated_connections,
+            'channels': len(multiplexer.subscribers),
+            'messages': self.messages,
+            'undeliveredMessages': self.undelivered_messages,
+            'deliveries': self.deliveries,
+            'dispatchSeconds': self.dispatch_seconds,
+        }
+
+    async def publish(self, redis_client, multiplexer):
+        try:
+            await redis_client.hset(self.REDIS_KEY, self.worker_id, json.dumps(self.to_dict(multiplexer)))
+        except Exception:
+            logger.exception("unable to publish sockjs worker metrics")
+
+    @staticmethod
+    async def load(redis_client, max_age):
+        """ returns the metrics of every worker that reported within max_age seconds and prunes the rest """
+        now = time.time()
+        workers = []
+        stale_workers = []
+        for worker_id, data in (await redis_client.hgetall(WorkerMetrics.REDIS_KEY)).items():
+            worker_metrics = json.loads(data)
+            if now - worker_metrics['updated'] > max_age:
+                stale_workers.append(worker_id)
+            else:
+                workers.append(worker_metrics)
+        if stale_workers:
+            await redis_client.hdel(WorkerMetrics.REDIS_KEY, *stale_workers)
+        return sorted(workers, key=lambda w: w['worker'])
+
+
+class MetricsHandler(web.RequestHandler):
+
+    async def get(self):
+        workers = await WorkerMetrics.load(redis_client, max_age=settings.WEBSOCKET_METRICS_INTERVAL * 3)
+        totals = {k: sum(w[k] for w in workers) for k in ('connections', 'authenticatedConnections', 'messages',
+                                                         'undeliveredMessages', 'deliveries')}
+        self.write({'workers': workers, 'totals': totals})
+
+
+# asyncio redis client used for auth token lookups and the shared pub/sub connection, worker metrics and the
+# multiplexer, created in main after forking worker processes
+redis_client = None
+metrics = None
+multiplexer = None
 
 
 class RedisSockJSConnection(SockJSConnection):
@@ -83,8 +294,13 @@ class RedisSockJSConnection(SockJSConnection):
     with Redis) dispatches the json messages as they were received to connected clients.
     """
 
+    subscribed = False
+    # LiveEventBuffer holding live events while missed events are replayed
+    live_event_buffer = None
+
     def on_open(self, request):
         logger.debug("opening connection for %s", request)
+        metrics.connections += 1
 
     def _send_message(self, message, event_type):
         self.send(json.dumps({'message': message, 'event_type': event_type}))
@@ -98,34 +314,102 @@ class RedisSockJSConnection(SockJSConnection):
     def is_connection_event(self, message_dict):
         return message_dict['event_type'] == 'connect'
 
-    def is_valid(self, auth_token):
-        return self.get_auth_token() == auth_token
+    async def is_valid(self, auth_token):
+        return auth_token is not None and await self.get_auth_token() == auth_token
 
-    def get_auth_token(self):
+    async def get_auth_token(self):
         key = "%s_%s" % (self.email, self.user_id)
-        return RedisPubSub.get_redis_instance().get(key)
+        return await redis_client.get(key)
 
     def on_message(self, message):
         if not message:
-            logger.warn("Received empty message")
+            logger.warning("Received empty message")
             return
         message_dict = json.loads(message)
         self.email = message_dict['email']
         self.user_id = message_dict['user_id']
         logger.debug("message: %s", message_dict)
+        ioloop.IOLoop.current().spawn_callback(self.connect, message_dict)
+
+    async def connect(self, message_dict):
         auth_token = message_dict.get('auth_token')
-        if self.is_connection_event(message_dict) and self.is_valid(auth_token):
+        if self.is_connection_event(message_dict) and await self.is_valid(auth_token):
+            if self.is_closed or self.subscribed:
+                return
             self.initialize(message_dict)
-            subscriber.subscribe(self.redis_channels, self)
+            self.subscribed = True
+            metrics.authenticated_connections += 1
+            # subscribe before replaying so that no event falls in between, live events are held back until the
+            # missed events have been sent
+            self.live_event_buffer = LiveEventBuffer()
+            await multiplexer.subscribe(self.redis_channels, self)
             self.info("Real-time connection enabled")
+            try:
+                await self.replay(message_dict.get('last_sequences'))
+            finally:
+                self.release_live_events()
         else:
             self.info("Failed to authenticate with the real-time server. Please try signing out and signing back in.")
-            logger.debug("Failed to connect due to auth_token mismatch. Found (%s) expected (%s)",
-                         auth_token, self.get_auth_token())
+            logger.debug("Failed to connect due to auth_token mismatch for %s_%s (%s)",
+                         self.email, self.user_id, auth_token)
+
+    def hold_live_event(self, channel, sequence, message):
+        """ returns True if the given live event was held back because missed events are still being replayed """
+        if self.live_event_buffer is None:
+            return False
+        self.live_event_buffer.hold(channel, sequence, message)
+        return True
+
+    def release_live_events(self):
+        live_event_buffer = self.live_event_buffer
+        self.live_event_buffer = None
+        if live_event_buffer is None or self.is_closed:
+            return
+        for channel, sequence, message in live_event_buffer.release():
+            self.send(message)
+
+    async def replay(self, last_sequences):
+        """
+        Sends the events published on this connection's channels after the last sequence ids the client saw. Live
+        events received in the meantime are held back and sent afterwards, minus the ones that were part of the
+        replay. If events newer than the client's last seen event were trimmed from a channel's replay buffer or
+        expired with it, sends an update event instead so that the client reloads its view model.
+        """
+        if not isinstance(last_sequences, dict):
+            return
+        for channel in self.redis_channels:
+            last_sequence = last_sequences.get(channel)
+            if not last_sequence:
+                continue
+            try:
+                next_sequence = RedisPubSub.get_next_sequence(str(last_sequence))
+            except ValueError:
+                logger.warning("invalid last sequence %s for channel %s", last_sequence, channel)
+                continue
+            key = RedisPubSub.get_replay_key(channel)
+            pipe = redis_client.pipeline()
+            pipe.hmget(RedisPubSub.get_replay_sequence_key(channel), 'published', 'trimmed')
+            pipe.exists(key)
+            pipe.xrange(key, min=next_sequence)
+            (published_sequence, trimmed_sequence), replay_buffer_exists, missed_events = await pipe.execute()
+            if self.is_closed:
+                return
+            if RedisPubSub.is_replay_incomplete(str(last_sequence), published_sequence, trimmed_sequence,
+                                                replay_buffer_exists):
+                logger.debug("events after %s on %s are no longer in the replay buffer, requesting update",
+                             last_sequence, channel)
+                self._send_message('', 'update')
+                return
+            for sequence, fields in missed_events:
+                self.send(add_sequence(fields['data'], channel, sequence))
+                self.live_event_buffer.replayed(channel, sequence)
 
     def on_close(self):
-        for channel in self.redis_channels:
-            subscriber.unsubscribe(channel, self)
+        metrics.connections -= 1
+        if self.subscribed:
+            self.subscribed = False
+            metrics.authenticated_connections -= 1
+            ioloop.IOLoop.current().spawn_callback(multiplexer.unsubscribe, self.redis_channels, self)
 
 
 # sockjs-tornado creates a new instance for every connected client.
@@ -158,22 +442,56 @@ class ExperimenterConnection(RedisSockJSConnection):
 
 
 def main(argv=None):
-    if argv is None:
-        argv = sys.argv
-    # currently only allow one command-line argument, the port to run on.
+    global redis_client, metrics, multiplexer
+    parser = argparse.ArgumentParser(description='sockjs push server for vcweb participants and experimenters')
+    parser.add_argument('port', nargs='?', type=int, default=settings.WEBSOCKET_PORT)
+    parser.add_argument('--workers', type=int, default=settings.WEBSOCKET_WORKERS,
+                        help='number of worker processes sharing the port, 0 to fork one per cpu')
+    parser.add_argument('--pattern-subscriptions', dest='pattern_subscriptions', action='store_true', default=False,
+                        help='use pattern subscriptions even with a single worker')
+    parser.add_argument('--metrics-port', dest='metrics_port', type=int, default=settings.WEBSOCKET_METRICS_PORT,
+                        help='localhost-only port serving worker metrics, 0 to disable')
+    options = parser.parse_args(sys.argv[1:] if argv is None else argv[1:])
     logging.getLogger().setLevel(logging.DEBUG)
-    port = int(argv[1]) if (len(argv) > 1) else settings.WEBSOCKET_PORT
+    sockets = netutil.bind_sockets(options.port)
+    metrics_sockets = []
+    if options.metrics_port:
+        # metrics are not authenticated, keep them off the public websocket port
+        metrics_sockets = netutil.bind_sockets(options.metrics_port, address='127.0.0.1')
+    worker_id = 0
+    if options.workers != 1:
+        # each forked worker runs its own event loop, redis connections and sockjs routers
+        worker_id = process.fork_processes(options.workers)
+    redis_client = aioredis.Redis(host=settings.REDIS_HOST, decode_responses=True)
+    metrics = WorkerMetrics(worker_id)
+    if options.workers != 1 or options.pattern_subscriptions:
+        multiplexer = PatternChannelMultiplexer(redis_client, metrics)
+    else:
+        multiplexer = RedisChannelMultiplexer(redis_client, metrics)
     ParticipantRouter = SockJSRouter(ParticipantConnection, '%s/participant' % settings.WEBSOCKET_URI)
     ExperimenterRouter = SockJSRouter(ExperimenterConnection, '%s/experimenter' % settings.WEBSOCKET_URI)
     urls = list(chain.from_iterable([ParticipantRouter.urls, ExperimenterRouter.urls]))
     app = web.Application(urls)
-    logger.info("starting sockjs server on port %s", port)
-    app.listen(port)
     if getattr(settings, 'SENTRY_DSN', None):
         sentry_sdk.init(dsn=settings.SENTRY_DSN,
                 integrations=[TornadoIntegration()]
                 )
-    ioloop.IOLoop.instance().start()
+    io_loop = ioloop.IOLoop.current()
+    io_loop.run_sync(multiplexer.start)
+    ioloop.PeriodicCallback(lambda: io_loop.spawn_callback(metrics.publish, redis_client, multiplexer),
+                            settings.WEBSOCKET_METRICS_INTERVAL * 1000).start()
+    if settings.READY_STATUS_INTERVAL > 0:
+        # send trailing participant ready events deferred by web requests, see ReadyStatusPublisher
+        ioloop.PeriodicCallback(lambda: io_loop.run_in_executor(None, ReadyStatusPublisher.flush_due),
+                                settings.READY_STATUS_INTERVAL * 1000 / 2).start()
+    logger.info("starting sockjs worker %s (%s) on port %s", worker_id, type(multiplexer).__name__, options.port)
+    server = httpserver.HTTPServer(app)
+    server.add_sockets(sockets)
+    if metrics_sockets:
+        metrics_server = httpserver.HTTPServer(web.Application([(r'%s/metrics' % settings.WEBSOCKET_URI,
+                                                                 MetricsHandler)]))
+        metrics_server.add_sockets(metrics_sockets)
+    io_loop.start()
 
 
 if __name__ == '__main__':